@@ -0,0 +1,91 @@
+# 型ごとの SPL 行の引当時間と、型の数ごとの出荷計画の適用時間を計測する
+# 実行: python -m benchmarks.bench_allocate
+import gc
+import tempfile
+import tracemalloc
+from datetime import date
+from time import perf_counter
+from typing import Callable, Tuple
+
+from benchmarks.bench_order import ORDERS_PER_KATA, ROWS_PER_ORDER, make_rows
+from shipping_instruction.config import AnsweredOrderFileColumnConfig
+from shipping_instruction.order import OrderFile, OrderFiles
+from shipping_instruction.pms import PMSPartition
+from tests.fixtures import (allocation_case, legacy_spl_rows_to_order,
+                            partition, write_order_xls)
+
+ORDER_COUNTS = [100, 1_000, 5_000]
+KATA_COUNTS = [200, 1_000, 5_000]
+SPL_ROWS_PER_ORDER = 0.5
+REPEAT = 3
+
+
+def bench(allocate: Callable, orderCount: int) -> float:
+    make = allocation_case(0,
+                           orderCount=orderCount,
+                           splRowCount=int(orderCount * SPL_ROWS_PER_ORDER))
+    best = float("inf")
+    for _ in range(REPEAT):
+        (orders, spl_rows) = make()
+        start = perf_counter()
+        allocate(splRows=spl_rows, orders=orders)
+        best = min(best, perf_counter() - start)
+    return best
+
+
+def bench_plan(kataCount: int) -> Tuple[float, float, int]:
+    with tempfile.TemporaryDirectory() as dir:
+        config = AnsweredOrderFileColumnConfig()
+        size = kataCount * ORDERS_PER_KATA * ROWS_PER_ORDER
+        path = write_order_xls(dir, make_rows(size), config)
+
+        def load() -> Tuple[OrderFile, PMSPartition]:
+            order_file = OrderFile(isNew=False, path=path, config=config)
+            plan = partition(date(2020, 10, 1), "N05",
+                             [(kata, f"{kata}-H", 1) for kata in order_file.katas])
+            return (order_file, plan)
+
+        secs = []
+        for columnar in [False, True]:
+            best = float("inf")
+            for _ in range(REPEAT):
+                (order_file, plan) = load()
+                start = perf_counter()
+                OrderFiles(files=[order_file]).apply_shipping_plan(
+                    partitions=[plan], columnar=columnar)
+                best = min(best, perf_counter() - start)
+            secs.append(best)
+
+        # 受注ファイルの読み込みは含めず、計画で増えたメモリだけを測る
+        (order_file, plan) = load()
+        gc.collect()
+        tracemalloc.start()
+        order_files = OrderFiles(files=[order_file])
+        order_files.apply_shipping_plan(partitions=[plan])
+        gc.collect()
+        (kept, _) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return (secs[0], secs[1], kept)
+
+
+def main():
+    allocate = OrderFiles._OrderFiles__spl_rows_to_order  # type: ignore
+    print("SPL 行の引当 (1 型)")
+    print(f"{'orders':>8} {'spl rows':>9} {'legacy sec':>11} {'sec':>8}")
+    for order_count in ORDER_COUNTS:
+        legacy = bench(legacy_spl_rows_to_order, order_count)
+        current = bench(allocate, order_count)
+        print(f"{order_count:>8} {int(order_count * SPL_ROWS_PER_ORDER):>9} "
+              f"{legacy:>11.3f} {current:>8.4f}")
+
+    print("")
+    print("出荷計画の適用")
+    print(f"{'katas':>8} {'sec':>8} {'columnar':>9} {'kept MB':>8}")
+    for kata_count in KATA_COUNTS:
+        (sec, columnar_sec, kept) = bench_plan(kata_count)
+        print(f"{kata_count:>8} {sec:>8.3f} {columnar_sec:>9.3f} "
+              f"{kept / 2**20:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# OrderFile の読み込み時間を行数ごとに計測する
+# 実行: python -m benchmarks.bench_order
+import gc
+import tempfile
+import tracemalloc
+from pathlib import Path
+from time import perf_counter
+from typing import List, Tuple
+
+from shipping_instruction.cache import SnapshotCache
+from shipping_instruction.config import AnsweredOrderFileColumnConfig
+from shipping_instruction.order import OrderFile
+from tests.fixtures import answered_row, write_order_xls
+
+SIZES = [1_000, 5_000, 20_000]
+ROWS_PER_ORDER = 2
+ORDERS_PER_KATA = 5
+REPEAT = 3
+
+
+def make_rows(size: int) -> List[dict]:
+    rows: List[dict] = []
+    for i in range(size):
+        order_id = i // ROWS_PER_ORDER
+        kata = f"K{order_id // ORDERS_PER_KATA:05d}"
+        rows.append(answered_row(order_id + 1, kata, 10, 5,
+                                 released=i % ROWS_PER_ORDER == 0))
+    return rows
+
+
+def bench_load(size: int) -> Tuple[float, int, int]:
+    with tempfile.TemporaryDirectory() as dir:
+        path = write_order_xls(dir, make_rows(size),
+                               AnsweredOrderFileColumnConfig())
+        best = float("inf")
+        for _ in range(REPEAT):
+            start = perf_counter()
+            OrderFile(isNew=False, path=path,
+                      config=AnsweredOrderFileColumnConfig())
+            best = min(best, perf_counter() - start)
+
+        tracemalloc.start()
+        order_file = OrderFile(isNew=False, path=path,
+                               config=AnsweredOrderFileColumnConfig())
+        # xlrd の Book は循環参照を持つので、解放されたかは gc の後で測る
+        gc.collect()
+        (retained, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del order_file
+        return (best, peak, retained)
+
+
+def bench_cached_load(size: int) -> Tuple[float, float]:
+    with tempfile.TemporaryDirectory() as dir:
+        path = write_order_xls(dir, make_rows(size),
+                               AnsweredOrderFileColumnConfig())
+        cache = SnapshotCache(str(Path(dir).joinpath("cache")))
+
+        start = perf_counter()
+        OrderFile(isNew=False, path=path,
+                  config=AnsweredOrderFileColumnConfig(), cache=cache)
+        miss = perf_counter() - start
+
+        start = perf_counter()
+        OrderFile(isNew=False, path=path,
+                  config=AnsweredOrderFileColumnConfig(), cache=cache)
+        hit = perf_counter() - start
+        return (miss, hit)
+
+
+def bench_incremental_load(size: int, changed: float) -> Tuple[float, float]:
+    # 前回の実行のあと、changed の割合のオーダだけ更新された日を再現する
+    with tempfile.TemporaryDirectory() as dir:
+        config = AnsweredOrderFileColumnConfig()
+        cache = SnapshotCache(str(Path(dir).joinpath("cache")))
+        rows = make_rows(size)
+        path = write_order_xls(dir, rows, config)
+        OrderFile(isNew=False, path=path, config=config,
+                  cache=cache, incrementalKey="answered")
+
+        cache_dir = Path(dir).joinpath("cache")
+        base = cache_dir.joinpath("answered.pickle").read_bytes()
+
+        step = max(1, int(1 / changed))
+        for i in range(0, size, step * ROWS_PER_ORDER):
+            rows[i] = dict(rows[i], JUTYUU_RECORD_KOUSHIN_BI=44106.5)
+        path = write_order_xls(dir, rows, config)
+
+        # どちらも内容のハッシュでは当たらない状態から測る
+        full = incremental = float("inf")
+        for i in range(REPEAT):
+            start = perf_counter()
+            OrderFile(isNew=False, path=path, config=config,
+                      cache=SnapshotCache(str(Path(dir).joinpath(f"full{i}"))))
+            full = min(full, perf_counter() - start)
+
+            # 前回の実行の直後の状態に戻す
+            for content in cache_dir.iterdir():
+                content.unlink()
+            cache_dir.joinpath("answered.pickle").write_bytes(base)
+            start = perf_counter()
+            OrderFile(isNew=False, path=path, config=config,
+                      cache=cache, incrementalKey="answered")
+            incremental = min(incremental, perf_counter() - start)
+        return (full, incremental)
+
+
+def main():
+    print("OrderFile 読み込み")
+    print(f"{'rows':>8} {'orders':>7} {'sec':>8} {'us/row':>8} "
+          f"{'peak MB':>8} {'kept MB':>8}")
+    for size in SIZES:
+        (sec, peak, retained) = bench_load(size)
+        print(f"{size:>8} {size // ROWS_PER_ORDER:>7} "
+              f"{sec:>8.3f} {sec / size * 1e6:>8.2f} "
+              f"{peak / 2**20:>8.1f} {retained / 2**20:>8.1f}")
+
+
+    print("")
+    print("OrderFile 読み込み (キャッシュ)")
+    print(f"{'rows':>8} {'miss sec':>9} {'hit sec':>8}")
+    for size in SIZES:
+        (miss, hit) = bench_cached_load(size)
+        print(f"{size:>8} {miss:>9.3f} {hit:>8.3f}")
+
+    print("")
+    print("OrderFile 差分読み込み (5% のオーダが更新)")
+    print(f"{'rows':>8} {'full sec':>9} {'incr sec':>9}")
+    for size in SIZES:
+        (full, incremental) = bench_incremental_load(size, 0.05)
+        print(f"{size:>8} {full:>9.3f} {incremental:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# 納期回答アップロードファイルの出力時間を行数ごとに計測する
+# 実行: python -m benchmarks.bench_output
+import tempfile
+from datetime import date
+from pathlib import Path
+from time import perf_counter
+from typing import Tuple
+
+from benchmarks.bench_order import make_rows
+from shipping_instruction.config import AnsweredOrderFileColumnConfig
+from shipping_instruction.order import OrderFile, OrderFiles
+from tests.fixtures import partition, write_order_xls
+
+# 出力は 1 シートに収まる (xls は 65536 行まで) 約 5 万行まで
+SIZES = [5_000, 20_000, 33_000]
+REPEAT = 3
+
+
+def bench_output(size: int) -> Tuple[float, int]:
+    with tempfile.TemporaryDirectory() as dir:
+        config = AnsweredOrderFileColumnConfig()
+        order_file = OrderFile(isNew=False,
+                               path=write_order_xls(dir, make_rows(size), config),
+                               config=config)
+
+        # すべてのオーダに出荷が付くよう、型ごとのリリース数量をそのまま出荷する
+        plan = partition(date(2020, 10, 1), "N05",
+                         [(kata, f"{kata}-H", released_qty)
+                          for kata, released_qty
+                          in order_file.releasedQtyOfKata.items()])
+        OrderFiles(files=[order_file]).apply_shipping_plan(partitions=[plan])
+
+        output = str(Path(dir).joinpath("upload.xls"))
+        best = float("inf")
+        for _ in range(REPEAT):
+            start = perf_counter()
+            order_file.output_upload_file(output=output)
+            best = min(best, perf_counter() - start)
+
+        rows = sum(len(order.originalRows) + len(order.splRows)
+                   for order in order_file.ordersHasNotTBDSPLRow)
+        return (best, rows)
+
+
+def main():
+    print("納期回答アップロードファイルの出力")
+    print(f"{'order rows':>11} {'out rows':>9} {'sec':>8} {'us/row':>8}")
+    for size in SIZES:
+        (sec, rows) = bench_output(size)
+        print(f"{size:>11} {rows:>9} {sec:>8.3f} {sec / rows * 1e6:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
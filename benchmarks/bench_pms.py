@@ -0,0 +1,52 @@
+# PMSFile の読み込み時間を行数ごとに計測する
+# 実行: python -m benchmarks.bench_pms
+import tempfile
+import tracemalloc
+from time import perf_counter
+from typing import List, Tuple
+
+from shipping_instruction.config import PMSFileColumnsConfig
+from shipping_instruction.pms import PMSFile
+from tests.fixtures import write_pms_csv
+
+SIZES = [1_000, 10_000, 100_000]
+ROWS_PER_KATA = 10
+REPEAT = 3
+# 実際の PMS ファイルには使わない列も多い
+COLUMNS = 40
+FILLER = "出荷予定品名"
+
+
+def make_rows(size: int) -> List[dict]:
+    return [{"kata": f"K{i // ROWS_PER_KATA:06d}",
+             "hin": f"H{i % 3}",
+             "qty": 1 + i % 5} for i in range(size)]
+
+
+def bench(size: int, useMmap: bool) -> Tuple[float, int]:
+    with tempfile.TemporaryDirectory() as dir:
+        write_pms_csv(dir, make_rows(size), columns=COLUMNS, filler=FILLER)
+        best = float("inf")
+        for _ in range(REPEAT):
+            start = perf_counter()
+            PMSFile(path=dir, config=PMSFileColumnsConfig(), useMmap=useMmap)
+            best = min(best, perf_counter() - start)
+
+        tracemalloc.start()
+        PMSFile(path=dir, config=PMSFileColumnsConfig(), useMmap=useMmap)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return (best, peak)
+
+
+def main():
+    print(f"{'mode':>5} {'rows':>8} {'katas':>7} {'sec':>8} {'us/row':>8} {'peak MB':>8}")
+    for size in SIZES:
+        for (mode, use_mmap) in (("csv", False), ("mmap", True)):
+            (sec, peak) = bench(size, use_mmap)
+            print(f"{mode:>5} {size:>8} {size // ROWS_PER_KATA:>7} "
+                  f"{sec:>8.3f} {sec / size * 1e6:>8.2f} {peak / 2**20:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+from array import array
+from typing import NamedTuple, Sequence
+
+
+class Allocation(NamedTuple):
+    # 引当の結果。i 番目の切れ目は注文 orderIndexes[i] に
+    # SPL 行 splIndexes[i] から qtys[i] だけ入る
+    # ひとつの注文の切れ目は、この並びのとおりに付ける
+    orderIndexes: array
+    splIndexes: array
+    qtys: array
+
+
+def allocate(orderKatas: Sequence[int],
+             orderQtys: Sequence[int],
+             splKatas: Sequence[int],
+             splQtys: Sequence[int]) -> Allocation:
+    # 全部の型の注文と SPL 行を、前から一度ずつだけ見てまとめて引き当てる
+    # orderKatas/splKatas は型の番号で、同じ型の行は続けて番号の昇順に並べる
+    # 型ごとの数量の合計は、注文と SPL 行で同じ (出荷計画では TBD 行で埋める)
+    # 切れ目は配列に書き出すだけで、行のオブジェクトは呼び出し側が作る
+    order_indexes = array("l")
+    spl_indexes = array("l")
+    qtys = array("q")
+    add_order_index = order_indexes.append
+    add_spl_index = spl_indexes.append
+    add_qty = qtys.append
+
+    spl_count = len(splQtys)
+    # 引き当て中の SPL 行と、その未引当数
+    spl_index = -1
+    spl_left = 0
+    next_spl_index = 0
+    for order_index, (kata, order_left) in enumerate(zip(orderKatas, orderQtys)):
+        # 数量 0 の注文は引当に関わらない
+        if order_left == 0:
+            continue
+
+        if spl_left and splKatas[spl_index] != kata:
+            raise Exception("Shipment Quantity Not Equal Released Quantity")
+
+        while True:
+            if spl_left == 0:
+                # 前の型の SPL 行は、全部引き当たっているはず
+                while next_spl_index < spl_count and splKatas[next_spl_index] < kata:
+                    if splQtys[next_spl_index]:
+                        raise Exception(
+                            "Shipment Quantity Not Equal Released Quantity")
+                    next_spl_index += 1
+
+                # 同じ型の、数量のある次の SPL 行へ進む
+                while next_spl_index < spl_count \
+                        and splKatas[next_spl_index] == kata \
+                        and splQtys[next_spl_index] == 0:
+                    next_spl_index += 1
+
+                if next_spl_index == spl_count or splKatas[next_spl_index] != kata:
+                    if order_left:
+                        raise Exception(
+                            "Shipment Quantity Not Equal Released Quantity")
+                    break
+
+                spl_index = next_spl_index
+                spl_left = splQtys[spl_index]
+                next_spl_index += 1
+
+            add_order_index(order_index)
+            add_spl_index(spl_index)
+            if order_left >= spl_left:
+                # SPL 行の残りが全部この注文に入る
+                add_qty(spl_left)
+                order_left -= spl_left
+                spl_left = 0
+            else:
+                # SPL 行が注文をまたぐ
+                # (注残がちょうど埋まった注文にも、同じ型の次の SPL 行から数量 0 の行が入る)
+                add_qty(order_left)
+                spl_left -= order_left
+                break
+
+    if spl_left or any(splQtys[next_spl_index:]):
+        raise Exception("Shipment Quantity Not Equal Released Quantity")
+
+    return Allocation(orderIndexes=order_indexes,
+                      splIndexes=spl_indexes,
+                      qtys=qtys)
@@ -1,98 +1,246 @@
-from datetime import datetime
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import date, datetime
 from pathlib import Path
-from time import sleep
-from typing import List, Optional
+from time import perf_counter
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 # geckodriver, Selenium, Firefox のバージョン対応は下記をチェック
 # https://firefox-source-docs.mozilla.org/testing/geckodriver/Support.html
 from selenium import webdriver
 from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
+from selenium.webdriver.remote.webelement import WebElement
 from selenium.webdriver.firefox.webdriver import WebDriver
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 
-from shipping_instruction.config import DirConfig, DriverConfig, MRPCConfig
-from shipping_instruction.order import Order, OrderFiles
+from shipping_instruction.config import (DirConfig, DriverConfig, MRPCConfig,
+                                         WaitConfig)
+from shipping_instruction.download import DownloadTracker
+from shipping_instruction.journal import RegistrationJournal
+from shipping_instruction.order import Order, OrderFiles, SPLRow
 from shipping_instruction.pms import PMSFile
 from shipping_instruction.user import User
-from shipping_instruction.util import _get_first_file_in_dir, _init_dir
+from shipping_instruction.util import _init_dir
 
 __SPEC = "32268"
 
 
-class __DownloadCompleted():
-    __DOWNLOAD_WAIT = 5
+class __ValueIs():
+    # 入力欄の値が画面に反映されたら、その入力欄を返す
 
-    def __init__(self, dir: str):
-        sleep(self.__DOWNLOAD_WAIT)
-        self.dir = dir
+    def __init__(self, locator: Tuple[str, str], value: str):
+        self.locator = locator
+        self.value = value
 
-    def __call__(self, driver: WebDriver) -> Optional[WebDriver]:
-        p = Path(self.dir)
-        if not p.is_dir():
-            return None
+    def __call__(self, driver: WebDriver) -> Optional[WebElement]:
+        element = driver.find_element(*self.locator)
+        return element if element.get_attribute("value") == self.value else None
 
-        counter = 0
-        for content in p.iterdir():
-            counter += 1
-            if content.suffix == ".part":
-                return None
 
-        return driver if counter >= 1 else None
+class WaitTimer:
+    # もともと固定の sleep で待っていたところで、条件を待った時間を測る
 
+    def __init__(self):
+        self.fixedSeconds = 0.0
+        self.waitedSeconds = 0.0
 
-def __save_error_screenshot(driver: WebDriver, dir: str):
-    file_dir = _init_dir(dir, False)
-    if file_dir is None:
-        raise Exception("Error Screenshot Dir Not Found")
+    @property
+    def savedSeconds(self) -> float:
+        return self.fixedSeconds - self.waitedSeconds
 
-    dir_p = Path(file_dir)
-    file_name = f'{datetime.now().strftime("%Y%m%d_%H%M%S")}.png'
-    file_p = dir_p.joinpath(file_name)
-    if not file_p.is_file():
-        raise Exception("Screenshot Save Fail")
+    @contextmanager
+    def measure(self, fixedSeconds: float) -> Iterator[None]:
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.waitedSeconds += perf_counter() - start
+            self.fixedSeconds += fixedSeconds
+
+    def until(self, wait: WebDriverWait, condition: Any, fixedSeconds: float) -> Any:
+        with self.measure(fixedSeconds):
+            return wait.until(condition)
+
+    def add(self, other: "WaitTimer"):
+        self.fixedSeconds += other.fixedSeconds
+        self.waitedSeconds += other.waitedSeconds
+
+
+@dataclass
+class ShippingInstructionResult:
+    # 登録した順に (オーダ, SPL 行, その行の出荷指示書の PDF のパス)
+    registeredRows: List[Tuple[Order, SPLRow, str]] = field(default_factory=list)
+    # registeredRows のうち、前の実行で登録済みだったので飛ばした行の数
+    resumedRowCount: int = 0
+    timer: WaitTimer = field(default_factory=WaitTimer)
+
+
+class BrowserSession:
+    # ログインしたブラウザをひとつだけ立ち上げ、各段階で使いまわす
+    # 段階ごとに変わるのはダウンロード先だけなので、
+    # 起動中のブラウザの設定を書き換えて、メニューのページから始め直す
+
+    # 起動中の Firefox の設定を書き換える (chrome コンテキストで実行する)
+    __SET_PREFERENCE = """
+        const preference = arguments[0];
+        for (const [key, value] of Object.entries(preference)) {
+            if (typeof value === "boolean") {
+                Services.prefs.setBoolPref(key, value);
+            } else if (typeof value === "number") {
+                Services.prefs.setIntPref(key, value);
+            } else {
+                Services.prefs.setStringPref(key, value);
+            }
+        }
+    """
+
+    def __init__(self,
+                 driverConfig: DriverConfig,
+                 user: User,
+                 waitConfig: WaitConfig = WaitConfig()):
+        self.driverConfig = driverConfig
+        self.user = user
+        self.waitConfig = waitConfig
+        self.driver: Optional[WebDriver] = None
+
+        # 起動とログインにかかった秒数と、各段階に貸した回数
+        self.launchSeconds = 0.0
+        self.borrowCount = 0
+
+    def __enter__(self) -> "BrowserSession":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def savedLaunchCount(self) -> int:
+        # 段階ごとに立ち上げていれば、貸した回数だけ起動とログインをしていた
+        return max(self.borrowCount - 1, 0)
+
+    @property
+    def savedSeconds(self) -> float:
+        return self.launchSeconds * self.savedLaunchCount
+
+    def open(self) -> WebDriver:
+        if self.driver is not None:
+            return self.driver
+
+        start = perf_counter()
+
+        C = self.driverConfig
+        fp = webdriver.FirefoxProfile(profile_directory=C.profile)
+        for key, value in C.preference.items():
+            fp.set_preference(key, value)
+
+        # ファイルをダウンロードする場合、
+        # firefox が立ちあがる前に削除しないといけない
+        # (あとの段階でダウンロードするかもしれないので、いつも削除する)
+        if not C.delete_handler_files(fp.tempfolder):
+            raise Exception("FireFox Profile Temp Folder Error")
+
+        driver = webdriver.Firefox(
+            firefox_profile=fp,
+            firefox_binary=C.firefox,
+            executable_path=C.geckodriver,
+            service_log_path=C.log,
+        )
+        try:
+            self.__login(driver)
+        except Exception:
+            driver.quit()
+            raise
 
-    driver.save_screenshot(str(file_p))
+        self.driver = driver
+        self.launchSeconds = perf_counter() - start
+        return driver
 
+    def borrow(self, driverConfig: DriverConfig) -> WebDriver:
+        # ログイン後のページを開いたブラウザを、段階のダウンロード先に切り替えて貸す
+        driver = self.open()
 
-def download_order(isNew: bool,
-                   driverConfig: DriverConfig,
-                   mrpCConfig: MRPCConfig,
-                   user: User) -> Optional[str]:
+        if driverConfig is not self.driverConfig and len(driverConfig.preference) > 0:
+            with driver.context(driver.CONTEXT_CHROME):
+                driver.execute_script(self.__SET_PREFERENCE,
+                                      driverConfig.preference)
 
-    fp = webdriver.FirefoxProfile(profile_directory=driverConfig.profile)
-    for key, value in driverConfig.preference.items():
-        fp.set_preference(key, value)
+        # ログインした直後でなければ、前の段階のページからメニューのページに戻る
+        if self.borrowCount > 0:
+            driver.switch_to.default_content()
+            driver.get(self.user.URL)
 
-    # ファイルをダウンロードする場合、
-    # firefox が立ちあがる前に削除しないといけない
-    if not driverConfig.delete_handler_files(fp.tempfolder):
-        raise Exception("FireFox Profile Temp Folder Error")
+        self.borrowCount += 1
+        return driver
 
-    with webdriver.Firefox(
-        firefox_profile=fp,
-        firefox_binary=driverConfig.firefox,
-        executable_path=driverConfig.geckodriver,
-        service_log_path=driverConfig.log
-    ) as driver:
+    def close(self):
+        if self.driver is None:
+            return
 
-        wait = WebDriverWait(driver, 10)
+        self.driver.quit()
+        self.driver = None
 
-        driver.get(user.URL)
+    def __login(self, driver: WebDriver):
+        wait = WebDriverWait(driver,
+                             self.waitConfig.TIMEOUT,
+                             poll_frequency=self.waitConfig.POLL_FREQUENCY)
+
+        driver.get(self.user.URL)
 
         wait.until(
             EC.presence_of_element_located((By.NAME, "sei_login"))
-        ).send_keys(user.SSO_ID)
+        ).send_keys(self.user.SSO_ID)
 
         wait.until(
             EC.presence_of_element_located((By.NAME, "sei_passwd"))
-        ).send_keys(user.SSO_PASSWORD)
+        ).send_keys(self.user.SSO_PASSWORD)
 
         wait.until(
             EC.presence_of_element_located((By.NAME, "login"))
         ).submit()
 
+
+@contextmanager
+def __borrow(session: Optional[BrowserSession],
+             driverConfig: DriverConfig,
+             user: User) -> Iterator[WebDriver]:
+    # セッションを渡されなければ、今までどおりこの段階だけのためにブラウザを立ち上げる
+    if session is not None:
+        yield session.borrow(driverConfig)
+        return
+
+    with BrowserSession(driverConfig, user) as own_session:
+        yield own_session.borrow(driverConfig)
+
+
+def __save_error_screenshot(driver: WebDriver, dir: str):
+    file_dir = _init_dir(dir, False)
+    if file_dir is None:
+        raise Exception("Error Screenshot Dir Not Found")
+
+    dir_p = Path(file_dir)
+    file_name = f'{datetime.now().strftime("%Y%m%d_%H%M%S")}.png'
+    file_p = dir_p.joinpath(file_name)
+
+    driver.save_screenshot(str(file_p))
+    if not file_p.is_file():
+        raise Exception("Screenshot Save Fail")
+
+
+def download_order(isNew: bool,
+                   driverConfig: DriverConfig,
+                   mrpCConfig: MRPCConfig,
+                   user: User,
+                   session: Optional[BrowserSession] = None,
+                   waitConfig: WaitConfig = WaitConfig()) -> Optional[str]:
+
+    with __borrow(session, driverConfig, user) as driver:
+
+        wait = WebDriverWait(driver,
+                             waitConfig.TIMEOUT,
+                             poll_frequency=waitConfig.POLL_FREQUENCY)
+
         wait.until(
             EC.frame_to_be_available_and_switch_to_it("fr_menu")
         )
@@ -127,15 +275,20 @@ def download_order(isNew: bool,
                 )
             )
 
+        timer = WaitTimer()
+
         wait.until(
             EC.presence_of_element_located((By.NAME, "xmrp_bu_c_rfc_2"))
         ).clear()
 
-        sleep(1)
-
-        wait.until(
-            EC.presence_of_element_located((By.NAME, "xmrp_bu_c_rfc_2"))
+        # 空になったのを確かめてから入力し、入力した値が反映されるのを待つ
+        timer.until(
+            wait, __ValueIs((By.NAME, "xmrp_bu_c_rfc_2"), ""), fixedSeconds=1
         ).send_keys(mrpCConfig.MRPC)
+        timer.until(
+            wait, __ValueIs((By.NAME, "xmrp_bu_c_rfc_2"), mrpCConfig.MRPC),
+            fixedSeconds=0
+        )
 
         wait.until(
             EC.presence_of_element_located(
@@ -146,58 +299,46 @@ def download_order(isNew: bool,
             EC.element_to_be_clickable((By.CSS_SELECTOR, "#xsotype_k_chk_4-1"))
         ).click()
 
-        wait.until(
+        submit = wait.until(
             EC.element_to_be_clickable((By.NAME, "btn_submit"))
-        ).click()
-
-        sleep(3)
-
-        wait.until(
-            EC.element_to_be_clickable((By.LINK_TEXT, "ダウンロード(XLS)"))
-        ).click()
+        )
+        submit.click()
+
+        # 検索結果のページに切り替わってから、ダウンロードのリンクを待つ
+        timer.until(wait, EC.staleness_of(submit), fixedSeconds=3)
+        download_link = timer.until(
+            wait,
+            EC.element_to_be_clickable((By.LINK_TEXT, "ダウンロード(XLS)")),
+            fixedSeconds=0
+        )
 
         # download_dir = driverConfig.download
         # if download_dir is None:
         #     return None
 
-        WebDriverWait(driver, 60).until(
-            __DownloadCompleted(driverConfig.download)
-        )
+        # クリックする前のフォルダの中身と比べて、増えたファイルを待つ
+        with DownloadTracker(driverConfig.download,
+                             pollFrequency=waitConfig.POLL_FREQUENCY) as tracker:
+            download_link.click()
 
-        return _get_first_file_in_dir(driverConfig.download)
+            with timer.measure(fixedSeconds=5):
+                download_path = tracker.wait(waitConfig.DOWNLOAD_TIMEOUT)
+
+        return download_path
 
 
 def upload_spl(isNew: bool,
                driverConfig: DriverConfig,
                dirConfig: DirConfig,
-               user: User) -> bool:
-
-    fp = webdriver.FirefoxProfile(profile_directory=driverConfig.profile)
-    for key, value in driverConfig.preference.items():
-        fp.set_preference(key, value)
-
-    with webdriver.Firefox(
-        firefox_profile=fp,
-        firefox_binary=driverConfig.firefox,
-        executable_path=driverConfig.geckodriver,
-        service_log_path=driverConfig.log,
-    ) as driver:
+               user: User,
+               session: Optional[BrowserSession] = None,
+               waitConfig: WaitConfig = WaitConfig()) -> bool:
 
-        wait = WebDriverWait(driver, 10)
+    with __borrow(session, driverConfig, user) as driver:
 
-        driver.get(user.URL)
-
-        wait.until(
-            EC.presence_of_element_located((By.NAME, "sei_login"))
-        ).send_keys(user.SSO_ID)
-
-        wait.until(
-            EC.presence_of_element_located((By.NAME, "sei_passwd"))
-        ).send_keys(user.SSO_PASSWORD)
-
-        wait.until(
-            EC.presence_of_element_located((By.NAME, "login"))
-        ).submit()
+        wait = WebDriverWait(driver,
+                             waitConfig.TIMEOUT,
+                             poll_frequency=waitConfig.POLL_FREQUENCY)
 
         wait.until(
             EC.frame_to_be_available_and_switch_to_it("fr_menu")
@@ -261,150 +402,325 @@ def upload_spl(isNew: bool,
 def shipping_instruction(orders: List[Order],
                          driverConfig: DriverConfig,
                          mrpCConfig: MRPCConfig,
-                         user: User):
+                         user: User,
+                         session: Optional[BrowserSession] = None,
+                         waitConfig: WaitConfig = WaitConfig(),
+                         batchRegistration: bool = False,
+                         result: Optional[ShippingInstructionResult] = None,
+                         journal: Optional[RegistrationJournal] = None) -> ShippingInstructionResult:
+    # batchRegistration = True なら、注文番号と出荷日が同じ行を 1 回の検索でまとめて登録する
+    # 検索結果から行を見分けられないまとまりは、今までどおり 1 行ずつ登録する
+    # result を渡すと登録した行をそこに足していくので、途中で失敗しても登録済みの行がわかる
+    # journal を渡すと、記録にある行は飛ばし、登録を確定した行はすぐに記録する
+
+    if result is None:
+        result = ShippingInstructionResult()
+
+    # 出荷指示書は同じフォルダにたまっていくので、登録ごとに増えた 1 件をその行の PDF とする
+    with __borrow(session, driverConfig, user) as driver, \
+            DownloadTracker(driverConfig.download,
+                            pollFrequency=waitConfig.POLL_FREQUENCY) as tracker:
+
+        wait = WebDriverWait(driver,
+                             waitConfig.TIMEOUT,
+                             poll_frequency=waitConfig.POLL_FREQUENCY)
+
+        for (order, spl_rows) in __registration_groups(orders, batchRegistration):
+            if journal is not None:
+                spl_rows = __resume_rows(journal, result, order, spl_rows)
+                if len(spl_rows) == 0:
+                    continue
+
+            if len(spl_rows) >= 2:
+                timer = WaitTimer()
+                pdf_path = __register_group(driver, wait, timer, tracker,
+                                            order, spl_rows, mrpCConfig,
+                                            user, waitConfig)
+                if pdf_path is not None:
+                    # 記録には行ごとに同じダウンロードした PDF を渡し、残しておく PDF を 1 つにする
+                    for spl_row in spl_rows:
+                        kept_path = pdf_path
+                        if journal is not None:
+                            kept_path = journal.record(order, spl_row, pdf_path)
+                        result.registeredRows.append((order, spl_row, kept_path))
+                    result.timer.add(timer)
+                    continue
+
+            # まとめて登録できなかったときの待ち時間は、1 行ずつの登録に含めない
+            for spl_row in spl_rows:
+                timer = WaitTimer()
+                pdf_path = __register_row(driver, wait, timer, tracker,
+                                          order, spl_row, mrpCConfig,
+                                          user, waitConfig)
+                kept_path = pdf_path
+                if journal is not None:
+                    kept_path = journal.record(order, spl_row, pdf_path)
+
+                result.registeredRows.append((order, spl_row, kept_path))
+                result.timer.add(timer)
+
+    return result
+
+
+def __resume_rows(journal: RegistrationJournal,
+                  result: ShippingInstructionResult,
+                  order: Order,
+                  splRows: List[SPLRow]) -> List[SPLRow]:
+    # 前の実行で登録済みの行は、記録にある PDF を使い、残りの行だけを返す
+    remaining_rows: List[SPLRow] = []
+    for spl_row in splRows:
+        pdf_path = journal.registered(order, spl_row)
+        if pdf_path is None:
+            remaining_rows.append(spl_row)
+            continue
+
+        result.registeredRows.append((order, spl_row, pdf_path))
+        result.resumedRowCount += 1
+
+    return remaining_rows
+
+
+def __registration_groups(orders: List[Order],
+                          batchRegistration: bool) -> List[Tuple[Order, List[SPLRow]]]:
+    # 1 回の検索で登録する行のまとまり
+    groups: List[Tuple[Order, List[SPLRow]]] = []
+    for order in orders:
+        if not batchRegistration:
+            groups.extend((order, [spl_row]) for spl_row in order.notTBDSPLRows)
+            continue
+
+        spl_rows_of_date: Dict[date, List[SPLRow]] = {}
+        for spl_row in order.notTBDSPLRows:
+            spl_rows_of_date.setdefault(spl_row.shipmentDate, []).append(spl_row)
+        groups.extend((order, spl_rows) for spl_rows in spl_rows_of_date.values())
+
+    return groups
+
+
+def __register_row(driver: WebDriver,
+                   wait: WebDriverWait,
+                   timer: WaitTimer,
+                   tracker: DownloadTracker,
+                   order: Order,
+                   splRow: SPLRow,
+                   mrpCConfig: MRPCConfig,
+                   user: User,
+                   waitConfig: WaitConfig) -> str:
+    __search_instruction(driver, wait, timer, mrpCConfig,
+                         order.orderNumber, splRow.shipmentDate, splRow.hin)
 
-    fp = webdriver.FirefoxProfile(profile_directory=driverConfig.profile)
-    for key, value in driverConfig.preference.items():
-        fp.set_preference(key, value)
+    # 出荷指示の新規登録画面で回答納期が検索できないと、ここで詰まる
+    try:
+        wait.until(
+            EC.presence_of_element_located(
+                (By.NAME, "load_cd_rfc_2_0"))
+        ).send_keys(mrpCConfig.TSUMI_BASYO)
+    except TimeoutException:
+        __save_error_screenshot(
+            driver, DirConfig.ERROR_SCREENSHOT_DIR)
+        raise Exception("SPL Not Found")
+
+    wait.until(
+        EC.element_to_be_clickable((By.NAME, "updchk_0"))
+    ).click()
+
+    # チェックが入り、登録ボタンが押せるようになるのを待つ
+    timer.until(
+        wait,
+        EC.element_located_to_be_selected((By.NAME, "updchk_0")),
+        fixedSeconds=3
+    )
+
+    return __confirm_registration(driver, wait, timer, tracker, user, waitConfig)
+
+
+def __register_group(driver: WebDriver,
+                     wait: WebDriverWait,
+                     timer: WaitTimer,
+                     tracker: DownloadTracker,
+                     order: Order,
+                     splRows: List[SPLRow],
+                     mrpCConfig: MRPCConfig,
+                     user: User,
+                     waitConfig: WaitConfig) -> Optional[str]:
+    # 品番を指定せずに検索し、結果の行のうち登録する品番の行だけにチェックを入れる
+    # 行を見分けられなければ、何も登録せずに None を返す
+    hins = [spl_row.hin for spl_row in splRows]
+    if len(set(hins)) != len(hins):
+        return None
+
+    __search_instruction(driver, wait, timer, mrpCConfig,
+                         order.orderNumber, splRows[0].shipmentDate, None)
+
+    try:
+        wait.until(EC.presence_of_element_located((By.NAME, "updchk_0")))
+    except TimeoutException:
+        driver.get(user.URL)
+        return None
+
+    # 結果の行ごとの、品目の欄の文字 (ほかの欄に同じ文字があっても見ない)
+    row_hins: List[Optional[str]] = []
+    while True:
+        checks = driver.find_elements(By.NAME, f"updchk_{len(row_hins)}")
+        if len(checks) == 0:
+            break
+        row = checks[0].find_element(By.XPATH, "./ancestor::tr[1]")
+        row_hins.append(__hin_cell_text(row))
+
+    indexes: List[int] = []
+    for hin in hins:
+        matched = [n for (n, row_hin) in enumerate(row_hins) if row_hin == hin]
+        if len(matched) != 1:
+            # 1 行ずつ登録し直すため、メニューのページに戻る
+            driver.get(user.URL)
+            return None
+        indexes.append(matched[0])
 
-    # ファイルをダウンロードする場合、
-    # firefox が立ちあがる前に削除しないといけない
-    if not driverConfig.delete_handler_files(fp.tempfolder):
-        raise Exception("FireFox Profile Temp Folder Error")
+    for n in indexes:
+        wait.until(
+            EC.presence_of_element_located((By.NAME, f"load_cd_rfc_2_{n}"))
+        ).send_keys(mrpCConfig.TSUMI_BASYO)
 
-    with webdriver.Firefox(
-        firefox_profile=fp,
-        firefox_binary=driverConfig.firefox,
-        executable_path=driverConfig.geckodriver,
-        service_log_path=driverConfig.log,
-    ) as driver:
+        wait.until(
+            EC.element_to_be_clickable((By.NAME, f"updchk_{n}"))
+        ).click()
 
-        wait = WebDriverWait(driver, 10)
+        timer.until(
+            wait,
+            EC.element_located_to_be_selected((By.NAME, f"updchk_{n}")),
+            fixedSeconds=3
+        )
 
-        driver.get(user.URL)
+    return __confirm_registration(driver, wait, timer, tracker, user, waitConfig)
 
-        wait.until(
-            EC.presence_of_element_located((By.NAME, "sei_login"))
-        ).send_keys(user.SSO_ID)
 
-        wait.until(
-            EC.presence_of_element_located((By.NAME, "sei_passwd"))
-        ).send_keys(user.SSO_PASSWORD)
+def __hin_cell_text(row: WebElement) -> Optional[str]:
+    # 見出しが「品目」の欄を探し、その欄の文字を返す。見つからなければ None
+    headers = row.find_elements(By.XPATH, "./ancestor::table[1]//tr[th][1]/th")
+    columns = [n for (n, header) in enumerate(headers) if "品目" in header.text]
+    if len(columns) != 1:
+        return None
 
-        wait.until(
-            EC.presence_of_element_located((By.NAME, "login"))
-        ).submit()
+    cells = row.find_elements(By.XPATH, "./td")
+    if columns[0] >= len(cells):
+        return None
 
-        for order in orders:
-            for spl_row in order.notTBDSPLRows:
+    return cells[columns[0]].text.strip()
 
-                wait.until(
-                    EC.frame_to_be_available_and_switch_to_it("fr_menu")
-                )
 
-                wait.until(
-                    EC.element_to_be_clickable(
-                        (By.CSS_SELECTOR, "body > table:nth-child(6) > tbody:nth-child(1) > tr:nth-child(2) > td:nth-child(1) > nobr:nth-child(1) > a:nth-child(1)")
-                    )
-                ).click()
-
-                wait.until(
-                    EC.element_to_be_clickable(
-                        (By.CSS_SELECTOR, "body > table:nth-child(6) > tbody:nth-child(1) > tr:nth-child(2) > td:nth-child(1) > table:nth-child(2) > tbody:nth-child(1) > tr:nth-child(2) > td:nth-child(1) > a:nth-child(1)")
-                    )
-                ).click()
-
-                driver.switch_to.parent_frame()
-                wait.until(
-                    EC.frame_to_be_available_and_switch_to_it("fr_main")
-                )
+def __search_instruction(driver: WebDriver,
+                         wait: WebDriverWait,
+                         timer: WaitTimer,
+                         mrpCConfig: MRPCConfig,
+                         orderNumber: str,
+                         shipmentDate: date,
+                         hin: Optional[str]):
+    wait.until(
+        EC.frame_to_be_available_and_switch_to_it("fr_menu")
+    )
+
+    wait.until(
+        EC.element_to_be_clickable(
+            (By.CSS_SELECTOR, "body > table:nth-child(6) > tbody:nth-child(1) > tr:nth-child(2) > td:nth-child(1) > nobr:nth-child(1) > a:nth-child(1)")
+        )
+    ).click()
 
-                wait.until(
-                    EC.presence_of_element_located(
-                        (By.NAME, "xmrp_bu_c_rf_01"))
-                ).clear()
-
-                sleep(1)
-
-                wait.until(
-                    EC.presence_of_element_located(
-                        (By.NAME, "xmrp_bu_c_rf_01"))
-                ).send_keys(mrpCConfig.MRPC)
-
-                wait.until(
-                    EC.presence_of_element_located((By.NAME, "kaito_noki"))
-                ).send_keys(str(spl_row.shipmentDate))
-
-                wait.until(
-                    EC.presence_of_element_located(
-                        (By.NAME, "pms_to_kaito_noki")
-                    )
-                ).send_keys(str(spl_row.shipmentDate))
-
-                wait.until(
-                    EC.presence_of_element_located((By.NAME, "moku_noki_nn"))
-                ).send_keys(str(spl_row.shipmentDate))
-
-                wait.until(
-                    EC.presence_of_element_located(
-                        (By.NAME, "pms_to_moku_noki_nn")
-                    )
-                ).send_keys(str(spl_row.shipmentDate))
-
-                wait.until(
-                    EC.presence_of_element_located((By.NAME, "seiban2"))
-                ).send_keys(order.orderNumber)
-
-                wait.until(
-                    EC.presence_of_element_located((By.NAME, "xitm_no_rfc_01"))
-                ).send_keys(spl_row.hin)
-
-                wait.until(
-                    EC.element_to_be_clickable((By.NAME, "btn_submit"))
-                ).submit()
-
-                # 出荷指示の新規登録画面で回答納期が検索できないと、ここで詰まる
-                try:
-                    wait.until(
-                        EC.presence_of_element_located(
-                            (By.NAME, "load_cd_rfc_2_0"))
-                    ).send_keys(mrpCConfig.TSUMI_BASYO)
-                except TimeoutException:
-                    __save_error_screenshot(
-                        driver, DirConfig.ERROR_SCREENSHOT_DIR)
-                    raise Exception("SPL Not Found")
-
-                wait.until(
-                    EC.element_to_be_clickable((By.NAME, "updchk_0"))
-                ).click()
-
-                sleep(3)
-
-                wait.until(
-                    EC.element_to_be_clickable((By.NAME, "btn_submit"))
-                ).submit()
-
-                wait.until(
-                    EC.presence_of_element_located(
-                        # 「以」の前の改行に注意
-                        (By.XPATH, "//*[text()=\"\n以下のデータを登録しますか？\"]")
-                    )
-                )
+    wait.until(
+        EC.element_to_be_clickable(
+            (By.CSS_SELECTOR, "body > table:nth-child(6) > tbody:nth-child(1) > tr:nth-child(2) > td:nth-child(1) > table:nth-child(2) > tbody:nth-child(1) > tr:nth-child(2) > td:nth-child(1) > a:nth-child(1)")
+        )
+    ).click()
+
+    driver.switch_to.parent_frame()
+    wait.until(
+        EC.frame_to_be_available_and_switch_to_it("fr_main")
+    )
+
+    wait.until(
+        EC.presence_of_element_located(
+            (By.NAME, "xmrp_bu_c_rf_01"))
+    ).clear()
+
+    # 空になったのを確かめてから入力し、入力した値が反映されるのを待つ
+    timer.until(
+        wait, __ValueIs((By.NAME, "xmrp_bu_c_rf_01"), ""),
+        fixedSeconds=1
+    ).send_keys(mrpCConfig.MRPC)
+    timer.until(
+        wait,
+        __ValueIs((By.NAME, "xmrp_bu_c_rf_01"), mrpCConfig.MRPC),
+        fixedSeconds=0
+    )
+
+    wait.until(
+        EC.presence_of_element_located((By.NAME, "kaito_noki"))
+    ).send_keys(str(shipmentDate))
+
+    wait.until(
+        EC.presence_of_element_located(
+            (By.NAME, "pms_to_kaito_noki")
+        )
+    ).send_keys(str(shipmentDate))
 
-                wait.until(
-                    EC.element_to_be_clickable((By.NAME, "btn_submit"))
-                ).submit()
+    wait.until(
+        EC.presence_of_element_located((By.NAME, "moku_noki_nn"))
+    ).send_keys(str(shipmentDate))
 
-                WebDriverWait(driver, 60).until(
-                    __DownloadCompleted(driverConfig.download)
-                )
+    wait.until(
+        EC.presence_of_element_located(
+            (By.NAME, "pms_to_moku_noki_nn")
+        )
+    ).send_keys(str(shipmentDate))
 
-                wait.until(
-                    EC.presence_of_element_located(
-                        # 「デ」の前の改行に注意
-                        (By.XPATH, "//*[text()=\"\nデータを登録しました。\"]")
-                    )
-                )
+    wait.until(
+        EC.presence_of_element_located((By.NAME, "seiban2"))
+    ).send_keys(orderNumber)
+
+    if hin is not None:
+        wait.until(
+            EC.presence_of_element_located((By.NAME, "xitm_no_rfc_01"))
+        ).send_keys(hin)
+
+    wait.until(
+        EC.element_to_be_clickable((By.NAME, "btn_submit"))
+    ).submit()
+
+
+def __confirm_registration(driver: WebDriver,
+                           wait: WebDriverWait,
+                           timer: WaitTimer,
+                           tracker: DownloadTracker,
+                           user: User,
+                           waitConfig: WaitConfig) -> str:
+    timer.until(
+        wait,
+        EC.element_to_be_clickable((By.NAME, "btn_submit")),
+        fixedSeconds=0
+    ).submit()
+
+    wait.until(
+        EC.presence_of_element_located(
+            # 「以」の前の改行に注意
+            (By.XPATH, "//*[text()=\"\n以下のデータを登録しますか？\"]")
+        )
+    )
+
+    tracker.snapshot()
+    wait.until(
+        EC.element_to_be_clickable((By.NAME, "btn_submit"))
+    ).submit()
+
+    with timer.measure(fixedSeconds=5):
+        pdf_path = tracker.wait(waitConfig.DOWNLOAD_TIMEOUT)
+
+    wait.until(
+        EC.presence_of_element_located(
+            # 「デ」の前の改行に注意
+            (By.XPATH, "//*[text()=\"\nデータを登録しました。\"]")
+        )
+    )
+
+    # driver.switch_to.parent_frame()
+    driver.get(user.URL)
 
-                # driver.switch_to.parent_frame()
-                driver.get(user.URL)
+    return pdf_path
@@ -0,0 +1,110 @@
+import hashlib
+import os
+import pickle
+import threading
+from pathlib import Path
+from typing import Any, List, Optional, Tuple
+
+from shipping_instruction.util import _init_dir
+
+
+class SnapshotCache:
+    # 読み込んだファイルの中身 (モデル) をディスクに保存しておき、
+    # 同じファイルをもう一度読むときに使いまわす
+    __SUFFIX = ".pickle"
+    __CHUNK = 1 << 20
+
+    def __init__(self, dir: str, maxBytes: int = 256 * 2**20):
+        cache_dir = _init_dir(dir, False)
+        if cache_dir is None:
+            raise Exception(f"Cache Dir Not Found: {dir}")
+
+        self.dir = cache_dir
+        self.maxBytes = maxBytes
+
+    @classmethod
+    def key(cls, path: str, version: str, config: Any) -> str:
+        # ファイルの中身・パーサのバージョン・列の設定のどれかが変われば別のキーになる
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(cls.__CHUNK), b""):
+                h.update(chunk)
+
+        h.update(f"version={version}".encode())
+        h.update(repr(cls.__config_items(config)).encode())
+
+        return h.hexdigest()
+
+    def load(self, key: str) -> Optional[Any]:
+        p = self.__path(key)
+        try:
+            with open(str(p), "rb") as f:
+                snapshot = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # 壊れたキャッシュは捨てて読み直す
+            self.__unlink(p)
+            return None
+
+        # 最近使ったものを残すため、更新日時を使った順番の目印にする
+        try:
+            os.utime(str(p))
+        except OSError:
+            pass
+
+        return snapshot
+
+    def save(self, key: str, snapshot: Any):
+        p = self.__path(key)
+        # 同じプロセスの別スレッドからも書くので、スレッドごとに一時ファイルを分ける
+        tmp = p.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(str(tmp), "wb") as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(str(tmp), str(p))
+
+        self.__evict(keep=p)
+
+    def __evict(self, keep: Path):
+        entries = []
+        total = 0
+        for content in Path(self.dir).iterdir():
+            if content.suffix != self.__SUFFIX:
+                continue
+
+            try:
+                stat = content.stat()
+            except FileNotFoundError:
+                continue
+
+            entries.append((stat.st_mtime, stat.st_size, content))
+            total += stat.st_size
+
+        # 古く使われていないものから消す
+        for (_, size, content) in sorted(entries, key=lambda e: e[0]):
+            if total <= self.maxBytes:
+                break
+
+            if content == keep:
+                continue
+
+            self.__unlink(content)
+            total -= size
+
+    def __path(self, key: str) -> Path:
+        return Path(self.dir).joinpath(f"{key}{self.__SUFFIX}")
+
+    @staticmethod
+    def __unlink(p: Path):
+        try:
+            p.unlink()
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def __config_items(config: Any) -> List[Tuple[str, Any]]:
+        items: List[Tuple[str, Any]] = []
+        for name in sorted(dir(config)):
+            if name.isupper():
+                items.append((name, getattr(config, name)))
+        return items
@@ -1,3 +1,7 @@
+import json
+import os
+import shutil
+import threading
 from getpass import getuser
 from pathlib import Path
 from typing import Any, Dict, Optional
@@ -83,14 +87,23 @@ class DriverConfig:
 
     __HANDLERS = ["mimeTypes.rdf", "handlers.json"]
 
+    # 起動のたびにコピーする、設定だけを入れた小さなプロファイル
+    PROFILE_TEMPLATE_DIR = "cache\\firefox_profile"
+    # 既定のプロファイルから引き継ぐファイル (社内の証明書の設定)
+    # 引き継いだあとで証明書を変えたときは、PROFILE_TEMPLATE_DIR を消すと作り直す
+    __PROFILE_FILES = ["cert9.db", "key4.db", "cert_override.txt", "pkcs11.txt"]
+
     def __init__(self,
                  profile: Optional[str] = None,
                  firefox: str = "C:\\Program Files\\Mozilla Firefox\\firefox.exe",
                  geckodriver: str = "geckodriver.exe",
                  log: str = "log",
-                 download: str = ""):
-        if profile is None:
-            self.profile = self.__get_profile_dir()
+                 download: str = "",
+                 slimProfile: bool = True):
+        # profile を指定しなければ、起動するときに
+        # slimProfile = True なら小さなプロファイルを、False なら既定のプロファイルを使う
+        self.__profile = profile
+        self.slimProfile = slimProfile
 
         self.firefox = firefox
 
@@ -106,12 +119,21 @@ class DriverConfig:
 
         self.download = self.__setup_download_dir(download)
 
-        self.preference = {"browser.download.useDownloadDir": True,
-                           "browser.helperApps.neverAsk.saveToDisk": ",".join(self.__MIME_TYPES),
-                           "browser.download.folderList": self.__USER_DEFINED,
-                           "browser.download.lastDir": "",
+        self.preference = {**self.__download_preference(),
                            "browser.download.dir": self.download}
 
+    @property
+    def profile(self) -> Optional[str]:
+        if self.__profile is None:
+            if self.slimProfile:
+                self.__profile = self.__setup_profile_template(
+                    self.PROFILE_TEMPLATE_DIR, self.__get_profile_dir()
+                )
+            else:
+                self.__profile = self.__get_profile_dir()
+
+        return self.__profile
+
     def delete_handler_files(self, tempfolder: Optional[str]) -> bool:
         if tempfolder is None:
             return False
@@ -146,6 +168,46 @@ class DriverConfig:
                         return str(content)
         return None
 
+    @classmethod
+    def __download_preference(cls) -> Dict[str, Any]:
+        return {"browser.download.useDownloadDir": True,
+                "browser.helperApps.neverAsk.saveToDisk": ",".join(cls.__MIME_TYPES),
+                "browser.download.folderList": cls.__USER_DEFINED,
+                "browser.download.lastDir": ""}
+
+    @classmethod
+    def __setup_profile_template(cls, dir: str, source: Optional[str]) -> str:
+        # キャッシュ・履歴・拡張機能などは持たず、ダウンロードの設定だけを書いておく
+        # (ダウンロード先は起動するときと段階ごとに設定する)
+        template_dir = _init_dir(dir, False)
+        if template_dir is None:
+            raise Exception(f"Profile Template Dir Not Found: {dir}")
+
+        template = Path(template_dir)
+        user_js = "".join(f"user_pref({json.dumps(key)}, {json.dumps(value)});\n"
+                          for key, value in cls.__download_preference().items())
+
+        user_js_p = template.joinpath("user.js")
+        if not user_js_p.is_file() or user_js_p.read_text(encoding="utf-8") != user_js:
+            cls.__replace_file(user_js_p,
+                               lambda tmp: tmp.write_text(user_js, encoding="utf-8"))
+
+        if source is not None:
+            for name in cls.__PROFILE_FILES:
+                src = Path(source).joinpath(name)
+                dst = template.joinpath(name)
+                if src.is_file() and not dst.is_file():
+                    cls.__replace_file(dst, lambda tmp: shutil.copyfile(src, tmp))
+
+        return str(template.resolve())
+
+    @staticmethod
+    def __replace_file(path: Path, write):
+        # 別のスレッドが同時に作っても壊れないよう、一時ファイルに書いてから置き換える
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        write(tmp)
+        os.replace(str(tmp), str(path))
+
     @staticmethod
     def __setup_download_dir(dir: str) -> str:
         # この実装だとダウンロード先のフォルダは毎回リフレッシュされるので注意
@@ -165,6 +227,64 @@ class DriverConfig:
         return str(Path(log_dir).joinpath("geckodriver.log").resolve())
 
 
+class WaitConfig:
+    # 画面の要素を待つ秒数
+    TIMEOUT = 10
+    # ダウンロードの完了を待つ秒数
+    DOWNLOAD_TIMEOUT = 60
+    # 条件を確かめる間隔 (秒)
+    POLL_FREQUENCY = 0.1
+
+
+class InstructionConfig:
+    # 注文番号と出荷日が同じ行を、1 回の検索でまとめて登録する
+    BATCH_REGISTRATION = False
+    # 出荷指示を登録するブラウザの数
+    # 2 以上なら、オーダを振り分けて、それぞれログインしたブラウザで並行して登録する
+    WORKERS = 1
+    # 前の実行で登録を確定した行は、登録せずに飛ばす
+    RESUME = True
+
+    def __init__(self,
+                 batchRegistration: Optional[bool] = None,
+                 workers: Optional[int] = None,
+                 resume: Optional[bool] = None):
+        if batchRegistration is not None:
+            self.BATCH_REGISTRATION = batchRegistration
+        if resume is not None:
+            self.RESUME = resume
+        if workers is not None:
+            if workers < 1:
+                raise Exception(f"Invalid Workers: {workers}")
+            self.WORKERS = workers
+
+
+class PortalConfig:
+    # ブラウザを使わず、HTTP で直接フォームを送る経路の設定
+    # ページのパスは user.json の URL からの相対パス
+    # 設定していないページは、今までどおりブラウザで操作する
+    ANSWERED_ORDER_SEARCH_PATH: Optional[str] = None
+    NEW_ORDER_SEARCH_PATH: Optional[str] = None
+    ANSWERED_ORDER_UPLOAD_PATH: Optional[str] = None
+    NEW_ORDER_UPLOAD_PATH: Optional[str] = None
+
+    # ページに文字コードの指定がないときの文字コード
+    ENCODING = "cp932"
+    # 1 回のリクエストを待つ秒数
+    TIMEOUT = 30
+    # 使いまわすために残しておく接続の数 (ホストごと)
+    MAX_IDLE_CONNECTIONS = 4
+    # たどるリダイレクトの回数
+    MAX_REDIRECTS = 5
+
+    @property
+    def enabled(self) -> bool:
+        return any(path is not None for path in (self.ANSWERED_ORDER_SEARCH_PATH,
+                                                 self.NEW_ORDER_SEARCH_PATH,
+                                                 self.ANSWERED_ORDER_UPLOAD_PATH,
+                                                 self.NEW_ORDER_UPLOAD_PATH))
+
+
 class OrderFileColumnConfingBase:
     SHEET: Optional[str] = None
 
@@ -321,6 +441,8 @@ class DirConfig:
 
     PMS_FILE_DIR = "input"
 
+    DOWNLOAD_DIR = "download"
+
     ANSWERED_ORDER_DIR = "download\\answered"
     NEW_ORDER_DIR = "download\\new"
 
@@ -331,17 +453,54 @@ class DirConfig:
     PDF_OUTPUT_DIR = "output\\pdf"
 
     ERROR_SCREENSHOT_DIR = "error"
+    VALIDATION_REPORT_DIR = "error"
+
+    CACHE_DIR = "cache"
+
+    # 登録を確定した出荷指示の記録 (途中で止まった実行をやり直すときに使う)
+    JOURNAL_DIR = "journal"
+
+    OUTPUT_DIR = "output"
+
+    def __init__(self,
+                 instructionNumber: Optional[str] = None,
+                 mrpc: Optional[str] = None):
+        # 一括処理では指示番号ごとのフォルダに出力する
+        # PDF の出力先はもともと指示番号ごとに分かれている
+        # 複数の MRP 拠点を同時に処理するときは、拠点ごとにダウンロード先と出力先を分ける
+        self.instructionNumber = instructionNumber
+        self.mrpc = mrpc
+
+        output_dir = self.OUTPUT_DIR
+        if instructionNumber is not None:
+            output_dir = f"{output_dir}\\{instructionNumber}"
+
+        if mrpc is not None:
+            output_dir = f"{output_dir}\\{mrpc}"
+            download_dir = f"{self.DOWNLOAD_DIR}\\{mrpc}"
+            self.ANSWERED_ORDER_DIR = f"{download_dir}\\answered"
+            self.NEW_ORDER_DIR = f"{download_dir}\\new"
+            self.PDF_DIR = f"{download_dir}\\pdf"
+            self.JOURNAL_DIR = f"{self.JOURNAL_DIR}\\{mrpc}"
+
+        if output_dir != self.OUTPUT_DIR:
+            self.ANSWERED_ORDER_OUTPUT_PATH = f"{output_dir}\\answered.xls"
+            self.NEW_ORDER_OUTPUT_PATH = f"{output_dir}\\new.xls"
+
+    def of_site(self, mrpc: str) -> "DirConfig":
+        return DirConfig(instructionNumber=self.instructionNumber, mrpc=mrpc)
 
 
 class MRPCConfig:
+    # 出荷倉庫の先頭文字ごとの (MRP拠点, 積場所)
+    SITES = {"N": ("40", "N05"),
+             "E": ("20", "E09")}
+
     def __init__(self, pms_file):
-        if pms_file.headCharOfShipmentWarehouse == "N":
-            self.MRPC = "40"
-            self.TSUMI_BASYO = "N05"
-        elif pms_file.headCharOfShipmentWarehouse == "E":
-            self.MRPC = "20"
-            self.TSUMI_BASYO = "E09"
-        else:
+        site = self.SITES.get(pms_file.headCharOfShipmentWarehouse)
+        if site is None:
             raise Exception(
                 f"Unknown Shipment Warehouse: {pms_file.headCharOfShipmentWarehouse}"
             )
+
+        (self.MRPC, self.TSUMI_BASYO) = site
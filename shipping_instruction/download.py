@@ -0,0 +1,74 @@
+from pathlib import Path
+from time import monotonic, sleep
+from typing import Dict, List, Optional, Set
+
+
+class DownloadTracker:
+    # ダウンロード先のフォルダを見張り、操作のあとに増えた完了済みのファイルを 1 件だけ待つ
+    # Firefox はダウンロード中に同じ名前の空ファイルと .part ファイルを作るので、
+    # .part ファイルが消え、サイズが変わらなくなったら完了とみなす
+
+    __PART_SUFFIX = ".part"
+
+    def __init__(self, dir: str, pollFrequency: float = 0.1):
+        self.dir = dir
+        self.pollFrequency = pollFrequency
+
+        self.__known: Set[str] = set()
+        self.snapshot()
+
+    def __enter__(self) -> "DownloadTracker":
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def snapshot(self):
+        # ダウンロードを始める操作の前に、フォルダにあるファイルを覚える
+        self.__known = set(self.__names())
+
+    def wait(self, timeout: float) -> str:
+        # snapshot() のあとに増えた完了済みのファイルを 1 件待ち、そのパスを返す
+        deadline = monotonic() + timeout
+        sizes: Dict[str, int] = {}
+        while True:
+            completed = self.__new_completed_names()
+            if len(completed) > 1:
+                raise Exception(
+                    f"Unexpected Downloads: {', '.join(sorted(completed))}"
+                )
+
+            if len(completed) == 1:
+                name = completed[0]
+                size = self.__size(name)
+                # 前に確かめたときとサイズが同じなら、書き込みは終わっている
+                if size is not None and sizes.get(name) == size:
+                    self.__known.add(name)
+                    return str(Path(self.dir).joinpath(name))
+                sizes = {} if size is None else {name: size}
+
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                raise Exception(f"Download Timeout: {self.dir}")
+
+            sleep(min(self.pollFrequency, remaining))
+
+    def __names(self) -> List[str]:
+        p = Path(self.dir)
+        if not p.is_dir():
+            return []
+
+        return [content.name for content in p.iterdir() if content.is_file()]
+
+    def __new_completed_names(self) -> List[str]:
+        names = set(self.__names())
+        return [name for name in names - self.__known
+                if not name.endswith(self.__PART_SUFFIX)
+                and f"{name}{self.__PART_SUFFIX}" not in names]
+
+    def __size(self, name: str) -> Optional[int]:
+        try:
+            return Path(self.dir).joinpath(name).stat().st_size
+        except OSError:
+            # 確かめる間に名前が変わった
+            return None
@@ -0,0 +1,117 @@
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from shipping_instruction.order import Order, SPLRow
+from shipping_instruction.util import _init_dir
+
+
+class RegistrationJournal:
+    # 登録を確定した出荷指示を、1 行ずつ追記していく記録
+    # 途中で止まった実行をやり直すときは、記録にある行を登録せずに飛ばす
+    # PDF のダウンロード先は次の実行で空にされるので、出荷指示書の PDF は記録と一緒に残しておく
+
+    __SUFFIX = ".jsonl"
+
+    def __init__(self, dir: str, instructionNumber: str, resume: bool = True):
+        journal_dir = _init_dir(dir, False)
+        if journal_dir is None:
+            raise Exception(f"Journal Dir Not Found: {dir}")
+
+        pdf_dir = _init_dir(str(Path(journal_dir).joinpath(instructionNumber)), False)
+        if pdf_dir is None:
+            raise Exception(f"Journal PDF Dir Not Found: {dir}")
+
+        self.instructionNumber = instructionNumber
+        self.path = str(Path(journal_dir).joinpath(f"{instructionNumber}{self.__SUFFIX}"))
+        self.pdfDir = pdf_dir
+
+        self.__lock = threading.Lock()
+        # (注文番号, 品番, 出荷日, 出荷倉庫) ごとの出荷指示書の PDF
+        # 同じオーダでも、倉庫が違えば品番と出荷日が同じ行がある
+        self.__entries: Dict[Tuple[str, str, str, str], str] = {}
+        # ダウンロードした PDF と、残しておいた PDF
+        # まとめて登録した行は同じ PDF を共有するので、1 回だけ残す
+        self.__kept: Dict[str, str] = {}
+        self.__torn = False
+        # 記録してある行数 (やり直さないときも、前の実行の PDF は上書きしない)
+        self.__recordCount = 0
+
+        self.__load(resume)
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def registered(self, order: Order, splRow: SPLRow) -> Optional[str]:
+        # 登録済みなら、その行の出荷指示書の PDF のパスを返す
+        with self.__lock:
+            return self.__entries.get(self.__key(order, splRow))
+
+    def record(self, order: Order, splRow: SPLRow, pdfPath: str) -> str:
+        # 登録を確定した行を記録し、残しておいた PDF のパスを返す
+        with self.__lock:
+            kept_path = self.__kept.get(pdfPath)
+            if kept_path is None:
+                # 前の実行の PDF と名前が重ならないように、記録の件数を頭につける
+                kept_path = str(Path(self.pdfDir).joinpath(
+                    f"{self.__recordCount:04d}_{Path(pdfPath).name}"
+                ))
+                shutil.copyfile(pdfPath, kept_path)
+                self.__kept[pdfPath] = kept_path
+
+            key = self.__key(order, splRow)
+            line = json.dumps({"instructionNumber": self.instructionNumber,
+                               "orderNumber": key[0],
+                               "hin": key[1],
+                               "shipmentDate": key[2],
+                               "shipmentWarehouse": key[3],
+                               "pdf": kept_path},
+                              ensure_ascii=False)
+
+            with open(self.path, "a", encoding="utf-8") as f:
+                # 書きかけで止まった行の続きには書かない
+                if self.__torn:
+                    f.write("\n")
+                    self.__torn = False
+                f.write(f"{line}\n")
+                f.flush()
+                # 次の行を登録する前に、確実にディスクへ書いておく
+                os.fsync(f.fileno())
+
+            self.__entries[key] = kept_path
+            self.__recordCount += 1
+            return kept_path
+
+    def __load(self, resume: bool):
+        p = Path(self.path)
+        if not p.is_file():
+            return
+
+        text = p.read_text(encoding="utf-8")
+        self.__torn = text != "" and not text.endswith("\n")
+        lines = text.splitlines()
+        self.__recordCount = len(lines)
+        if not resume:
+            return
+
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # 書いている途中で止まった行は、登録していないものとして扱う
+                continue
+
+            if entry.get("instructionNumber") != self.instructionNumber:
+                continue
+
+            key = (entry["orderNumber"], entry["hin"], entry["shipmentDate"],
+                   entry["shipmentWarehouse"])
+            self.__entries[key] = entry["pdf"]
+
+    @staticmethod
+    def __key(order: Order, splRow: SPLRow) -> Tuple[str, str, str, str]:
+        return (order.orderNumber, splRow.hin, splRow.shipmentDate.isoformat(),
+                splRow.shipmentWarehouse)
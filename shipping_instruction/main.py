@@ -1,29 +1,108 @@
+import json
 import subprocess
-from time import sleep
-from typing import List, Optional, Tuple
-
-from shipping_instruction.browser import (download_order, shipping_instruction,
+import sys
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import freeze_support
+from pathlib import Path
+from time import perf_counter, sleep
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from shipping_instruction.browser import (BrowserSession,
+                                          ShippingInstructionResult,
+                                          download_order, shipping_instruction,
                                           upload_spl)
+from shipping_instruction.cache import SnapshotCache
 from shipping_instruction.config import (AnsweredOrderFileColumnConfig,
-                                         DirConfig, DriverConfig, MRPCConfig,
-                                         NewOrderFileColumnConfig)
+                                         DirConfig, DriverConfig,
+                                         InstructionConfig, MRPCConfig,
+                                         NewOrderFileColumnConfig, PortalConfig)
+from shipping_instruction.journal import RegistrationJournal
 from shipping_instruction.order import Order, OrderFile, OrderFiles
 from shipping_instruction.pdf import merge
-from shipping_instruction.pms import PMSFile, PMSFileColumnsConfig
+from shipping_instruction.pms import (PMSFile, PMSFileColumnsConfig,
+                                      PMSPartition, PMSValidationError)
+from shipping_instruction.portal import (PortalClient, PortalError,
+                                         PortalNotSentError)
 from shipping_instruction.user import User
+from shipping_instruction.util import _get_files_in_dir, _init_dir
+
 
+def read_pms_file(path: str = DirConfig.PMS_FILE_DIR) -> PMSFile:
+    return PMSFile(path=path,
+                   config=PMSFileColumnsConfig(),
+                   useMmap=True,
+                   cache=SnapshotCache(DirConfig.CACHE_DIR))
 
-def read_pms_file() -> PMSFile:
-    return PMSFile(path=DirConfig.PMS_FILE_DIR,
-                   config=PMSFileColumnsConfig())
 
+def report_pms_violations(error: PMSValidationError) -> str:
+    report_dir = _init_dir(DirConfig.VALIDATION_REPORT_DIR, False)
+    if report_dir is None:
+        raise Exception("Validation Report Dir Not Found")
 
-def download_answered_order(mrpCConfig: MRPCConfig, user: User) -> str:
-    answered_config = DriverConfig(download=DirConfig.ANSWERED_ORDER_DIR)
-    answered_file_path = download_order(isNew=False,
-                                        driverConfig=answered_config,
-                                        mrpCConfig=mrpCConfig,
-                                        user=user)
+    report_path = str(Path(report_dir).joinpath(
+        f"{Path(error.fileName).stem}_validation.json"
+    ))
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(error.to_dict(), f, ensure_ascii=False, indent=2)
+
+    print("")
+    print(f"PMS ファイルに {len(error.violations)} 件の問題があります: {error.fileName}")
+    for violation in error.violations:
+        print(f"  {violation.row}行目 {violation.column}列目 "
+              f"{violation.field}: {violation.code} [{violation.value}]")
+    print(f"問題の一覧を保存しました: {report_path}")
+    return report_path
+
+
+def download_order_via_portal(portal: Optional[PortalClient],
+                              isNew: bool,
+                              mrpCConfig: MRPCConfig,
+                              downloadDir: str) -> Optional[str]:
+    if portal is None:
+        return None
+
+    try:
+        return portal.download_order(isNew=isNew,
+                                     mrpc=mrpCConfig.MRPC,
+                                     downloadDir=downloadDir)
+    except PortalError as e:
+        print(f"HTTP でダウンロードできなかったため、ブラウザでダウンロードします: {e}")
+        return None
+
+
+def upload_spl_via_portal(portal: Optional[PortalClient],
+                          isNew: bool,
+                          dirConfig: DirConfig) -> Optional[bool]:
+    if portal is None:
+        return None
+
+    upload_path = dirConfig.NEW_ORDER_OUTPUT_PATH if isNew else dirConfig.ANSWERED_ORDER_OUTPUT_PATH
+    try:
+        return portal.upload_spl(isNew=isNew, uploadPath=upload_path)
+    except PortalNotSentError as e:
+        print(f"HTTP でアップロードできなかったため、ブラウザでアップロードします: {e}")
+        return None
+    except PortalError as e:
+        # 送ったあとに失敗したときは、ブラウザで送り直すと二重に登録するおそれがある
+        raise Exception(f"HTTP でのアップロードの結果がわからないため、処理を中止します: {e}")
+
+
+def download_answered_order(mrpCConfig: MRPCConfig,
+                            user: User,
+                            dirConfig: DirConfig = DirConfig(),
+                            session: Optional[BrowserSession] = None,
+                            portal: Optional[PortalClient] = None) -> str:
+    answered_config = DriverConfig(download=dirConfig.ANSWERED_ORDER_DIR)
+    answered_file_path = download_order_via_portal(portal=portal,
+                                                   isNew=False,
+                                                   mrpCConfig=mrpCConfig,
+                                                   downloadDir=answered_config.download)
+    if answered_file_path is None:
+        answered_file_path = download_order(isNew=False,
+                                            driverConfig=answered_config,
+                                            mrpCConfig=mrpCConfig,
+                                            user=user,
+                                            session=session)
     if answered_file_path is None:
         raise Exception("回答済受注ファイルのダウンロードに失敗しました")
 
@@ -31,12 +110,22 @@ def download_answered_order(mrpCConfig: MRPCConfig, user: User) -> str:
     return answered_file_path
 
 
-def download_new_order(mrpCConfig: MRPCConfig, user: User) -> Optional[str]:
-    new_config = DriverConfig(download=DirConfig.NEW_ORDER_DIR)
-    new_file_path = download_order(isNew=True,
-                                   driverConfig=new_config,
-                                   mrpCConfig=mrpCConfig,
-                                   user=user)
+def download_new_order(mrpCConfig: MRPCConfig,
+                       user: User,
+                       dirConfig: DirConfig = DirConfig(),
+                       session: Optional[BrowserSession] = None,
+                       portal: Optional[PortalClient] = None) -> Optional[str]:
+    new_config = DriverConfig(download=dirConfig.NEW_ORDER_DIR)
+    new_file_path = download_order_via_portal(portal=portal,
+                                              isNew=True,
+                                              mrpCConfig=mrpCConfig,
+                                              downloadDir=new_config.download)
+    if new_file_path is None:
+        new_file_path = download_order(isNew=True,
+                                       driverConfig=new_config,
+                                       mrpCConfig=mrpCConfig,
+                                       user=user,
+                                       session=session)
     if new_file_path is None:
         # 新規受注がゼロの場合もあるためエラーにしない
         print("新規受注ファイルのダウンロードに失敗しました")
@@ -45,12 +134,54 @@ def download_new_order(mrpCConfig: MRPCConfig, user: User) -> Optional[str]:
     return new_file_path
 
 
-def output_upload_file_wrapper(pmsFile: PMSFile,
+def download_order_files(mrpCConfig: MRPCConfig,
+                         user: User,
+                         dirConfig: DirConfig = DirConfig(),
+                         session: Optional[BrowserSession] = None,
+                         portal: Optional[PortalClient] = None) -> Tuple[str, Optional[str]]:
+    # 回答済受注と新規受注は別のページから別のフォルダにダウンロードするので、同時に進める
+    # 新規受注のほうはもうひとつブラウザを立ち上げる
+    start = perf_counter()
+    with BrowserSession(driverConfig=DriverConfig(download=""),
+                        user=user) as new_session, \
+            ThreadPoolExecutor(max_workers=2) as executor:
+        answered_future: Future = executor.submit(download_answered_order,
+                                                  mrpCConfig=mrpCConfig,
+                                                  user=user,
+                                                  dirConfig=dirConfig,
+                                                  session=session,
+                                                  portal=portal)
+        new_future: Future = executor.submit(download_new_order,
+                                             mrpCConfig=mrpCConfig,
+                                             user=user,
+                                             dirConfig=dirConfig,
+                                             session=new_session,
+                                             portal=portal)
+
+        # 両方のダウンロードが終わるのを待ってから次へ進む
+        answered_file_path: str = answered_future.result()
+        new_file_path: Optional[str] = new_future.result()
+
+    print(f"受注ファイルのダウンロード時間: {perf_counter() - start:.1f} 秒")
+    return (answered_file_path, new_file_path)
+
+
+def output_upload_file_wrapper(partitions: Sequence[PMSPartition],
                                answeredFilePath: str,
-                               newFilePath: Optional[str]) -> Tuple[bool, bool, OrderFiles, Optional[str]]:
+                               newFilePath: Optional[str],
+                               dirConfig: DirConfig = DirConfig(),
+                               incrementalKey: Optional[str] = None) -> Tuple[bool, bool, OrderFiles, Optional[str]]:
+    # 途中で失敗してやり直すときは、同じファイルの読み込み結果を使いまわす
+    cache = SnapshotCache(DirConfig.CACHE_DIR)
+
     answered_order_file = OrderFile(isNew=False,
                                     path=answeredFilePath,
-                                    config=AnsweredOrderFileColumnConfig())
+                                    config=AnsweredOrderFileColumnConfig(),
+                                    cache=cache,
+                                    incrementalKey=incrementalKey)
+    if incrementalKey is not None:
+        print(f"回答済受注 {len(answered_order_file.orders)} 件のうち "
+              f"{answered_order_file.reusedOrderCount} 件は前回から変更がありません")
 
     new_order_file: Optional[OrderFile] = None
     if newFilePath is None:
@@ -58,14 +189,15 @@ def output_upload_file_wrapper(pmsFile: PMSFile,
     else:
         new_order_file = OrderFile(isNew=True,
                                    path=newFilePath,
-                                   config=NewOrderFileColumnConfig())
+                                   config=NewOrderFileColumnConfig(),
+                                   cache=cache)
 
     order_files = OrderFiles(files=[answered_order_file])
 
     if new_order_file is not None:
         order_files.append_order_file(orderFile=new_order_file)
 
-    order_files.apply_shipping_plan(pmsFile=pmsFile)
+    order_files.apply_shipping_plan(partitions=partitions)
 
     tyuumon_bangou_prefix = order_files.get_valid_tyuumou_bangou_prefix()
     # if tyuumon_bangou_prefix is None:
@@ -75,36 +207,44 @@ def output_upload_file_wrapper(pmsFile: PMSFile,
     for order_file in order_files.files:
         if not order_file.isNew:
             answered_done = order_file.output_upload_file(
-                output=DirConfig.ANSWERED_ORDER_OUTPUT_PATH
+                output=dirConfig.ANSWERED_ORDER_OUTPUT_PATH
             )
             if not answered_done:
                 print("回答済受注に対する納期回答更新はありません")
             else:
                 print(
-                    f"回答済受注の回答アップロードファイルを作成しました: {DirConfig.ANSWERED_ORDER_OUTPUT_PATH}"
+                    f"回答済受注の回答アップロードファイルを作成しました: {dirConfig.ANSWERED_ORDER_OUTPUT_PATH}"
                 )
         else:
             new_done = order_file.output_upload_file(
-                output=DirConfig.NEW_ORDER_OUTPUT_PATH
+                output=dirConfig.NEW_ORDER_OUTPUT_PATH
             )
             if not new_done:
                 print("新規受注に対する納期回答更新はありません")
             else:
                 print(
-                    f"新規受注の回答アップロードファイルを作成しました: {DirConfig.NEW_ORDER_OUTPUT_PATH}"
+                    f"新規受注の回答アップロードファイルを作成しました: {dirConfig.NEW_ORDER_OUTPUT_PATH}"
                 )
 
     return (answered_done, new_done, order_files, tyuumon_bangou_prefix)
 
 
-def upload_spl_wrapper(doAnswered: bool, doNew: bool, user: User):
+def upload_spl_wrapper(doAnswered: bool, doNew: bool, user: User,
+                       dirConfig: DirConfig = DirConfig(),
+                       session: Optional[BrowserSession] = None,
+                       portal: Optional[PortalClient] = None):
 
     answered_done = False
     if doAnswered:
-        answered_done = upload_spl(isNew=False,
-                                   driverConfig=DriverConfig(download=""),
-                                   dirConfig=DirConfig(),
-                                   user=user)
+        answered_done = upload_spl_via_portal(portal=portal,
+                                              isNew=False,
+                                              dirConfig=dirConfig)
+        if answered_done is None:
+            answered_done = upload_spl(isNew=False,
+                                       driverConfig=DriverConfig(download=""),
+                                       dirConfig=dirConfig,
+                                       user=user,
+                                       session=session)
     if doAnswered:
         if answered_done:
             print("回答済受注の回答アップロードが完了しました")
@@ -113,10 +253,15 @@ def upload_spl_wrapper(doAnswered: bool, doNew: bool, user: User):
 
     new_done = False
     if doNew:
-        new_done = upload_spl(isNew=True,
-                              driverConfig=DriverConfig(download=""),
-                              dirConfig=DirConfig(),
-                              user=user)
+        new_done = upload_spl_via_portal(portal=portal,
+                                         isNew=True,
+                                         dirConfig=dirConfig)
+        if new_done is None:
+            new_done = upload_spl(isNew=True,
+                                  driverConfig=DriverConfig(download=""),
+                                  dirConfig=dirConfig,
+                                  user=user,
+                                  session=session)
     if doNew:
         if new_done:
             print("回答済受注の回答アップロードが完了しました")
@@ -129,17 +274,162 @@ def upload_spl_wrapper(doAnswered: bool, doNew: bool, user: User):
 
 def shipping_instruction_wrapper(orders: List[Order],
                                  mrpCConfig: MRPCConfig,
-                                 user: User):
-    shipping_instruction(orders=orders,
-                         driverConfig=DriverConfig(download=DirConfig.PDF_DIR),
-                         mrpCConfig=mrpCConfig,
-                         user=user)
-
-
-def merge_wrapper(pmsFile: PMSFile):
-    pdf_path = merge(inputDir=DirConfig.PDF_DIR,
-                     outputBaseDir=DirConfig.PDF_OUTPUT_DIR,
-                     instructionNumber=pmsFile.instructionNumber)
+                                 user: User,
+                                 dirConfig: DirConfig = DirConfig(),
+                                 session: Optional[BrowserSession] = None,
+                                 instructionConfig: InstructionConfig = InstructionConfig(),
+                                 journal: Optional[RegistrationJournal] = None) -> List[str]:
+    # 登録した出荷指示書の PDF を、オーダと SPL 行の順に返す
+    workers = min(instructionConfig.WORKERS, len(orders))
+    if workers <= 1:
+        result = shipping_instruction(orders=orders,
+                                      driverConfig=DriverConfig(download=dirConfig.PDF_DIR),
+                                      mrpCConfig=mrpCConfig,
+                                      user=user,
+                                      session=session,
+                                      batchRegistration=instructionConfig.BATCH_REGISTRATION,
+                                      journal=journal)
+    else:
+        result = run_instruction_workers(orders=orders,
+                                         workers=workers,
+                                         mrpCConfig=mrpCConfig,
+                                         user=user,
+                                         dirConfig=dirConfig,
+                                         session=session,
+                                         instructionConfig=instructionConfig,
+                                         journal=journal)
+
+    if result.resumedRowCount > 0:
+        print(f"前の実行で登録済みの {result.resumedRowCount} 行を飛ばしました")
+    timer = result.timer
+    print(f"出荷指示の登録で、固定の待ち {timer.fixedSeconds:.0f} 秒のところ "
+          f"{timer.waitedSeconds:.1f} 秒で進みました ({timer.savedSeconds:.1f} 秒短縮)")
+    if instructionConfig.BATCH_REGISTRATION:
+        pdf_count = len({pdf_path for (_, _, pdf_path) in result.registeredRows})
+        print(f"{len(result.registeredRows)} 行を {pdf_count} 回の登録で済ませました")
+
+    return ordered_pdf_files(orders, result)
+
+
+def shard_orders(orders: List[Order], workers: int) -> List[List[Order]]:
+    # オーダは分けずに、行数の少ないワーカーから順に振り分ける
+    # まとめて登録する行は同じオーダなので、同じワーカーに入る
+    shards: List[List[Order]] = [[] for _ in range(workers)]
+    row_counts = [0] * workers
+    for order in orders:
+        n = row_counts.index(min(row_counts))
+        shards[n].append(order)
+        row_counts[n] += len(order.notTBDSPLRows)
+
+    return [shard for shard in shards if len(shard) > 0]
+
+
+def run_instruction_workers(orders: List[Order],
+                            workers: int,
+                            mrpCConfig: MRPCConfig,
+                            user: User,
+                            dirConfig: DirConfig,
+                            session: Optional[BrowserSession] = None,
+                            instructionConfig: InstructionConfig = InstructionConfig(),
+                            journal: Optional[RegistrationJournal] = None) -> ShippingInstructionResult:
+    shards = shard_orders(orders, workers)
+    # 失敗したワーカーがあっても、それまでに登録した行は結果に残す
+    results = [ShippingInstructionResult() for _ in shards]
+    errors: Dict[int, Exception] = {}
+
+    print(f"{len(shards)} 個のブラウザで並行して登録します")
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        futures = [
+            executor.submit(run_instruction_worker,
+                            orders=shard,
+                            driverConfig=DriverConfig(
+                                download=f"{dirConfig.PDF_DIR}\\worker{n}"),
+                            mrpCConfig=mrpCConfig,
+                            user=user,
+                            # ひとつめのワーカーは、拠点で立ち上げたブラウザを使う
+                            session=session if n == 0 else None,
+                            instructionConfig=instructionConfig,
+                            result=results[n],
+                            journal=journal)
+            for (n, shard) in enumerate(shards)
+        ]
+        for (n, future) in enumerate(futures):
+            try:
+                future.result()
+            except Exception as e:
+                errors[n] = e
+
+    merged = ShippingInstructionResult()
+    for (n, (shard, result)) in enumerate(zip(shards, results)):
+        row_count = sum(len(order.notTBDSPLRows) for order in shard)
+        status = f"失敗: {errors[n]}" if n in errors else "完了"
+        print(f"  ワーカー {n}: {len(result.registeredRows)} / {row_count} 行を登録 {status}")
+        merged.registeredRows.extend(result.registeredRows)
+        merged.resumedRowCount += result.resumedRowCount
+        merged.timer.add(result.timer)
+
+    if len(errors) > 0:
+        raise Exception(f"{len(errors)} 個のワーカーで出荷指示の登録に失敗しました")
+
+    return merged
+
+
+def run_instruction_worker(orders: List[Order],
+                           driverConfig: DriverConfig,
+                           mrpCConfig: MRPCConfig,
+                           user: User,
+                           session: Optional[BrowserSession],
+                           instructionConfig: InstructionConfig,
+                           result: ShippingInstructionResult,
+                           journal: Optional[RegistrationJournal] = None) -> ShippingInstructionResult:
+    if session is not None:
+        return shipping_instruction(orders=orders,
+                                    driverConfig=driverConfig,
+                                    mrpCConfig=mrpCConfig,
+                                    user=user,
+                                    session=session,
+                                    batchRegistration=instructionConfig.BATCH_REGISTRATION,
+                                    result=result,
+                                    journal=journal)
+
+    # ワーカーごとにログインしたブラウザを立ち上げる
+    with BrowserSession(DriverConfig(download=""), user) as own_session:
+        return shipping_instruction(orders=orders,
+                                    driverConfig=driverConfig,
+                                    mrpCConfig=mrpCConfig,
+                                    user=user,
+                                    session=own_session,
+                                    batchRegistration=instructionConfig.BATCH_REGISTRATION,
+                                    result=result,
+                                    journal=journal)
+
+
+def ordered_pdf_files(orders: List[Order], result: ShippingInstructionResult) -> List[str]:
+    # ワーカーの終わった順ではなく、オーダと SPL 行の順に並べる
+    # まとめて登録した行は PDF を共有するので、最初の行の位置に 1 回だけ入れる
+    position = {id(spl_row): i
+                for (i, spl_row) in enumerate(spl_row
+                                              for order in orders
+                                              for spl_row in order.notTBDSPLRows)}
+    registered_rows = sorted(result.registeredRows,
+                             key=lambda row: position.get(id(row[1]), len(position)))
+
+    files: List[str] = []
+    for (_, _, pdf_path) in registered_rows:
+        if pdf_path not in files:
+            files.append(pdf_path)
+
+    return files
+
+
+def merge_wrapper(pmsFile: PMSFile,
+                  suffix: str = "",
+                  dirConfig: DirConfig = DirConfig(),
+                  files: Optional[List[str]] = None):
+    pdf_path = merge(inputDir=dirConfig.PDF_DIR,
+                     outputBaseDir=dirConfig.PDF_OUTPUT_DIR,
+                     instructionNumber=f"{pmsFile.instructionNumber}{suffix}",
+                     files=files)
 
     if pdf_path is None:
         raise Exception("PDF の結合に失敗しました")
@@ -147,44 +437,147 @@ def merge_wrapper(pmsFile: PMSFile):
     subprocess.Popen(["start", pdf_path], shell=True)
 
 
-def main():
-
-    BYE = 5
+def run_pipeline(pmsFile: PMSFile,
+                 user: User,
+                 dirConfig: DirConfig,
+                 incremental: bool = False,
+                 instructionConfig: InstructionConfig = InstructionConfig()) -> bool:
+    partitions_of_site = pmsFile.partitionsOfSite
+    if len(partitions_of_site) == 1:
+        partitions = next(iter(partitions_of_site.values()))
+        return run_site_pipeline(pmsFile=pmsFile,
+                                 partitions=partitions,
+                                 mrpCConfig=MRPCConfig(partitions[0]),
+                                 user=user,
+                                 dirConfig=dirConfig,
+                                 pdfSuffix="",
+                                 incremental=incremental,
+                                 instructionConfig=instructionConfig)
+
+    # 拠点どうしは受注もアップロードファイルも重ならないので、拠点ごとの処理を同時に進める
+    # ダウンロード先と出力先は拠点ごとに分け、結合した PDF も拠点ごとに名前を分ける
+    print("")
+    print(f"{len(partitions_of_site)} 件の MRP 拠点を同時に処理します")
+
+    with ThreadPoolExecutor(max_workers=len(partitions_of_site)) as executor:
+        futures: Dict[str, Future] = {}
+        for partitions in partitions_of_site.values():
+            mrp_c_config = MRPCConfig(partitions[0])
+            futures[mrp_c_config.MRPC] = executor.submit(
+                run_site_pipeline,
+                pmsFile=pmsFile,
+                partitions=partitions,
+                mrpCConfig=mrp_c_config,
+                user=user,
+                dirConfig=dirConfig.of_site(mrp_c_config.MRPC),
+                pdfSuffix=f"_{mrp_c_config.MRPC}",
+                incremental=incremental,
+                instructionConfig=instructionConfig
+            )
 
-    pms_file = read_pms_file()
+    # 失敗した拠点があっても、ほかの拠点の処理はそのまま最後まで進める
+    results: Dict[str, str] = {}
+    for mrpc, future in futures.items():
+        try:
+            results[mrpc] = "完了" if future.result() else "中止"
+        except Exception as e:
+            results[mrpc] = f"失敗: {e}"
 
     print("")
-    print(f"このファイルをもとに処理を開始します: {pms_file.fileName}")
+    print("MRP拠点ごとの処理結果")
+    for mrpc, result in results.items():
+        print(f"  {mrpc}: {result}")
+
+    return all(result == "完了" for result in results.values())
+
+
+def run_site_pipeline(pmsFile: PMSFile,
+                      partitions: Sequence[PMSPartition],
+                      mrpCConfig: MRPCConfig,
+                      user: User,
+                      dirConfig: DirConfig,
+                      pdfSuffix: str,
+                      incremental: bool = False,
+                      instructionConfig: InstructionConfig = InstructionConfig()) -> bool:
+    start = perf_counter()
+
+    # ダウンロードから出荷指示の登録まで、ログインしたブラウザをひとつだけ使う
+    # ダウンロード先は段階ごとに切り替える
+    # HTTP の経路を設定してあれば、ダウンロードとアップロードはまずそちらで行う
+    portal_config = PortalConfig()
+    with BrowserSession(driverConfig=DriverConfig(download=""),
+                        user=user) as session, \
+            PortalClient(user=user, config=portal_config) as portal:
+        try:
+            return run_site_stages(pmsFile=pmsFile,
+                                   partitions=partitions,
+                                   mrpCConfig=mrpCConfig,
+                                   user=user,
+                                   dirConfig=dirConfig,
+                                   pdfSuffix=pdfSuffix,
+                                   session=session,
+                                   portal=portal if portal_config.enabled else None,
+                                   incremental=incremental,
+                                   instructionConfig=instructionConfig)
+        finally:
+            report_browser_session(session=session,
+                                   mrpCConfig=mrpCConfig,
+                                   elapsed=perf_counter() - start)
 
-    mrp_c_config = MRPCConfig(pms_file)
-    user = User(jsonPath=DirConfig.USER_JSON_PATH)
+
+def report_browser_session(session: BrowserSession,
+                           mrpCConfig: MRPCConfig,
+                           elapsed: float):
+    print("")
+    print(f"MRP拠点 {mrpCConfig.MRPC} の処理時間: {elapsed:.1f} 秒")
+    if session.savedLaunchCount > 0:
+        print(f"  ブラウザの起動とログイン ({session.launchSeconds:.1f} 秒) を "
+              f"{session.savedLaunchCount} 回省略し、"
+              f"約 {session.savedSeconds:.1f} 秒短縮しました")
+
+
+def run_site_stages(pmsFile: PMSFile,
+                    partitions: Sequence[PMSPartition],
+                    mrpCConfig: MRPCConfig,
+                    user: User,
+                    dirConfig: DirConfig,
+                    pdfSuffix: str,
+                    session: BrowserSession,
+                    portal: Optional[PortalClient] = None,
+                    incremental: bool = False,
+                    instructionConfig: InstructionConfig = InstructionConfig()) -> bool:
+    print("")
+    print(f"MRP拠点 {mrpCConfig.MRPC} の処理を開始します")
+    for partition in partitions:
+        print(f"  出荷日 {partition.shipmentDate} 出荷倉庫 {partition.shipmentWarehouse}")
 
     print("")
     print("受注ファイルをダウンロードします")
 
-    (answered_file_path, new_file_path) = (
-        download_answered_order(mrpCConfig=mrp_c_config,
-                                user=user),
-        download_new_order(mrpCConfig=mrp_c_config,
-                           user=user)
+    (answered_file_path, new_file_path) = download_order_files(
+        mrpCConfig=mrpCConfig,
+        user=user,
+        dirConfig=dirConfig,
+        session=session,
+        portal=portal
     )
 
     print("")
     print("納期回答アップロードファイルを作成します")
 
     (do_answered, do_new, order_files, tyuumon_bangou_prefix) = output_upload_file_wrapper(
-        pmsFile=pms_file,
+        partitions=partitions,
         answeredFilePath=answered_file_path,
-        newFilePath=new_file_path
+        newFilePath=new_file_path,
+        dirConfig=dirConfig,
+        # 回答済受注は MRP 拠点ごとに前回の実行結果と比べて読む
+        incrementalKey=f"answered-{mrpCConfig.MRPC}" if incremental else None
     )
 
     if tyuumon_bangou_prefix is None:
         print("")
         print("注文番号の接頭辞が複数混在しているため、処理を中止します")
-        # print(f"このウィンドウは{BYE}秒後に自動的に閉じます")
-        # sleep(BYE)
-        input("エンターキーを押すとこのウィンドウが閉じます")
-        return
+        return False
 
     print("")
     print(f"注文番号の接頭辞は {tyuumon_bangou_prefix} のみです")
@@ -195,21 +588,65 @@ def main():
     upload_spl_wrapper(
         doAnswered=do_answered,
         doNew=do_new,
-        user=user)
+        user=user,
+        dirConfig=dirConfig,
+        session=session,
+        portal=portal)
 
     print("")
     print("出荷指示を登録します")
 
-    shipping_instruction_wrapper(
+    # 途中で止まった実行をやり直すときは、登録を確定した行を飛ばす
+    journal = RegistrationJournal(dir=dirConfig.JOURNAL_DIR,
+                                  instructionNumber=pmsFile.instructionNumber,
+                                  resume=instructionConfig.RESUME)
+
+    pdf_files = shipping_instruction_wrapper(
         orders=order_files.ordersHasNotTBDSPLRow,
-        mrpCConfig=mrp_c_config,
-        user=user
+        mrpCConfig=mrpCConfig,
+        user=user,
+        dirConfig=dirConfig,
+        session=session,
+        instructionConfig=instructionConfig,
+        journal=journal
     )
 
     print("")
     print("出荷指示書の PDF を結合します")
 
-    merge_wrapper(pmsFile=pms_file)
+    merge_wrapper(pmsFile=pmsFile, suffix=pdfSuffix, dirConfig=dirConfig,
+                  files=pdf_files)
+
+    return True
+
+
+def main(incremental: bool = False,
+         instructionConfig: InstructionConfig = InstructionConfig()):
+
+    BYE = 5
+
+    try:
+        pms_file = read_pms_file()
+    except PMSValidationError as e:
+        # ブラウザを立ち上げる前に、問題をまとめて報告して終わる
+        report_pms_violations(e)
+        input("エンターキーを押すとこのウィンドウが閉じます")
+        return
+
+    print("")
+    print(f"このファイルをもとに処理を開始します: {pms_file.fileName}")
+
+    user = User(jsonPath=DirConfig.USER_JSON_PATH)
+
+    if not run_pipeline(pmsFile=pms_file,
+                        user=user,
+                        dirConfig=DirConfig(),
+                        incremental=incremental,
+                        instructionConfig=instructionConfig):
+        # print(f"このウィンドウは{BYE}秒後に自動的に閉じます")
+        # sleep(BYE)
+        input("エンターキーを押すとこのウィンドウが閉じます")
+        return
 
     print("")
     # print(f"処理が完了しました。このウィンドウは{BYE}秒後に自動的に閉じます")
@@ -219,5 +656,78 @@ def main():
     input("エンターキーを押すとこのウィンドウが閉じます")
 
 
+def batch_main(incremental: bool = False,
+               instructionConfig: InstructionConfig = InstructionConfig()):
+    pms_file_paths = _get_files_in_dir(DirConfig.PMS_FILE_DIR, ".csv")
+    if len(pms_file_paths) == 0:
+        raise Exception(f"PMS File Not Found: {DirConfig.PMS_FILE_DIR}")
+
+    print("")
+    print(f"{len(pms_file_paths)} 件の PMS ファイルを読み込みます")
+
+    # 読み込みはファイルごとに独立しているので並列に行う
+    # ダウンロード以降は前のファイルのアップロード結果に依存するので順番に行う
+    with ProcessPoolExecutor() as executor:
+        futures: Dict[str, Future] = {
+            path: executor.submit(read_pms_file, path) for path in pms_file_paths
+        }
+
+    user = User(jsonPath=DirConfig.USER_JSON_PATH)
+
+    results: Dict[str, str] = {}
+    instruction_numbers: Dict[str, str] = {}
+    for path, future in futures.items():
+        try:
+            pms_file: PMSFile = future.result()
+
+            if pms_file.instructionNumber in instruction_numbers:
+                raise Exception(
+                    f"Duplicate Instruction Number: {pms_file.instructionNumber}"
+                )
+            instruction_numbers[pms_file.instructionNumber] = path
+
+            print("")
+            print(f"このファイルをもとに処理を開始します: {pms_file.fileName}")
+
+            done = run_pipeline(pmsFile=pms_file,
+                                user=user,
+                                dirConfig=DirConfig(pms_file.instructionNumber),
+                                incremental=incremental,
+                                instructionConfig=instructionConfig)
+            results[path] = "完了" if done else "中止"
+        except PMSValidationError as e:
+            report_path = report_pms_violations(e)
+            results[path] = f"失敗: {e} ({report_path})"
+        except Exception as e:
+            # 失敗したファイルは飛ばして次のファイルへ進む
+            print(f"処理に失敗しました: {path}: {e}")
+            results[path] = f"失敗: {e}"
+
+    print("")
+    print("処理結果")
+    for path, result in results.items():
+        print(f"  {path}: {result}")
+
+    input("エンターキーを押すとこのウィンドウが閉じます")
+
+
 if __name__ == "__main__":
-    main()
+    # exe 化したときにプロセスプールを使うために必要
+    freeze_support()
+    # --incremental: 回答済受注を前回の実行結果と比べ、変わったオーダだけ作り直す
+    incremental = "--incremental" in sys.argv[1:]
+    # --batch-registration: 注文番号と出荷日が同じ出荷指示を、まとめて登録する
+    # --workers N: N 個のブラウザで、出荷指示を並行して登録する
+    workers = None
+    if "--workers" in sys.argv[1:-1]:
+        workers = int(sys.argv[sys.argv.index("--workers") + 1])
+    # --no-resume: 前の実行で登録済みの行も、もう一度登録する
+    instruction_config = InstructionConfig(
+        batchRegistration="--batch-registration" in sys.argv[1:],
+        workers=workers,
+        resume="--no-resume" not in sys.argv[1:]
+    )
+    if "--batch" in sys.argv[1:]:
+        batch_main(incremental=incremental, instructionConfig=instruction_config)
+    else:
+        main(incremental=incremental, instructionConfig=instruction_config)
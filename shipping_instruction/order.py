@@ -1,37 +1,103 @@
-from dataclasses import dataclass, field
+import sys
+from array import array
+from dataclasses import dataclass
 from datetime import date
-from os import truncate
+from itertools import repeat
 from pathlib import Path
-from typing import ClassVar, Dict, List, Optional, Set
+from typing import (Any, Callable, ClassVar, Dict, Iterable, List, Optional,
+                    Sequence, Set, Tuple)
 
 from xlrd import open_workbook, sheet, xldate
-from xlwt import Workbook, Worksheet
+from xlwt import Style, Workbook, Worksheet
+from xlwt.Cell import BlankCell, NumberCell, StrCell
 
+from shipping_instruction.allocation import allocate
+from shipping_instruction.cache import SnapshotCache
 from shipping_instruction.config import OrderFileColumnConfingBase
-from shipping_instruction.pms import PMSFile, PMSRow
+from shipping_instruction.pms import PMSPartition, PMSRow, PMSRowsOfKata
 from shipping_instruction.util import _init_dir
 
 
-@dataclass
 class Order:
+    # 受注ファイルには数万件のオーダがあるので、属性は __slots__ で持つ
+    # (Python 3.8 では dataclass に slots を指定できない)
+    __slots__ = ("orderID", "orderNumber", "tyuumonBangou", "kata",
+                 "orderQty", "isNew", "releasedQty",
+                 "releasedRows", "notReleasedRows",
+                 "__splRows", "__notTBDSPLRowCount", "__updatedReleasedQty")
+
     __DEFAULT_UPDATED_RELEASED_QTY: ClassVar[int] = 0
 
     __TYUUMON_BANGOU_PREFIX_LEN = 2
 
-    orderID: str
-    orderNumber: str
-    tyuumonBangou: str
-    kata: str
-    orderQty: int
-    isNew: bool
-    releasedQty: int
-    splRows: List["SPLRow"] = field(default_factory=list)
-    releasedRows: List[int] = field(default_factory=list)
-    notReleasedRows: List[int] = field(default_factory=list)
-
-    def __post_init__(self):
+    def __init__(self,
+                 orderID: str,
+                 orderNumber: str,
+                 tyuumonBangou: str,
+                 kata: str,
+                 orderQty: int,
+                 isNew: bool,
+                 releasedQty: int,
+                 splRows: Sequence["SPLRow"] = (),
+                 releasedRows: Optional[List[int]] = None,
+                 notReleasedRows: Optional[List[int]] = None):
+        self.orderID = orderID
+        self.orderNumber = orderNumber
+        self.tyuumonBangou = tyuumonBangou
+        self.kata = sys.intern(kata)
+        self.orderQty = orderQty
+        self.isNew = isNew
+        self.releasedQty = releasedQty
+        self.releasedRows = [] if releasedRows is None else releasedRows
+        self.notReleasedRows = [] if notReleasedRows is None \
+            else notReleasedRows
+        self.splRows = splRows
         self.__updatedReleasedQty = self.__DEFAULT_UPDATED_RELEASED_QTY
 
+    def __repr__(self) -> str:
+        return (f"Order(orderID={self.orderID!r}, "
+                f"orderNumber={self.orderNumber!r}, "
+                f"tyuumonBangou={self.tyuumonBangou!r}, "
+                f"kata={self.kata!r}, orderQty={self.orderQty!r}, "
+                f"isNew={self.isNew!r}, releasedQty={self.releasedQty!r}, "
+                f"splRows={self.splRows!r}, "
+                f"releasedRows={self.releasedRows!r}, "
+                f"notReleasedRows={self.notReleasedRows!r})")
+
+    def __eq__(self, other: Any) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self.__fields() == other.__fields()
+
+    def __fields(self) -> Tuple[Any, ...]:
+        return (self.orderID, self.orderNumber, self.tyuumonBangou, self.kata,
+                self.orderQty, self.isNew, self.releasedQty, self.splRows,
+                self.releasedRows, self.notReleasedRows)
+
+    @property
+    def splRows(self) -> Sequence["SPLRow"]:
+        return self.__splRows
+
+    @splRows.setter
+    def splRows(self, value: Sequence["SPLRow"]):
+        # SPL 行が付くオーダは一部なので、リストは行を足すときに作る
+        # 付け足しは append_spl_row で行う
+        self.__splRows: Sequence[SPLRow] = ()
+        self.__notTBDSPLRowCount = 0
+        for spl_row in value:
+            self.append_spl_row(spl_row)
+
+    def append_spl_row(self, splRow: "SPLRow"):
+        # TBD でない行の数は、行を足すときに一緒に数える
+        if not self.__splRows:
+            self.__splRows = []
+        self.__splRows.append(splRow)  # type: ignore
+        if not splRow.isTBD:
+            self.__notTBDSPLRowCount += 1
+
+    def reset_spl_rows(self):
+        self.splRows = []
+
     @property
     def updatedReleasedQty(self) -> int:
         return self.__updatedReleasedQty
@@ -48,31 +114,25 @@ class Order:
 
     @property
     def isUpdateDone(self) -> bool:
-        return self.updatedReleasedQty == self.releasedQty
+        return self.__updatedReleasedQty == self.releasedQty
 
     @property
     def notUpdatedShipmentQty(self) -> int:
-        return self.releasedQty - self.updatedReleasedQty
+        return self.releasedQty - self.__updatedReleasedQty
 
     @property
     def hasNotTBDSPLRow(self) -> bool:
-        return len(self.notTBDSPLRows) >= 1
+        return self.__notTBDSPLRowCount >= 1
 
     @property
     def originalRows(self) -> List[int]:
-        original_rows = []
-        original_rows.extend(self.releasedRows)
-        original_rows.extend(self.notReleasedRows)
-        return original_rows
+        return self.releasedRows + self.notReleasedRows
 
     @property
     def notTBDSPLRows(self) -> List["SPLRow"]:
-        not_tbd_spl_rows = []
-        for spl_row in self.splRows:
-            if not spl_row.isTBD:
-                not_tbd_spl_rows.append(spl_row)
-
-        return not_tbd_spl_rows
+        if self.__notTBDSPLRowCount == len(self.__splRows):
+            return list(self.__splRows)
+        return [spl_row for spl_row in self.__splRows if not spl_row.isTBD]
 
     @property
     def tyuumonBangouPrefix(self) -> str:
@@ -82,10 +142,40 @@ class Order:
 class OrderFile:
     __SUFFIX = ".xls"
 
+    # 読み込みと出力で使う列 (設定にない列は読まない)
+    __STORED_COLUMNS = ["SAKUJO_F",
+                        "JUTYUU_ID",
+                        "JUTYUU_ORDER_BANGOU",
+                        "TYUUMON_BANGOU",
+                        "KATABAN",
+                        "JUTYUU_SUU",
+                        "JUTYUU_RECORD_KOUSHIN_BI",
+                        "NOUKI_KAITOU_HDR_RECORD_KOUSHIN_BI",
+                        "NOUKI_KAITOU_DTL_RECORD_KOUSHIN_BI",
+                        "NOUKI_KAITOU_DID",
+                        "SYUKKA_STATUS",
+                        "HINBAN",
+                        "KAITOU_SUU",
+                        "KAITOU_SYUKKA_BI",
+                        "MOKUHYOU_NOUKI",
+                        "HIKARI_MRP_KAITOU_NOUKI",
+                        "SPEC_TYOKUSOU",
+                        "NAMAMUGI",
+                        "SYUKKA_SOUKO",
+                        "YOTAKUSAKI_SOUKO",
+                        "TEISEI_RIYUU_C",
+                        "TEISEI_RIYUU_SYOSAI_NAIYOU",
+                        "TYUUSYAKU"]
+
+    # 読み込み結果の形が変わったら上げる (キャッシュを無効にする)
+    __CACHE_VERSION = 3
+
     def __init__(self,
                  isNew: bool,
                  path: str,
-                 config: OrderFileColumnConfingBase):
+                 config: OrderFileColumnConfingBase,
+                 cache: Optional[SnapshotCache] = None,
+                 incrementalKey: Optional[str] = None):
 
         path_p = Path(path)
         if not path_p.is_file():
@@ -98,93 +188,260 @@ class OrderFile:
         C = self.OrderColumns = config
 
         self.isNew = isNew
+
+        self.__ordersOfKata: Optional[Dict[str, List[Order]]] = None
+        self.__releasedQtyOfKata: Optional[Dict[str, int]] = None
+        self.__ordersHasNotTBDSPLRow: Optional[List[Order]] = None
+
+        # 同じファイルを前に読んでいたら、そのときの結果を使う
+        cache_key = ""
+        if cache is not None:
+            cache_key = cache.key(path,
+                                  f"{self.__CACHE_VERSION}-{self.isNew}",
+                                  C)
+            snapshot = cache.load(cache_key)
+            if snapshot is not None:
+                (self.__datemode, self.__rows, self.__columnPosition,
+                 self.orders) = snapshot
+                self.orderOfID = {order.orderID: order
+                                  for order in self.orders}
+                self.reusedOrderCount = len(self.orders)
+                return
+
+        # 差分読み込みは前回の実行で保存したオーダと比べ、
+        # 変わっていないオーダは作り直さずに使う
+        previous = None
+        if cache is not None and incrementalKey is not None:
+            previous = self.__previous_snapshot(cache.load(incrementalKey))
+
+        self.__load(path, previous)
+
+        if cache is not None:
+            cache.save(cache_key, (self.__datemode, self.__rows,
+                                   self.__columnPosition, self.orders))
+            if incrementalKey is not None:
+                cache.save(incrementalKey, self.__incremental_snapshot())
+
+    def __load(self,
+               path: str,
+               previous: Optional[Tuple[int, Dict[str, Any]]] = None):
+        C = self.OrderColumns
+
+        # 書式は出力に使わないので読まない
+        # 設定にある列だけを取り出したら、ワークブックはすぐに解放する
         workbook = open_workbook(filename=path,
-                                 formatting_info=True,
+                                 formatting_info=False,
                                  on_demand=True)
-        self.worksheet: sheet.Sheet = workbook.sheet_by_name(C.SHEET)
-        sh = self.worksheet
+        try:
+            sh = workbook.sheet_by_name(C.SHEET)
+            self.__datemode: int = workbook.datemode
+            if previous is None:
+                self.__rows, self.__columnPosition = \
+                    self.__extract_rows(sh, self.__stored_columns(C))
+                self.orders = []
+                self.orderOfID = {}
+                self.reusedOrderCount = 0
+                self.__build_orders(range(1, len(self.__rows)))
+            else:
+                self.__load_incremental(sh, previous)
+        finally:
+            workbook.release_resources()
+            del workbook
 
-        # オーダごとのリリース数量を調べるために ID が必要
-        order_ids: Set[str] = set()
+        if len(self.orders) == 0:
+            raise Exception("No Data In Order File")
+
+    def __load_incremental(self,
+                           sh: sheet.Sheet,
+                           previous: Tuple[int, Dict[str, Any]]):
+        C = self.OrderColumns
+        columns = self.__stored_columns(C)
+        self.__columnPosition = {col: pos for pos, col in enumerate(columns)}
+
+        # 日付の基準が違うと前回の値はそのまま使えない
+        previous_datemode, previous_orders = previous
+        if previous_datemode != self.__datemode:
+            previous_orders = {}
+
+        # ヘッダしかない (空の) ファイルは、全部を作り直すときと同じくオーダなしにする
+        if sh.nrows <= 1:
+            self.__rows, _ = self.__extract_rows(sh, columns)
+            self.__rowsOfID = {}
+            self.orders = []
+            self.orderOfID = {}
+            self.reusedOrderCount = 0
+            return
+
+        # 取り出す列を列ごとにまとめて読み、行に組み直す
+        data_rows = sh.nrows - 1
+        column_values = [sh.col_values(col, 1) if col < sh.ncols else [""] * data_rows
+                         for col in columns]
+        self.__rows = [self.__project(sh.row_values(0), columns)]
+        self.__rows.extend(zip(*column_values))
+
+        ID = self.__columnPosition[C.JUTYUU_ID]
+        rows_of_id: Dict[str, List[int]] = {}
         for row in range(1, sh.nrows):
-            order_ids.add(
-                str(int(sh.cell(row, C.JUTYUU_ID).value))
-            )
+            rows_of_id.setdefault(str(int(self.__rows[row][ID])), []).append(row)
+        self.__rowsOfID = rows_of_id
 
+        STATUS = self.__columnPosition.get(C.SYUKKA_STATUS)
         self.orders: List[Order] = []
-        for order_id in order_ids:
-            for row in range(1, sh.nrows):
-                tmp_order_id = str(int(sh.cell(row, C.JUTYUU_ID).value))
-                if order_id == tmp_order_id:
-                    order_qty = int(sh.cell(row, C.JUTYUU_SUU).value)
-                    default_released_qty = order_qty if self.isNew else 0
-                    order = Order(orderID=order_id,
-                                  orderNumber=str(
-                                      int(sh.cell(row, C.JUTYUU_ORDER_BANGOU).value)
-                                  ),
-                                  tyuumonBangou=str(
-                                      sh.cell(row, C.TYUUMON_BANGOU).value
-                                  ),
-                                  kata=str(sh.cell(row, C.KATABAN).value),
-                                  orderQty=order_qty,
-                                  isNew=self.isNew,
-                                  releasedQty=default_released_qty)
-                    self.orders.append(order)
-                    break
+        self.orderOfID: Dict[str, Order] = {}
+        changed_rows: List[int] = []
+        for order_id, rows in rows_of_id.items():
+            # 取り出した列のどれかひとつでも前回と違えば、オーダを作り直す
+            entry = previous_orders.get(order_id)
+            if entry is None or entry[1] != [self.__rows[row] for row in rows]:
+                changed_rows.extend(rows)
+                continue
 
-        if not self.isNew:
-            for order in self.orders:
-                for row in range(1, sh.nrows):
-                    tmp_order_id = str(int(sh.cell(row, C.JUTYUU_ID).value))
-                    if tmp_order_id == order.orderID:
-                        tmp_status = str(sh.cell(row, C.SYUKKA_STATUS).value)
-                        if tmp_status == C.RELEASED_VAL:
-                            released_qty = int(
-                                sh.cell(row, C.KAITOU_SUU).value
-                            )
-                            order.releasedQty += released_qty
-                            order.releasedRows.append(row)
-                        else:
-                            order.notReleasedRows.append(row)
+            # 変わっていないオーダは前回のオーダをそのまま使う
+            # 行番号だけは今回のファイルに合わせる
+            order, stored_rows = entry
+            order.releasedRows = []
+            order.notReleasedRows = []
+            for row, values in zip(rows, stored_rows):
+                if self.isNew:
+                    continue
+                if str(values[STATUS]) == C.RELEASED_VAL:
+                    order.releasedRows.append(row)
+                else:
+                    order.notReleasedRows.append(row)
+            self.orderOfID[order_id] = order
 
-        if len(self.orders) == 0:
-            raise Exception("No Data In Order File")
+        self.reusedOrderCount = len(self.orderOfID)
+        self.__build_orders(sorted(changed_rows))
+
+        # オーダの並びはファイルに最初に出てくる順のまま
+        self.orders = [self.orderOfID[order_id] for order_id in rows_of_id]
+
+    def __build_orders(self, rows: Iterable[int]):
+        C = self.OrderColumns
+        ID = self.__columnPosition[C.JUTYUU_ID]
+        SUU = self.__columnPosition[C.JUTYUU_SUU]
+        ORDER_BANGOU = self.__columnPosition[C.JUTYUU_ORDER_BANGOU]
+        TYUUMON_BANGOU = self.__columnPosition[C.TYUUMON_BANGOU]
+        KATABAN = self.__columnPosition[C.KATABAN]
+
+        # 一度だけ全行を読み、受注 ID ごとにまとめる
+        # ID ごとの最初の行からオーダを作り、リリース数量はその都度足していく
+        for row in rows:
+            values = self.__rows[row]
+            order_id = str(int(values[ID]))
+            order = self.orderOfID.get(order_id)
+            if order is None:
+                order_qty = int(values[SUU])
+                default_released_qty = order_qty if self.isNew else 0
+                order = Order(orderID=order_id,
+                              orderNumber=str(int(values[ORDER_BANGOU])),
+                              tyuumonBangou=str(values[TYUUMON_BANGOU]),
+                              kata=str(values[KATABAN]),
+                              orderQty=order_qty,
+                              isNew=self.isNew,
+                              releasedQty=default_released_qty)
+                self.orderOfID[order_id] = order
+                self.orders.append(order)
+
+            if self.isNew:
+                continue
+
+            tmp_status = str(values[self.__columnPosition[C.SYUKKA_STATUS]])
+            if tmp_status == C.RELEASED_VAL:
+                released_qty = int(
+                    values[self.__columnPosition[C.KAITOU_SUU]]
+                )
+                order.releasedQty += released_qty
+                order.releasedRows.append(row)
+            else:
+                order.notReleasedRows.append(row)
+
+    def __previous_snapshot(self, snapshot: Any) -> Tuple[int, Dict[str, Any]]:
+        # 初回や、読み込み方・列の設定が前回と違うときは全オーダを作る
+        columns = self.__stored_columns(self.OrderColumns)
+        column_position = {col: pos for pos, col in enumerate(columns)}
+        if snapshot is not None:
+            version, previous_position, datemode, orders = snapshot
+            if (version == f"{self.__CACHE_VERSION}-{self.isNew}"
+                    and previous_position == column_position):
+                return (datemode, orders)
+        return (-1, {})
+
+    def __incremental_snapshot(self) -> Tuple[Any, ...]:
+        # 計画で書き換わる前のオーダを、変更の判定に使う行と一緒に残す
+        orders: Dict[str, Any] = {}
+        for order in self.orders:
+            orders[order.orderID] = (order,
+                                     [self.__rows[row]
+                                      for row in self.__rowsOfID[order.orderID]])
+        return (f"{self.__CACHE_VERSION}-{self.isNew}",
+                self.__columnPosition, self.__datemode, orders)
+
+    @classmethod
+    def __stored_columns(cls, config: OrderFileColumnConfingBase) -> List[int]:
+        columns: Set[int] = set()
+        for name in cls.__STORED_COLUMNS:
+            col = getattr(config, name)
+            if col is not None:
+                columns.add(col)
+        return sorted(columns)
+
+    @staticmethod
+    def __project(values: List[Any], columns: List[int]) -> Tuple[Any, ...]:
+        if len(values) > columns[-1]:
+            return tuple(values[col] for col in columns)
+        return tuple(values[col] if col < len(values) else ""
+                     for col in columns)
+
+    @staticmethod
+    def __extract_rows(sh: sheet.Sheet,
+                       columns: List[int]) -> Tuple[List[Tuple[Any, ...]], Dict[int, int]]:
+        # 行番号はシートの行番号のまま (0 行目はヘッダ)
+        column_position = {col: pos for pos, col in enumerate(columns)}
+        rows: List[Tuple[Any, ...]] = []
+        for row in range(sh.nrows):
+            rows.append(OrderFile.__project(sh.row_values(row), columns))
+        return (rows, column_position)
 
     @property
     def katas(self) -> List[str]:
-        katas: Set[str] = set()
-        for order in self.orders:
-            katas.add(order.kata)
-        return list(katas)
+        return list(self.ordersOfKata.keys())
 
     @property
     def ordersOfKata(self) -> Dict[str, List[Order]]:
-        orders_of_kata: Dict[str, List[Order]] = {}
-        for kata in self.katas:
-            orders: List[Order] = []
+        # 読み込んだあとはオーダが増減しないので、初めて使うときに一度だけ作る
+        if self.__ordersOfKata is None:
+            orders_of_kata: Dict[str, List[Order]] = {}
             for order in self.orders:
-                if kata == order.kata:
-                    orders.append(order)
-            orders_of_kata[kata] = orders
-        return orders_of_kata
+                orders_of_kata.setdefault(order.kata, []).append(order)
+            self.__ordersOfKata = orders_of_kata
+        return self.__ordersOfKata
 
     @property
     def releasedQtyOfKata(self) -> Dict[str, int]:
-        released_qty_of_kata: Dict[str, int] = {}
-        for kata, orders in self.ordersOfKata.items():
-            released_qty = 0
-            for order in orders:
-                released_qty += order.releasedQty
-            released_qty_of_kata[kata] = released_qty
-        return released_qty_of_kata
+        if self.__releasedQtyOfKata is None:
+            released_qty_of_kata: Dict[str, int] = {}
+            for kata, orders in self.ordersOfKata.items():
+                released_qty = 0
+                for order in orders:
+                    released_qty += order.releasedQty
+                released_qty_of_kata[kata] = released_qty
+            self.__releasedQtyOfKata = released_qty_of_kata
+        return self.__releasedQtyOfKata
 
     @property
     def ordersHasNotTBDSPLRow(self) -> List[Order]:
-        orders_has_not_tbd_rows: List[Order] = list()
-        for order in self.orders:
-            if order.hasNotTBDSPLRow:
-                orders_has_not_tbd_rows.append(order)
-        return orders_has_not_tbd_rows
+        # SPL 行を付け直したら _reset_orders_has_not_tbd_spl_row で作り直す
+        if self.__ordersHasNotTBDSPLRow is None:
+            orders_has_not_tbd_rows: List[Order] = list()
+            for order in self.orders:
+                if order.hasNotTBDSPLRow:
+                    orders_has_not_tbd_rows.append(order)
+            self.__ordersHasNotTBDSPLRow = orders_has_not_tbd_rows
+        return self.__ordersHasNotTBDSPLRow
+
+    def _reset_orders_has_not_tbd_spl_row(self):
+        self.__ordersHasNotTBDSPLRow = None
 
     def _get_valid_tyuumou_bangou_prefix(self) -> Optional[str]:
         if len(self.ordersHasNotTBDSPLRow) == 0:
@@ -218,125 +475,61 @@ class OrderFile:
 
         C = self.OrderColumns
 
-        rd_sh = self.worksheet
         wt_wb: Workbook = Workbook()
         wt_sh: Worksheet = wt_wb.add_sheet(C.SHEET)
 
+        # 列ごとの変換は一度だけ決めておき、行ごとには分岐しない
+        copy_plan = self.__compile_copy_plan()
+        to_str = self.__memoize(self.__to_str)
+        released_cells: List[Tuple[int, str]] = []
+        if not self.isNew:
+            released_cells = [(C.SAKUJO_F, C.DELETE_VAL),
+                              (C.TEISEI_RIYUU_SYOSAI_NAIYOU, C.TEISEKI_RIYUU_VAL)]
+        spl_cells: List[Tuple[int, str]] = []
+        if not self.isNew:
+            spl_cells.append((C.TEISEI_RIYUU_SYOSAI_NAIYOU, C.TEISEKI_RIYUU_VAL))
+        spl_cells.append((C.TYUUSYAKU, C.TYUUSYAKU_VAL))
+        date_strs: Dict[Optional[date], str] = {None: ""}
+
+        rows = self.__rows
+        TEISEI_RIYUU_SYOSAI_NAIYOU = \
+            self.__columnPosition.get(C.TEISEI_RIYUU_SYOSAI_NAIYOU)
+
+        # 1 行分のセルをまとめてから、その行に書く
+        write_row = self.__row_writer(wt_wb, wt_sh)
         wt_row = 1
         for order in self.ordersHasNotTBDSPLRow:
+            released_rows = set(order.releasedRows)
             for org_row in order.originalRows:
-                wt_sh.write(wt_row, C.JUTYUU_ID,
-                            order.orderID)
-
-                self.__copy_column(sheetFrom=rd_sh, sheetTo=wt_sh,
-                                   rowFrom=org_row, rowTo=wt_row,
-                                   col=C.JUTYUU_RECORD_KOUSHIN_BI,
-                                   asDatetime=True)
-
-                self.__copy_column(sheetFrom=rd_sh, sheetTo=wt_sh,
-                                   rowFrom=org_row, rowTo=wt_row,
-                                   col=C.NOUKI_KAITOU_HDR_RECORD_KOUSHIN_BI,
-                                   asDatetime=True)
-
-                self.__copy_column(sheetFrom=rd_sh, sheetTo=wt_sh,
-                                   rowFrom=org_row, rowTo=wt_row,
-                                   col=C.NOUKI_KAITOU_DTL_RECORD_KOUSHIN_BI,
-                                   asDatetime=True)
-
-                self.__copy_column(sheetFrom=rd_sh, sheetTo=wt_sh,
-                                   rowFrom=org_row, rowTo=wt_row,
-                                   col=C.NOUKI_KAITOU_DID)
-
-                self.__copy_column(sheetFrom=rd_sh, sheetTo=wt_sh,
-                                   rowFrom=org_row, rowTo=wt_row,
-                                   col=C.HINBAN)
-
-                self.__copy_column(sheetFrom=rd_sh, sheetTo=wt_sh,
-                                   rowFrom=org_row, rowTo=wt_row,
-                                   col=C.KAITOU_SUU)
-
-                self.__copy_column(sheetFrom=rd_sh, sheetTo=wt_sh,
-                                   rowFrom=org_row, rowTo=wt_row,
-                                   col=C.KAITOU_SYUKKA_BI,
-                                   asDate=True)
-
-                self.__copy_column(sheetFrom=rd_sh, sheetTo=wt_sh,
-                                   rowFrom=org_row, rowTo=wt_row,
-                                   col=C.MOKUHYOU_NOUKI,
-                                   asDate=True)
-
-                self.__copy_column(sheetFrom=rd_sh, sheetTo=wt_sh,
-                                   rowFrom=org_row, rowTo=wt_row,
-                                   col=C.HIKARI_MRP_KAITOU_NOUKI,
-                                   asDate=True)
-
-                self.__copy_column(sheetFrom=rd_sh, sheetTo=wt_sh,
-                                   rowFrom=org_row, rowTo=wt_row,
-                                   col=C.SPEC_TYOKUSOU)
-
-                self.__copy_column(sheetFrom=rd_sh, sheetTo=wt_sh,
-                                   rowFrom=org_row, rowTo=wt_row,
-                                   col=C.NAMAMUGI)
-
-                self.__copy_column(sheetFrom=rd_sh, sheetTo=wt_sh,
-                                   rowFrom=org_row, rowTo=wt_row,
-                                   col=C.SYUKKA_SOUKO)
-
-                self.__copy_column(sheetFrom=rd_sh, sheetTo=wt_sh,
-                                   rowFrom=org_row, rowTo=wt_row,
-                                   col=C.YOTAKUSAKI_SOUKO)
-
-                self.__copy_column(sheetFrom=rd_sh, sheetTo=wt_sh,
-                                   rowFrom=org_row, rowTo=wt_row,
-                                   col=C.TEISEI_RIYUU_C)
-
-                self.__copy_column(sheetFrom=rd_sh, sheetTo=wt_sh,
-                                   rowFrom=org_row, rowTo=wt_row,
-                                   col=C.TYUUSYAKU)
-
-                if org_row in order.releasedRows:
-                    wt_sh.write(wt_row, C.SAKUJO_F,
-                                C.DELETE_VAL)
-                    wt_sh.write(wt_row, C.TEISEI_RIYUU_SYOSAI_NAIYOU,
-                                C.TEISEKI_RIYUU_VAL)
+                values = rows[org_row]
+                cells: List[Tuple[int, Any]] = [(C.JUTYUU_ID, order.orderID)]
+                for (col, pos, convert) in copy_plan:
+                    cells.append((col, convert(values[pos])))
+
+                if org_row in released_rows:
+                    cells.extend(released_cells)
                 else:
-                    self.__copy_column(sheetFrom=rd_sh, sheetTo=wt_sh,
-                                       rowFrom=org_row, rowTo=wt_row,
-                                       col=C.TEISEI_RIYUU_SYOSAI_NAIYOU)
+                    cells.append((C.TEISEI_RIYUU_SYOSAI_NAIYOU,
+                                  to_str(values[TEISEI_RIYUU_SYOSAI_NAIYOU])))
 
+                write_row(wt_row, cells)
                 wt_row += 1
 
             for spl_row in order.splRows:
-                wt_sh.write(wt_row, C.JUTYUU_ID,
-                            order.orderID)
-
-                wt_sh.write(wt_row, C.HINBAN,
-                            spl_row.hin)
-
-                wt_sh.write(wt_row, C.KAITOU_SUU,
-                            spl_row.shipmentQty)
-
-                if spl_row.shipmentDate is None:
-                    wt_sh.write(wt_row, C.KAITOU_SYUKKA_BI,
-                                "")
-                    wt_sh.write(wt_row, C.MOKUHYOU_NOUKI,
-                                "")
-                else:
-                    wt_sh.write(wt_row, C.KAITOU_SYUKKA_BI,
-                                str(spl_row.shipmentDate))
-                    wt_sh.write(wt_row, C.MOKUHYOU_NOUKI,
-                                str(spl_row.shipmentDate))
-
-                wt_sh.write(wt_row, C.SYUKKA_SOUKO,
-                            spl_row.shipmentWarehouse)
-
-                if not self.isNew:
-                    wt_sh.write(wt_row, C.TEISEI_RIYUU_SYOSAI_NAIYOU,
-                                C.TEISEKI_RIYUU_VAL)
-
-                wt_sh.write(wt_row, C.TYUUSYAKU,
-                            C.TYUUSYAKU_VAL)
-
+                shipment_date = date_strs.get(spl_row.shipmentDate)
+                if shipment_date is None:
+                    shipment_date = date_strs[spl_row.shipmentDate] = \
+                        str(spl_row.shipmentDate)
+
+                cells = [(C.JUTYUU_ID, order.orderID),
+                         (C.HINBAN, spl_row.hin),
+                         (C.KAITOU_SUU, spl_row.shipmentQty),
+                         (C.KAITOU_SYUKKA_BI, shipment_date),
+                         (C.MOKUHYOU_NOUKI, shipment_date),
+                         (C.SYUKKA_SOUKO, spl_row.shipmentWarehouse)]
+                cells.extend(spl_cells)
+
+                write_row(wt_row, cells)
                 wt_row += 1
 
         if wt_row >= 2:
@@ -345,52 +538,108 @@ class OrderFile:
         else:
             return False
 
-    @classmethod
-    def __copy_column(cls,
-                      sheetFrom: sheet.Sheet,
-                      sheetTo: Worksheet,
-                      rowFrom: int,
-                      rowTo: int,
-                      col: Optional[int],
-                      asDate: bool = False,
-                      asDatetime: bool = False) -> str:
-
-        def __wt(value: str):
-            sheetTo.write(rowTo, col,
-                          value)
-
-        value = sheetFrom.cell(rowFrom, col).value
+    @staticmethod
+    def __row_writer(wt_wb: Workbook,
+                     wt_sh: Worksheet) -> Callable[[int, List[Tuple[int, Any]]], None]:
+        # Worksheet.write はセルごとに書式を登録し直すので、書式の番号は一度だけ求める
+        # 行の左端と右端の列だけは Row.write で書き、行とシートの列の範囲を更新させる
+        xf = wt_wb.add_style(Style.default_style)
+        add_str = wt_wb.add_str
+
+        def write_row(rowx: int, cells: List[Tuple[int, Any]]):
+            row = wt_sh.row(rowx)
+            first_col = last_col = cells[0][0]
+            for (col, _) in cells:
+                if col < first_col:
+                    first_col = col
+                elif col > last_col:
+                    last_col = col
+
+            for (col, value) in cells:
+                if col == first_col or col == last_col:
+                    row.write(col, value)
+                elif value.__class__ is str:
+                    if value == "":
+                        row.insert_cell(col, BlankCell(rowx, col, xf))
+                    else:
+                        row.insert_cell(col,
+                                        StrCell(rowx, col, xf, add_str(value)))
+                elif value.__class__ is int or value.__class__ is float:
+                    row.insert_cell(col, NumberCell(rowx, col, xf, value))
+                else:
+                    row.write(col, value)
+
+        return write_row
+
+    def __compile_copy_plan(self) -> List[Tuple[int, int, Callable[[Any], str]]]:
+        # 元の行から写す列と変換 (日付・日時・文字列) の組
+        # 同じ値 (日付のシリアル値など) の変換は一度だけ行う
+        C = self.OrderColumns
+        to_datetime_str = self.__memoize(self.__to_datetime_str)
+        to_date_str = self.__memoize(self.__to_date_str)
+        to_str = self.__memoize(self.__to_str)
+        plan = [(C.JUTYUU_RECORD_KOUSHIN_BI, to_datetime_str),
+                (C.NOUKI_KAITOU_HDR_RECORD_KOUSHIN_BI, to_datetime_str),
+                (C.NOUKI_KAITOU_DTL_RECORD_KOUSHIN_BI, to_datetime_str),
+                (C.NOUKI_KAITOU_DID, to_str),
+                (C.HINBAN, to_str),
+                (C.KAITOU_SUU, to_str),
+                (C.KAITOU_SYUKKA_BI, to_date_str),
+                (C.MOKUHYOU_NOUKI, to_date_str),
+                (C.HIKARI_MRP_KAITOU_NOUKI, to_date_str),
+                (C.SPEC_TYOKUSOU, to_str),
+                (C.NAMAMUGI, to_str),
+                (C.SYUKKA_SOUKO, to_str),
+                (C.YOTAKUSAKI_SOUKO, to_str),
+                (C.TEISEI_RIYUU_C, to_str),
+                (C.TYUUSYAKU, to_str)]
+        return [(col, self.__columnPosition[col], convert)
+                for (col, convert) in plan
+                if col is not None]
+
+    @staticmethod
+    def __memoize(convert: Callable[[Any], str]) -> Callable[[Any], str]:
+        converted: Dict[Any, str] = {}
+
+        def memoized(value: Any) -> str:
+            new_value = converted.get(value)
+            if new_value is None:
+                new_value = converted[value] = convert(value)
+            return new_value
+
+        return memoized
+
+    def __to_datetime_str(self, value: Any) -> str:
         if value == "":
-            __wt("")
             return ""
+        return str(xldate.xldate_as_datetime(value, self.__datemode))
 
-        if asDate:
-            newValue = str(xldate.xldate_as_datetime(
-                value, sheetFrom.book.datemode).date())
-            __wt(newValue)
-            return newValue
-
-        if asDatetime:
-            newValue = str(xldate.xldate_as_datetime(
-                value, sheetFrom.book.datemode))
-            __wt(newValue)
-            return newValue
+    def __to_date_str(self, value: Any) -> str:
+        if value == "":
+            return ""
+        return str(xldate.xldate_as_datetime(value, self.__datemode).date())
 
+    @staticmethod
+    def __to_str(value: Any) -> str:
+        if value == "":
+            return ""
         try:
-            newValue = str(int(value))
+            return str(int(value))
         except ValueError:
-            newValue = str(value)
-        __wt(newValue)
-        return newValue
+            return str(value)
 
 
 @dataclass
 class SPLRow(PMSRow):
+    __slots__ = ("isTBD", "__copiedShipmentQty")
+
     __DEFAULT_COPIED_SHIPMENT_QTY: ClassVar[int] = 0
 
     isTBD: bool
 
     def __post_init__(self):
+        self.kata = sys.intern(self.kata)
+        self.hin = sys.intern(self.hin)
         self.__copiedShipmentQty = self.__DEFAULT_COPIED_SHIPMENT_QTY
 
     @property
@@ -428,7 +677,11 @@ class OrderFiles:
         if len(files) == 0:
             raise Exception("No Files")
 
-        self.__files = files
+        self.__files: List[OrderFile] = []
+        self.__ordersOfKata: Dict[str, List[Order]] = {}
+        self.__releasedQtyOfKata: Dict[str, int] = {}
+        for file in files:
+            self.__add_order_file(file)
 
     def append_order_file(self, orderFile: OrderFile):
         if len(self.__files) >= self.__FILES_LIMIT:
@@ -436,7 +689,16 @@ class OrderFiles:
                 f"Number of Files Over Limit: {self.__FILES_LIMIT}"
             )
 
+        self.__add_order_file(orderFile)
+
+    def __add_order_file(self, orderFile: OrderFile):
+        # 型ごとの索引はファイルを足すたびに、足したファイルの分だけ更新する
         self.__files.append(orderFile)
+        for kata, orders in orderFile.ordersOfKata.items():
+            self.__ordersOfKata.setdefault(kata, []).extend(orders)
+        for kata, released_qty in orderFile.releasedQtyOfKata.items():
+            self.__releasedQtyOfKata[kata] = \
+                self.__releasedQtyOfKata.get(kata, 0) + released_qty
 
     def get_valid_tyuumou_bangou_prefix(self) -> Optional[str]:
         prefixes: List[str] = []
@@ -475,43 +737,53 @@ class OrderFiles:
 
     @property
     def ordersOfKata(self) -> Dict[str, List[Order]]:
-        orders_of_kata: Dict[str, List[Order]] = {}
-        for file in self.files:
-            for kata, orders in file.ordersOfKata.items():
-                if kata in orders_of_kata:
-                    orders_of_kata[kata].extend(orders)
-                else:
-                    orders_of_kata[kata] = orders
-        return orders_of_kata
+        return self.__ordersOfKata
 
     @property
     def releasedQtyOfKata(self) -> Dict[str, int]:
-        released_qty_of_kata: Dict[str, int] = {}
-        for file in self.files:
-            for kata, released_qty in file.releasedQtyOfKata.items():
-                if kata in released_qty_of_kata:
-                    released_qty_of_kata[kata] += released_qty
-                else:
-                    released_qty_of_kata[kata] = released_qty
-        return released_qty_of_kata
+        return self.__releasedQtyOfKata
 
-    def apply_shipping_plan(self, pmsFile: PMSFile):
-        for kata, pms_rows_of_a_kata in pmsFile.pmsRowsOfKata.items():
-            tbd_qty = self.releasedQtyOfKata[kata] - \
-                pms_rows_of_a_kata.shipmentQty
+    def apply_shipping_plan(self,
+                            partitions: Sequence[PMSPartition],
+                            columnar: bool = False):
+        # columnar: 型ごとに引き当てず、全部の型を配列にしてまとめて引き当てる
+        for file in self.__files:
+            file._reset_orders_has_not_tbd_spl_row()
+
+        # 同じ型の出荷が複数の出荷日・出荷倉庫にまたがることがある
+        pms_rows_of_kata: Dict[str, List[PMSRowsOfKata]] = {}
+        for partition in partitions:
+            for pms_rows_of_a_kata in partition.pmsRowsOfKatas:
+                pms_rows_of_kata.setdefault(pms_rows_of_a_kata.kata, []) \
+                    .append(pms_rows_of_a_kata)
+
+        released_qty_of_kata = self.releasedQtyOfKata
+        orders_of_kata = self.ordersOfKata
+        plans: List[Tuple[List[PMSRowsOfKata], int, List[Order]]] = []
+        for kata, pms_rows_of_a_kata_list in pms_rows_of_kata.items():
+            shipment_qty_of_kata = 0
+            for pms_rows_of_a_kata in pms_rows_of_a_kata_list:
+                shipment_qty_of_kata += pms_rows_of_a_kata.shipmentQty
+
+            tbd_qty = released_qty_of_kata[kata] - shipment_qty_of_kata
             if tbd_qty < 0:
                 raise Exception(
                     f"Shipment Quantity Over Released Quantity: {kata}, {tbd_qty}")
 
+            if columnar:
+                plans.append((pms_rows_of_a_kata_list, tbd_qty, orders_of_kata[kata]))
+                continue
+
             spl_rows: List[SPLRow] = []
-            for hin, shipment_qty in pms_rows_of_a_kata.shipmentQtyOfHin.items():
-                spl_row = SPLRow(kata=kata,  # type: ignore
-                                 hin=hin,
-                                 shipmentDate=pms_rows_of_a_kata.shipmentDate,
-                                 shipmentQty=shipment_qty,
-                                 shipmentWarehouse=pms_rows_of_a_kata.shipmentWarehouse,
-                                 isTBD=False)
-                spl_rows.append(spl_row)
+            for pms_rows_of_a_kata in pms_rows_of_a_kata_list:
+                for hin, shipment_qty in pms_rows_of_a_kata.shipmentQtyOfHin.items():
+                    spl_row = SPLRow(kata=kata,  # type: ignore
+                                     hin=hin,
+                                     shipmentDate=pms_rows_of_a_kata.shipmentDate,
+                                     shipmentQty=shipment_qty,
+                                     shipmentWarehouse=pms_rows_of_a_kata.shipmentWarehouse,
+                                     isTBD=False)
+                    spl_rows.append(spl_row)
 
             if tbd_qty > 0:
                 tbd_hin = spl_rows[0].hin
@@ -519,65 +791,125 @@ class OrderFiles:
                                      hin=tbd_hin,
                                      shipmentDate=self.__TBD_DATE,
                                      shipmentQty=tbd_qty,
-                                     shipmentWarehouse=pms_rows_of_a_kata.shipmentWarehouse,
+                                     shipmentWarehouse=spl_rows[0].shipmentWarehouse,
                                      isTBD=True)
                 spl_rows.append(tbd_spl_row)
 
             self.__spl_rows_to_order(splRows=spl_rows,
-                                     orders=self.ordersOfKata[kata])
+                                     orders=orders_of_kata[kata])
+
+        if columnar:
+            self.__spl_rows_to_order_columnar(plans)
+
+    @classmethod
+    def __spl_rows_to_order_columnar(
+            cls, plans: Sequence[Tuple[List[PMSRowsOfKata], int, List[Order]]]):
+        # 型ごとの (出荷計画, TBD の数量, オーダ) を、型の番号を付けて配列に並べる
+        # 元になる SPL 行は品番と出荷計画への参照だけで持ち、
+        # SPLRow は引き当てた切れ目の行だけ作る
+        # (元の行ごとにオブジェクトを作ると、全部の型の分が残って GC の回数が増える)
+        all_orders: List[Order] = []
+        order_katas = array("l")
+        order_qtys = array("q")
+        spl_hins: List[str] = []
+        spl_pms_rows: List[PMSRowsOfKata] = []
+        spl_tbds = array("b")
+        spl_katas = array("l")
+        spl_qtys = array("q")
+        for kata_code, (pms_rows_of_a_kata_list, tbd_qty, orders) in enumerate(plans):
+            first_spl_index = len(spl_hins)
+            for pms_rows_of_a_kata in pms_rows_of_a_kata_list:
+                shipment_qty_of_hin = pms_rows_of_a_kata.shipmentQtyOfHin
+                spl_hins.extend(shipment_qty_of_hin)
+                spl_pms_rows.extend(repeat(pms_rows_of_a_kata, len(shipment_qty_of_hin)))
+                spl_qtys.extend(shipment_qty_of_hin.values())
+            spl_count = len(spl_hins) - first_spl_index
+            spl_tbds.extend(repeat(False, spl_count))
+            if tbd_qty > 0:
+                # TBD 行は最初の行の品番と出荷倉庫で作る
+                spl_hins.append(spl_hins[first_spl_index])
+                spl_pms_rows.append(spl_pms_rows[first_spl_index])
+                spl_tbds.append(True)
+                spl_qtys.append(tbd_qty)
+                spl_count += 1
+            spl_katas.extend(repeat(kata_code, spl_count))
+
+            for order in orders:
+                order.reset_spl_rows()
+                order_qtys.append(order.notUpdatedShipmentQty)
+            order_katas.extend(repeat(kata_code, len(orders)))
+            all_orders.extend(orders)
+
+        allocation = allocate(orderKatas=order_katas,
+                              orderQtys=order_qtys,
+                              splKatas=spl_katas,
+                              splQtys=spl_qtys)
+
+        tbd_date = cls.__TBD_DATE
+        for (order_index, spl_index, qty) in zip(allocation.orderIndexes,
+                                                 allocation.splIndexes,
+                                                 allocation.qtys):
+            pms_rows_of_a_kata = spl_pms_rows[spl_index]
+            is_tbd = spl_tbds[spl_index] == 1
+            all_orders[order_index].append_spl_row(
+                SPLRow(kata=pms_rows_of_a_kata.kata,  # type: ignore
+                       hin=spl_hins[spl_index],
+                       shipmentDate=tbd_date if is_tbd
+                       else pms_rows_of_a_kata.shipmentDate,
+                       shipmentQty=qty,
+                       shipmentWarehouse=pms_rows_of_a_kata.shipmentWarehouse,
+                       isTBD=is_tbd))
+
+        # 型ごとの合計が同じなので、すべての注残が引き当たる
+        for order in all_orders:
+            order.updatedReleasedQty = order.releasedQty
 
     @classmethod
     def __spl_rows_to_order(cls,
                             splRows: List[SPLRow],
                             orders: List[Order]):
         for order in orders:
-            order.splRows = []
+            order.reset_spl_rows()
 
-        while True:
-            done = cls.__spl_rows_to_order_core(splRows=splRows,
-                                                orders=orders)
-            if done:
-                break
-
-    @classmethod
-    def __spl_rows_to_order_core(cls,
-                                 splRows: List[SPLRow],
-                                 orders: List[Order]) -> bool:
+        # オーダと SPL 行を前から一度ずつだけ見て引き当てる
+        # 引当済の SPL 行は飛ばし、途中まで引き当てた SPL 行は次のオーダへ持ち越す
+        spl_index = 0
+        spl_count = len(splRows)
         for order in orders:
             if order.isUpdateDone:
                 continue
 
-            for spl_row in splRows:
-                if spl_row.isCopyDone:
-                    continue
+            while True:
+                while spl_index < spl_count and splRows[spl_index].isCopyDone:
+                    spl_index += 1
+                if spl_index == spl_count:
+                    return
 
+                spl_row = splRows[spl_index]
                 if order.notUpdatedShipmentQty >= spl_row.notCopiedShipmentQty:
                     # まだ回答を更新していない注残 >= 未引当出荷数
                     # 回答がひとつの注番に全部入る
                     shipment_qty = spl_row.notCopiedShipmentQty
-                    spl_row_to_order = SPLRow(kata=spl_row.kata,  # type: ignore
-                                              hin=spl_row.hin,
-                                              shipmentDate=spl_row.shipmentDate,
-                                              shipmentQty=shipment_qty,
-                                              shipmentWarehouse=spl_row.shipmentWarehouse,
-                                              isTBD=spl_row.isTBD)
                     spl_row.copiedShipmentQty = spl_row.shipmentQty
                     order.updatedReleasedQty += shipment_qty
-                    order.splRows.append(spl_row_to_order)
+                    order.append_spl_row(
+                        cls.__copy_spl_row(spl_row, shipment_qty))
+                    spl_index += 1
                 else:
                     # まだ回答を更新していない注残 < 未引当出荷数
-                    # 回答が注番をまたぐ
+                    # 回答が注番をまたぐ (注残が 0 のときは数量 0 の行が入る)
                     shipment_qty = order.notUpdatedShipmentQty
-                    spl_row_to_order = SPLRow(kata=spl_row.kata,  # type: ignore
-                                              hin=spl_row.hin,
-                                              shipmentDate=spl_row.shipmentDate,
-                                              shipmentQty=shipment_qty,
-                                              shipmentWarehouse=spl_row.shipmentWarehouse,
-                                              isTBD=spl_row.isTBD)
                     spl_row.copiedShipmentQty += shipment_qty
                     order.updatedReleasedQty = order.releasedQty
-                    order.splRows.append(spl_row_to_order)
-
-                    return False
+                    order.append_spl_row(
+                        cls.__copy_spl_row(spl_row, shipment_qty))
+                    break
 
-        return True
+    @staticmethod
+    def __copy_spl_row(splRow: SPLRow, shipmentQty: int) -> SPLRow:
+        return SPLRow(kata=splRow.kata,  # type: ignore
+                      hin=splRow.hin,
+                      shipmentDate=splRow.shipmentDate,
+                      shipmentQty=shipmentQty,
+                      shipmentWarehouse=splRow.shipmentWarehouse,
+                      isTBD=splRow.isTBD)
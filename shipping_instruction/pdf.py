@@ -8,14 +8,19 @@ from shipping_instruction.util import _init_dir
 
 def merge(inputDir: str,
           outputBaseDir: str,
-          instructionNumber: str) -> Optional[str]:
+          instructionNumber: str,
+          files: Optional[List[str]] = None) -> Optional[str]:
+    # files を渡したときは、その順に結合する
     output = __init_output_dir(outputBaseDir, instructionNumber)
     if output is None:
         return None
 
     merger = PdfFileMerger()
     counter = 0
-    for pdf in __get_original_files(inputDir):
+    if files is None:
+        files = __get_original_files(inputDir)
+
+    for pdf in files:
         merger.append(pdf)
         counter += 1
 
@@ -66,4 +71,5 @@ def __get_original_files(dir: str) -> List[str]:
 
         files.append(str(content))
 
-    return files
+    # iterdir の順は環境によって変わるので、名前順にそろえる
+    return sorted(files)
@@ -1,15 +1,24 @@
 import csv
-from dataclasses import dataclass
+import io
+import mmap
+import sys
+from dataclasses import asdict, dataclass, field
 from datetime import date, datetime
+from operator import itemgetter
 from pathlib import Path
-from typing import Dict, List, Optional, Set
+from typing import Any, Dict, Iterator, List, Mapping, NamedTuple, Optional, Tuple
 
-from shipping_instruction.config import PMSFileColumnsConfig
+from shipping_instruction.cache import SnapshotCache
+from shipping_instruction.config import MRPCConfig, PMSFileColumnsConfig
 from shipping_instruction.util import _get_first_file_in_dir
 
 
 @dataclass
 class PMSRow:
+    # 行は数が多いので __dict__ を持たせない
+    __slots__ = ("kata", "hin", "shipmentDate", "shipmentQty",
+                 "shipmentWarehouse")
+
     kata: str
     hin: str
     shipmentDate: Optional[date]
@@ -17,163 +26,383 @@ class PMSRow:
     shipmentWarehouse: str
 
 
-@dataclass
+@dataclass(frozen=True)
 class PMSRowsOfKata:
     kata: str
     shipmentDate: date
     shipmentWarehouse: str
-    pmsRows: List[PMSRow]
+    pmsRows: Tuple[PMSRow, ...]
+    # 以下は構築時に一度だけ集計する
+    hins: Tuple[str, ...] = field(init=False, repr=False, compare=False)
+    shipmentQtyOfHin: Mapping[str, int] = field(init=False, repr=False,
+                                                compare=False)
+    shipmentQty: int = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        pms_rows = tuple(self.pmsRows)
+        shipment_qty_of_hin: Dict[str, int] = {}
+        for pms_row in pms_rows:
+            shipment_qty_of_hin[pms_row.hin] = \
+                shipment_qty_of_hin.get(pms_row.hin, 0) + pms_row.shipmentQty
 
-    @property
-    def hins(self) -> List[str]:
-        hins: Set[str] = set()
-        for pms_row in self.pmsRows:
-            hin = pms_row.hin
-            hins.add(hin)
-        return list(hins)
+        # frozen なので object.__setattr__ で設定する
+        object.__setattr__(self, "pmsRows", pms_rows)
+        object.__setattr__(self, "hins", tuple(shipment_qty_of_hin))
+        object.__setattr__(self, "shipmentQtyOfHin", shipment_qty_of_hin)
+        object.__setattr__(self, "shipmentQty",
+                           sum(shipment_qty_of_hin.values()))
 
-    @property
-    def shipmentQtyOfHin(self) -> Dict[str, int]:
-        shipment_qty_of_hin: Dict[str, int] = {}
-        for hin in self.hins:
-            shipment_qty = 0
-            for pms_row in self.pmsRows:
-                if hin == pms_row.hin:
-                    shipment_qty += pms_row.shipmentQty
-            shipment_qty_of_hin[hin] = shipment_qty
-        return shipment_qty_of_hin
+
+@dataclass(frozen=True)
+class PMSPartition:
+    # 出荷日と出荷倉庫が同じ行のまとまり
+    shipmentDate: date
+    shipmentWarehouse: str
+    pmsRowsOfKatas: Tuple[PMSRowsOfKata, ...]
+    pmsRowsOfKata: Mapping[str, PMSRowsOfKata] = field(init=False, repr=False,
+                                                       compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "pmsRowsOfKatas", tuple(self.pmsRowsOfKatas))
+        object.__setattr__(self, "pmsRowsOfKata",
+                           {pms_rows_of_a_kata.kata: pms_rows_of_a_kata
+                            for pms_rows_of_a_kata in self.pmsRowsOfKatas})
 
     @property
-    def shipmentQty(self) -> int:
-        shipment_qty_of_kata = 0
-        for pms_row in self.pmsRows:
-            shipment_qty_of_kata += pms_row.shipmentQty
-        return shipment_qty_of_kata
+    def headCharOfShipmentWarehouse(self) -> str:
+        # MRP拠点の判定に用いる
+        return self.shipmentWarehouse[0]
+
+
+@dataclass(frozen=True)
+class PMSViolation:
+    row: int  # ファイル上の行番号 (ヘッダ行が 1)
+    column: Optional[int]  # ファイル上の列番号 (1 始まり)
+    field: str
+    code: str
+    value: str
+
+
+class PMSValidationError(Exception):
+    def __init__(self, fileName: str, violations: List[PMSViolation]):
+        super().__init__(
+            f"Invalid PMS File: {fileName}, {len(violations)} Violations"
+        )
+        self.fileName = fileName
+        self.violations = violations
+
+    def __reduce__(self):
+        # 一括処理でプロセス間を受け渡すため
+        return (self.__class__, (self.fileName, self.violations))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"file": self.fileName,
+                "violations": [asdict(v) for v in self.violations]}
+
+
+class _PMSRecord(NamedTuple):
+    # PMSFile で使う列だけを取り出した 1 行
+    line: int
+    columns: int
+    instructionNumber: str
+    shipmentWarehouse: str
+    shipmentDate: str
+    kata: str
+    hin: str
+    shipmentQty: str
 
 
 class PMSFile:
     __SUFFIX = ".csv"
+    # pms から出力されるファイルのエンコードは shift_jis のよう
+    __ENCODING = "shift_jis"
+
+    # 読み込み結果の形が変わったら上げる (キャッシュを無効にする)
+    __CACHE_VERSION = 2
 
     def __init__(self,
                  path: str,
-                 config: PMSFileColumnsConfig):
-        file = _get_first_file_in_dir(path)
+                 config: PMSFileColumnsConfig,
+                 useMmap: bool = False,
+                 cache: Optional[SnapshotCache] = None):
+        # ファイルが指定されたらそのファイルを、フォルダならその中の最初のファイルを読む
+        file = path if Path(path).is_file() else _get_first_file_in_dir(path)
         if file is None:
             raise Exception(f"PMS File Not Found: {path}")
 
         file_p = Path(file)
-        if file_p.suffix != self.__SUFFIX:
-            raise Exception(f"Invalid Suffix: {file_p.suffix}")
-
         # ファイル名の確認に使用
         self.fileName = file_p.name
+
+        if file_p.suffix != self.__SUFFIX:
+            raise PMSValidationError(self.fileName, [
+                PMSViolation(row=0, column=None, field="FILE",
+                             code="INVALID_SUFFIX", value=file_p.suffix)
+            ])
+
         C = self.config = config
-        # pms から出力されるファイルのエンコードは shift_jis のよう
-        with open(str(file_p), newline="", encoding="shift_jis") as csvfile:
-            reader = csv.reader(csvfile)
-            self.__csvRows = [row for row in reader]
 
-            self.instructionNumber = self.__csvRows[1][C.INSTRUCTION_NUMBER]
+        # 同じファイルを前に読んでいたら、そのときの結果を使う
+        cache_key = ""
+        if cache is not None:
+            # 出荷倉庫から MRP 拠点への対応が変わると、分けた結果も変わる
+            sites = sorted(MRPCConfig.SITES.items())
+            cache_key = cache.key(str(file_p), f"{self.__CACHE_VERSION}-{sites}", C)
+            snapshot = cache.load(cache_key)
+            if snapshot is not None:
+                (self.instructionNumber, self.katas, self.partitions) = snapshot
+                return
 
-            shipment_date = self.__get_valid_shipment_date()
-            if shipment_date is None:
-                raise Exception("Invalid Shipment Date")
+        self.__load(str(file_p), useMmap)
 
-            shipment_warehouse = self.__get_valid_shipment_warehouse()
-            if shipment_warehouse is None:
-                raise Exception("Invalid Shipment Warehouse")
+        if cache is not None:
+            cache.save(cache_key, (self.instructionNumber, self.katas,
+                                   self.partitions))
 
-            # MRP拠点の判定に用いる
-            self.headCharOfShipmentWarehouse = shipment_warehouse[0]
+    def __load(self, file: str, useMmap: bool):
+        C = self.config
+        FORMAT = C.SHIPMENT_DATE_FORMAT_VAL
+        SITES = MRPCConfig.SITES
+        LAST_COLUMN = self.__last_column()
+        # 日付の文字列はほぼすべての行で同じなので、変換結果を使いまわす
+        shipment_dates: Dict[str, Optional[date]] = {}
+        instruction_number: Optional[str] = None
+
+        # 読み込みと同時に検査し、問題はすべて集めてから報告する
+        violations: List[PMSViolation] = []
+
+        def __violate(record: _PMSRecord, field: str, code: str, value: str):
+            column = getattr(C, field)
+            violations.append(PMSViolation(row=record.line,
+                                           column=column + 1,
+                                           field=field,
+                                           code=code,
+                                           value=value))
+
+        # 一度だけファイルを読み、(出荷日, 出荷倉庫) ごと・型ごとに振り分ける
+        pms_rows_of_partition: Dict[Tuple[date, str],
+                                    Dict[str, List[PMSRow]]] = {}
+        katas: Dict[str, None] = {}
+        records = self.__read_mmap(file) if useMmap \
+            else self.__read_csv(file)
+        for record in records:
+            if record.columns <= LAST_COLUMN:
+                violations.append(PMSViolation(row=record.line,
+                                               column=record.columns + 1,
+                                               field="ROW",
+                                               code="MISSING_COLUMNS",
+                                               value=str(record.columns)))
+                continue
 
-            katas: Set[str] = set()
-            for index, row in enumerate(self.__csvRows):
-                if index == 0:
-                    continue
+            if instruction_number is None:
+                instruction_number = record.instructionNumber
+
+            is_valid = True
+
+            if record.shipmentDate in shipment_dates:
+                tmp_date = shipment_dates[record.shipmentDate]
+            else:
+                try:
+                    tmp_date = datetime.strptime(record.shipmentDate,
+                                                 FORMAT).date()
+                except ValueError:
+                    tmp_date = None
+                shipment_dates[record.shipmentDate] = tmp_date
+
+            if tmp_date is None:
+                __violate(record, "SHIPMENT_DATE", "INVALID_SHIPMENT_DATE",
+                          record.shipmentDate)
+                is_valid = False
+
+            tmp_warehouse = record.shipmentWarehouse
+            if tmp_warehouse == "":
+                __violate(record, "SHIPMENT_WAREHOUSE",
+                          "EMPTY_SHIPMENT_WAREHOUSE", tmp_warehouse)
+                is_valid = False
+            elif tmp_warehouse[0] not in SITES:
+                __violate(record, "SHIPMENT_WAREHOUSE",
+                          "UNKNOWN_SHIPMENT_WAREHOUSE", tmp_warehouse)
+                is_valid = False
+
+            kata = record.kata
+            if kata == "":
+                __violate(record, "KATA", "EMPTY_KATA", kata)
+                is_valid = False
+
+            hin = record.hin
+            if hin == "":
+                __violate(record, "HIN", "EMPTY_HIN", hin)
+                is_valid = False
+
+            try:
+                shipment_qty = int(record.shipmentQty)
+            except ValueError:
+                __violate(record, "SHIPMENT_QTY", "INVALID_SHIPMENT_QTY",
+                          record.shipmentQty)
+                is_valid = False
+
+            # 問題が見つかったら集計はやめて、検査だけを最後まで続ける
+            if not is_valid or len(violations) > 0:
+                continue
 
-                kata = row[C.KATA]
-                katas.add(kata)
-            self.katas = list(katas)
+            katas[kata] = None
 
-            self.pmsRowsOfKatas: List[PMSRowsOfKata] = []
-            for kata in self.katas:
-                pms_rows: List[PMSRow] = []
-                for index, row in enumerate(self.__csvRows):
-                    if index == 0:
-                        continue
+            pms_rows_of_kata = pms_rows_of_partition.get((tmp_date,
+                                                          tmp_warehouse))
+            if pms_rows_of_kata is None:
+                pms_rows_of_kata = \
+                    pms_rows_of_partition[(tmp_date, tmp_warehouse)] = {}
+
+            pms_rows = pms_rows_of_kata.get(kata)
+            if pms_rows is None:
+                pms_rows = pms_rows_of_kata[kata] = []
+
+            if shipment_qty > 0:
+                pms_row = PMSRow(kata=sys.intern(kata),
+                                 hin=sys.intern(hin),
+                                 shipmentDate=tmp_date,
+                                 shipmentQty=shipment_qty,
+                                 shipmentWarehouse=tmp_warehouse)
+                pms_rows.append(pms_row)
+
+        if len(violations) > 0:
+            raise PMSValidationError(self.fileName, violations)
+
+        if instruction_number is None:
+            raise Exception("No Data In PMS File")
+
+        self.instructionNumber = instruction_number
+
+        self.katas = list(katas.keys())
 
-                    if kata == row[C.KATA]:
-                        shipment_qty = int(row[C.SHIPMENT_QTY])
-                        if shipment_qty > 0:
-                            pms_row = PMSRow(kata=kata,
-                                             hin=row[C.HIN],
-                                             shipmentDate=shipment_date,
-                                             shipmentQty=shipment_qty,
-                                             shipmentWarehouse=shipment_warehouse)
-                            pms_rows.append(pms_row)
+        partitions: List[PMSPartition] = []
+        for (shipment_date, shipment_warehouse), pms_rows_of_kata \
+                in sorted(pms_rows_of_partition.items(), key=lambda i: i[0]):
+            pms_rows_of_katas: List[PMSRowsOfKata] = []
+            for kata, pms_rows in pms_rows_of_kata.items():
                 pms_rows_of_a_kata = PMSRowsOfKata(kata=kata,
                                                    shipmentDate=shipment_date,
                                                    shipmentWarehouse=shipment_warehouse,
-                                                   pmsRows=pms_rows)
+                                                   pmsRows=tuple(pms_rows))
                 if pms_rows_of_a_kata.shipmentQty > 0:
-                    self.pmsRowsOfKatas.append(pms_rows_of_a_kata)
+                    pms_rows_of_katas.append(pms_rows_of_a_kata)
 
-            if len(self.pmsRowsOfKatas) == 0:
-                raise Exception("No Data In PMS File")
+            if len(pms_rows_of_katas) > 0:
+                partitions.append(PMSPartition(shipmentDate=shipment_date,
+                                               shipmentWarehouse=shipment_warehouse,
+                                               pmsRowsOfKatas=tuple(pms_rows_of_katas)))
 
-    @property
-    def pmsRowsOfKata(self) -> Dict[str, PMSRowsOfKata]:
-        pms_rows_of_kata: Dict[str, PMSRowsOfKata] = {}
-        for kata in self.katas:
-            for pms_rows_of_a_kata in self.pmsRowsOfKatas:
-                if kata == pms_rows_of_a_kata.kata:
-                    pms_rows_of_kata[kata] = pms_rows_of_a_kata
-                    break
-        return pms_rows_of_kata
-
-    def __get_valid_shipment_date(self) -> Optional[date]:
-        C = self.config
-        FORMAT = C.SHIPMENT_DATE_FORMAT_VAL
-        DEFAULT_SHIPMENT_DATE = datetime.strptime("1900/01/01", FORMAT).date()
-        shipment_date = DEFAULT_SHIPMENT_DATE
+        if len(partitions) == 0:
+            raise Exception("No Data In PMS File")
 
-        for index, row in enumerate(self.__csvRows):
-            if index == 0:
-                continue
+        self.partitions: Tuple[PMSPartition, ...] = tuple(partitions)
 
-            if index == 1:
-                shipment_date = \
-                    datetime.strptime(row[C.SHIPMENT_DATE], FORMAT).date()
-                continue
+    @property
+    def partitionsOfSite(self) -> Dict[str, List[PMSPartition]]:
+        # MRP拠点 (出荷倉庫の先頭文字) ごとにまとめる
+        partitions_of_site: Dict[str, List[PMSPartition]] = {}
+        for partition in self.partitions:
+            partitions_of_site.setdefault(
+                partition.headCharOfShipmentWarehouse, []
+            ).append(partition)
+        return partitions_of_site
+
+    def __last_column(self) -> int:
+        C = self.config
+        return max(C.INSTRUCTION_NUMBER, C.SHIPMENT_WAREHOUSE,
+                   C.SHIPMENT_DATE, C.KATA, C.HIN, C.SHIPMENT_QTY)
 
-            tmp_date = \
-                datetime.strptime(row[C.SHIPMENT_DATE], FORMAT).date()
-            if shipment_date != tmp_date:
-                return None
+    def __to_record(self, line: int, row: List[str]) -> _PMSRecord:
+        C = self.config
+        if len(row) <= self.__last_column():
+            # 列が足りない行は検査で報告する
+            return _PMSRecord(line, len(row), "", "", "", "", "", "")
+
+        return _PMSRecord(line,
+                          len(row),
+                          row[C.INSTRUCTION_NUMBER],
+                          row[C.SHIPMENT_WAREHOUSE],
+                          row[C.SHIPMENT_DATE],
+                          row[C.KATA],
+                          row[C.HIN],
+                          row[C.SHIPMENT_QTY])
+
+    def __read_csv(self, file: str) -> Iterator[_PMSRecord]:
+        C = self.config
+        with open(file, newline="", encoding=self.__ENCODING) as csvfile:
+            reader = csv.reader(csvfile)
+            next(reader, None)  # ヘッダ行
 
-        if shipment_date == DEFAULT_SHIPMENT_DATE:
-            return None
+            for row in reader:
+                if len(row) == 0:
+                    continue
 
-        return shipment_date
+                yield self.__to_record(reader.line_num, row)
 
-    def __get_valid_shipment_warehouse(self) -> Optional[str]:
+    def __read_mmap(self, file: str) -> Iterator[_PMSRecord]:
+        # ファイルをメモリにマップし、バイト列のまま行と列に分ける
+        # デコードするのは使う列だけ
+        # shift_jis の 2 バイト目に "," "\"" "\n" は現れないのでバイト列で分割できる
         C = self.config
-        DEFAULT_SHIPMENT_WAREHOUSE = ""
-        shipment_warehouse = DEFAULT_SHIPMENT_WAREHOUSE
-
-        for index, row in enumerate(self.__csvRows):
-            if index == 0:
-                continue
-
-            if index == 1:
-                shipment_warehouse = row[C.SHIPMENT_WAREHOUSE]
-                continue
+        ENCODING = self.__ENCODING
+        LAST_COLUMN = self.__last_column()
+
+        # 指示番号・倉庫・日付・型・品目は同じ値が繰り返し現れるので、デコード結果を使いまわす
+        decoded: Dict[bytes, str] = {}
+
+        def __decode(value: bytes) -> str:
+            # 空文字列もキャッシュにあれば使う
+            text = decoded.get(value)
+            if text is None:
+                text = decoded[value] = value.decode(ENCODING)
+            return text
+
+        project = itemgetter(C.INSTRUCTION_NUMBER, C.SHIPMENT_WAREHOUSE,
+                             C.SHIPMENT_DATE, C.KATA, C.HIN, C.SHIPMENT_QTY)
+
+        with open(file, "rb") as f:
+            if Path(file).stat().st_size == 0:
+                return
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                mm.readline()  # ヘッダ行
+                line_num = 1
+
+                for raw in iter(mm.readline, b""):
+                    line_num += 1
+                    line = raw.rstrip(b"\r\n")
+                    if len(line) == 0:
+                        continue
 
-            tmp_warehouse = row[C.SHIPMENT_WAREHOUSE]
-            if shipment_warehouse != tmp_warehouse:
-                return None
+                    if b'"' in line:
+                        # 引用符の中の改行で行が分かれていたら、引用符が閉じるまで次の行をつなげる
+                        while raw.count(b'"') % 2 == 1:
+                            next_raw = mm.readline()
+                            if next_raw == b"":
+                                break
+                            line_num += 1
+                            raw += next_raw
+
+                        # 引用符つきの行だけは csv モジュールに任せる
+                        text = io.StringIO(raw.decode(ENCODING), newline="")
+                        row = next(csv.reader(text))
+                        yield self.__to_record(line_num, row)
+                        continue
 
-        if shipment_warehouse == DEFAULT_SHIPMENT_WAREHOUSE:
-            return None
+                    fields = line.split(b",")
+                    if len(fields) <= LAST_COLUMN:
+                        yield self.__to_record(line_num,
+                                               line.decode(ENCODING).split(","))
+                        continue
 
-        return shipment_warehouse
+                    (instruction_number, warehouse, shipment_date,
+                     kata, hin, shipment_qty) = project(fields)
+
+                    yield _PMSRecord(line_num,
+                                     len(fields),
+                                     __decode(instruction_number),
+                                     __decode(warehouse),
+                                     __decode(shipment_date),
+                                     __decode(kata),
+                                     __decode(hin),
+                                     shipment_qty.decode(ENCODING))
@@ -0,0 +1,537 @@
+import http.client
+import re
+import select
+import socket
+import threading
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from email.message import Message
+from html.parser import HTMLParser
+from http.cookies import SimpleCookie
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from urllib.parse import unquote, urlencode, urljoin, urlsplit
+
+from shipping_instruction.config import DirConfig, PortalConfig
+from shipping_instruction.user import User
+from shipping_instruction.util import _init_dir
+
+
+class PortalError(Exception):
+    # HTTP の経路で処理できなかった
+    # 受注のダウンロードは、呼び出し側がブラウザの経路で処理し直す
+    pass
+
+
+class PortalNotSentError(PortalError):
+    # 送る前に失敗したので、サーバは何も受け取っていない
+    # アップロードは、このときだけブラウザの経路で処理し直してよい
+    pass
+
+
+@dataclass
+class _Field:
+    name: str
+    value: str
+    type: str
+    id: Optional[str] = None
+    checked: bool = False
+
+
+@dataclass
+class _Form:
+    action: str
+    method: str
+    enctype: str
+    fields: List[_Field] = field(default_factory=list)
+
+    def has(self, name: str) -> bool:
+        return any(f.name == name for f in self.fields)
+
+    def values(self,
+               overrides: Dict[str, str],
+               toggles: Sequence[str] = (),
+               submit: Optional[str] = None) -> List[Tuple[str, str]]:
+        # ブラウザで入力してボタンを押したときに送られる値を作る
+        # overrides は入力欄の値を置き換え、toggles は id で指定したチェックボックスを切り替える
+        values: List[Tuple[str, str]] = []
+        for f in self.fields:
+            if f.type in ("submit", "button", "image", "reset"):
+                if f.name == submit:
+                    values.append((f.name, f.value))
+                continue
+
+            if f.type == "file":
+                continue
+
+            if f.type in ("checkbox", "radio"):
+                checked = f.checked != (f.id is not None and f.id in toggles)
+                if checked:
+                    values.append((f.name, f.value or "on"))
+                continue
+
+            values.append((f.name, overrides.get(f.name, f.value)))
+
+        names = {f.name for f in self.fields}
+        values.extend((name, value) for (name, value) in overrides.items()
+                      if name not in names)
+        return values
+
+
+class _PageParser(HTMLParser):
+    # フォームの入力欄とリンクだけを拾う
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.forms: List[_Form] = []
+        self.links: List[Tuple[str, str]] = []
+
+        self.__form: Optional[_Form] = None
+        self.__select: Optional[_Field] = None
+        self.__optionSeen = False
+        self.__textarea: Optional[_Field] = None
+        self.__link: Optional[Tuple[str, List[str]]] = None
+
+    def handle_starttag(self, tag, attrs):
+        a = {key: (value if value is not None else "") for (key, value) in attrs}
+
+        if tag == "form":
+            self.__form = _Form(action=a.get("action", ""),
+                                method=a.get("method", "get").lower(),
+                                enctype=a.get("enctype", "").lower())
+            self.forms.append(self.__form)
+        elif tag == "a":
+            self.__link = (a.get("href", ""), [])
+        elif tag == "option" and self.__select is not None:
+            # 選ばれた項目がなければ、最初の項目が送られる
+            if "selected" in a or not self.__optionSeen:
+                if not self.__select.checked:
+                    self.__select.value = a.get("value", "")
+                    self.__select.checked = "selected" in a
+            self.__optionSeen = True
+        elif self.__form is None or "name" not in a:
+            return
+        elif tag == "input":
+            self.__form.fields.append(_Field(name=a["name"],
+                                             value=a.get("value", ""),
+                                             type=a.get("type", "text").lower(),
+                                             id=a.get("id"),
+                                             checked="checked" in a))
+        elif tag == "select":
+            self.__select = _Field(name=a["name"], value="", type="select",
+                                   id=a.get("id"))
+            self.__optionSeen = False
+            self.__form.fields.append(self.__select)
+        elif tag == "textarea":
+            self.__textarea = _Field(name=a["name"], value="", type="textarea",
+                                     id=a.get("id"))
+            self.__form.fields.append(self.__textarea)
+
+    def handle_endtag(self, tag):
+        if tag == "form":
+            self.__form = None
+        elif tag == "select":
+            self.__select = None
+        elif tag == "textarea":
+            self.__textarea = None
+        elif tag == "a" and self.__link is not None:
+            (href, texts) = self.__link
+            self.links.append((href, "".join(texts).strip()))
+            self.__link = None
+
+    def handle_data(self, data):
+        if self.__textarea is not None:
+            self.__textarea.value += data
+        if self.__link is not None:
+            self.__link[1].append(data)
+
+
+@dataclass
+class _Response:
+    url: str
+    status: int
+    headers: Message
+    body: bytes
+
+
+class _Page:
+
+    def __init__(self, url: str, text: str, encoding: str):
+        self.url = url
+        self.text = text
+        # フォームはページと同じ文字コードで送る
+        self.encoding = encoding
+
+        parser = _PageParser()
+        parser.feed(text)
+        parser.close()
+        self.forms = parser.forms
+        self.links = parser.links
+
+    def form_with(self, name: str) -> _Form:
+        for form in self.forms:
+            if form.has(name):
+                return form
+
+        raise PortalError(f"Form Not Found: {name}: {self.url}")
+
+    def link(self, text: str) -> str:
+        for (href, link_text) in self.links:
+            if link_text == text:
+                return urljoin(self.url, href)
+
+        raise PortalError(f"Link Not Found: {text}: {self.url}")
+
+
+class PortalClient:
+    # ポータルに一度だけログインし、Cookie と接続を使いまわしてフォームを直接送る
+    # ブラウザで行っている受注ファイルのダウンロードと納期回答のアップロードを HTTP で行う
+    # ページの作りが想定と違うときは PortalError を出すので、呼び出し側はブラウザで処理し直す
+
+    # browser.py と同じ契約会社コード
+    __SPEC = "32268"
+
+    __CHARSET = re.compile(rb"""<meta[^>]+charset=["']?([A-Za-z0-9_\-]+)""",
+                           re.IGNORECASE)
+    __FILENAME = re.compile(r"""filename\*?=(?:UTF-8'')?["']?([^"';]+)""",
+                            re.IGNORECASE)
+
+    def __init__(self,
+                 user: User,
+                 config: PortalConfig = PortalConfig(),
+                 errorDir: str = DirConfig.ERROR_SCREENSHOT_DIR):
+        self.user = user
+        self.config = config
+        # アップロードで弾かれたページを残すフォルダ
+        self.errorDir = errorDir
+
+        self.__lock = threading.Lock()
+        self.__login_lock = threading.Lock()
+        self.__loggedIn = False
+        self.__cookies: Dict[str, str] = {}
+        self.__idle: Dict[Tuple[str, str, Optional[int]],
+                          List[http.client.HTTPConnection]] = {}
+
+        # 接続を作った回数 (使いまわせたかを確かめる)
+        self.connectionCount = 0
+
+    def __enter__(self) -> "PortalClient":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        with self.__lock:
+            for connections in self.__idle.values():
+                for connection in connections:
+                    connection.close()
+            self.__idle.clear()
+
+    def login(self):
+        with self.__login_lock:
+            if self.__loggedIn:
+                return
+
+            if self.user.URL is None:
+                raise PortalError("Portal URL Not Found")
+
+            page = self.__get(self.user.URL)
+            form = page.form_with("sei_login")
+            result = self.__submit(page, form, form.values(
+                overrides={"sei_login": self.user.SSO_ID or "",
+                           "sei_passwd": self.user.SSO_PASSWORD or ""},
+                submit="login"
+            ))
+
+            # ログインのフォームがまた出てきたら、ログインできていない
+            if any(f.has("sei_login") for f in result.forms):
+                raise PortalError("Login Failed")
+
+            self.__loggedIn = True
+
+    def download_order(self, isNew: bool, mrpc: str, downloadDir: str) -> str:
+        # 受注を検索して XLS をダウンロードし、保存したパスを返す
+        C = self.config
+        path = C.NEW_ORDER_SEARCH_PATH if isNew else C.ANSWERED_ORDER_SEARCH_PATH
+        self.login()
+
+        page = self.__get(self.__url(path))
+        form = page.form_with("btn_submit")
+        result = self.__submit(page, form, form.values(
+            overrides={"xmrp_bu_c_rfc_2": mrpc,
+                       "keiyaku_kaisya_cd_rfc3": self.__SPEC},
+            toggles=["xsotype_k_chk_4-1"],
+            submit="btn_submit"
+        ))
+
+        href = result.link("ダウンロード(XLS)")
+        if href.lower().startswith("javascript:"):
+            raise PortalError(f"Download Link Is Script: {href}")
+
+        response = self.__request("GET", href)
+
+        download_dir = _init_dir(downloadDir, True)
+        if download_dir is None:
+            raise Exception("Download Dir Not Exist")
+
+        output = Path(download_dir).joinpath(self.__file_name(response))
+        output.write_bytes(response.body)
+        return str(output)
+
+    def upload_spl(self, isNew: bool, uploadPath: str) -> bool:
+        # 納期回答のファイルをアップロードし、登録されたかを返す
+        C = self.config
+        path = C.NEW_ORDER_UPLOAD_PATH if isNew else C.ANSWERED_ORDER_UPLOAD_PATH
+
+        # アップロードを送るまでの失敗は、サーバに何も登録していない
+        try:
+            self.login()
+            page = self.__get(self.__url(path))
+            form = page.form_with("pms_upfile")
+            upload = Path(uploadPath)
+            files = {"pms_upfile": (upload.name, upload.read_bytes())}
+        except PortalNotSentError:
+            raise
+        except PortalError as e:
+            raise PortalNotSentError(str(e)) from e
+
+        # 送ったあとに失敗したときは、登録されたかわからないので PortalError のまま出す
+        result = self.__submit(page, form,
+                               form.values(overrides={}, submit="btn_submit"),
+                               files=files)
+
+        # 「以」の前の改行に注意
+        if "\n以下のデータを登録しました。" in result.text:
+            return True
+
+        # アップデートで弾かれた。ブラウザのスクリーンショットの代わりにページを残す
+        self.__save_error_page(result, self.errorDir)
+        return False
+
+    def __url(self, path: Optional[str]) -> str:
+        if path is None:
+            raise PortalError("Portal Path Not Configured")
+
+        return urljoin(self.user.URL or "", path)
+
+    def __get(self, url: str) -> _Page:
+        return self.__page(self.__request("GET", url))
+
+    def __submit(self,
+                 page: _Page,
+                 form: _Form,
+                 values: List[Tuple[str, str]],
+                 files: Optional[Dict[str, Tuple[str, bytes]]] = None) -> _Page:
+        url = urljoin(page.url, form.action)
+        encoding = page.encoding
+
+        if files is not None:
+            (body, content_type) = self.__multipart(values, files, encoding)
+            return self.__page(self.__request("POST", url, body,
+                                              {"Content-Type": content_type}))
+
+        query = urlencode(values, encoding=encoding)
+        if form.method == "post":
+            return self.__page(self.__request(
+                "POST", url, query.encode("ascii"),
+                {"Content-Type": "application/x-www-form-urlencoded"}
+            ))
+
+        return self.__page(self.__request("GET", f"{url.split('?')[0]}?{query}"))
+
+    def __page(self, response: _Response) -> _Page:
+        encoding = self.__encoding(response)
+        return _Page(response.url, response.body.decode(encoding, "replace"), encoding)
+
+    def __encoding(self, response: _Response) -> str:
+        charset = response.headers.get_content_charset()
+        if charset is None:
+            m = self.__CHARSET.search(response.body[:2048])
+            if m is not None:
+                charset = m.group(1).decode("ascii")
+
+        return charset or self.config.ENCODING
+
+    def __request(self,
+                  method: str,
+                  url: str,
+                  body: Optional[bytes] = None,
+                  headers: Optional[Dict[str, str]] = None) -> _Response:
+        for _ in range(self.config.MAX_REDIRECTS + 1):
+            response = self.__send(method, url, body, headers or {})
+
+            if response.status in (301, 302, 303, 307, 308):
+                location = response.headers.get("Location")
+                if location is None:
+                    raise PortalError(f"Redirect Without Location: {url}")
+
+                url = urljoin(url, location)
+                if response.status in (301, 302, 303):
+                    (method, body, headers) = ("GET", None, None)
+                continue
+
+            if response.status >= 400:
+                raise PortalError(f"HTTP {response.status}: {url}")
+
+            return response
+
+        raise PortalError(f"Too Many Redirects: {url}")
+
+    def __send(self,
+               method: str,
+               url: str,
+               body: Optional[bytes],
+               headers: Dict[str, str]) -> _Response:
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname or "", parts.port)
+        target = parts.path or "/"
+        if parts.query:
+            target = f"{target}?{parts.query}"
+
+        # 使いまわした接続がサーバ側で切れていたら、新しい接続で 1 回だけやり直す
+        for retry in (False, True):
+            (connection, reused) = self.__acquire(key, fresh=retry)
+            sent = False
+            try:
+                connection.request(method, target, body,
+                                   {**headers, **self.__cookie_header()})
+                sent = True
+                r = connection.getresponse()
+                data = r.read()
+            except (http.client.HTTPException, OSError) as e:
+                connection.close()
+                if reused and not retry and self.__retryable(method, sent, e):
+                    continue
+                if not sent:
+                    raise PortalNotSentError(f"Request Failed: {url}: {e}")
+                raise PortalError(f"Request Failed: {url}: {e}")
+
+            self.__store_cookies(r.msg.get_all("Set-Cookie") or [])
+            if r.will_close:
+                connection.close()
+            else:
+                self.__release(key, connection)
+
+            return _Response(url=url, status=r.status, headers=r.msg, body=data)
+
+        raise PortalError(f"Request Failed: {url}")
+
+    @staticmethod
+    def __retryable(method: str, sent: bool, error: Exception) -> bool:
+        # タイムアウトはサーバが処理している途中かもしれないので、やり直さない
+        if isinstance(error, socket.timeout):
+            return False
+
+        # 送り終える前に切れていれば、サーバは処理していない
+        if not sent:
+            return True
+
+        # 送ったあとに切れたときは、何度送っても同じ結果になる GET だけやり直す
+        # POST をやり直すと、ログインやアップロードを二重に送ることになる
+        return (method in ("GET", "HEAD")
+                and isinstance(error, (ConnectionResetError,
+                                       http.client.BadStatusLine)))
+
+    def __acquire(self,
+                  key: Tuple[str, str, Optional[int]],
+                  fresh: bool) -> Tuple[http.client.HTTPConnection, bool]:
+        with self.__lock:
+            idle = self.__idle.get(key)
+            while not fresh and idle:
+                connection = idle.pop()
+                if self.__is_alive(connection):
+                    return (connection, True)
+                connection.close()
+            self.connectionCount += 1
+
+        (scheme, host, port) = key
+        if scheme == "https":
+            return (http.client.HTTPSConnection(host, port,
+                                                timeout=self.config.TIMEOUT), False)
+        if scheme == "http":
+            return (http.client.HTTPConnection(host, port,
+                                               timeout=self.config.TIMEOUT), False)
+
+        raise PortalError(f"Unsupported Scheme: {scheme}")
+
+    @staticmethod
+    def __is_alive(connection: http.client.HTTPConnection) -> bool:
+        # 待っている接続に読めるものがあれば、サーバ側で閉じられている
+        if connection.sock is None:
+            return False
+
+        try:
+            (readable, _, _) = select.select([connection.sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return len(readable) == 0
+
+    def __release(self,
+                  key: Tuple[str, str, Optional[int]],
+                  connection: http.client.HTTPConnection):
+        with self.__lock:
+            idle = self.__idle.setdefault(key, [])
+            if len(idle) < self.config.MAX_IDLE_CONNECTIONS:
+                idle.append(connection)
+                return
+
+        connection.close()
+
+    def __cookie_header(self) -> Dict[str, str]:
+        with self.__lock:
+            if len(self.__cookies) == 0:
+                return {}
+            return {"Cookie": "; ".join(f"{name}={value}"
+                                        for (name, value) in self.__cookies.items())}
+
+    def __store_cookies(self, setCookies: Iterable[str]):
+        cookie: SimpleCookie = SimpleCookie()
+        for set_cookie in setCookies:
+            cookie.load(set_cookie)
+
+        with self.__lock:
+            for (name, morsel) in cookie.items():
+                self.__cookies[name] = morsel.value
+
+    def __file_name(self, response: _Response) -> str:
+        disposition = response.headers.get("Content-Disposition", "")
+        m = self.__FILENAME.search(disposition)
+        if m is not None:
+            return Path(unquote(m.group(1))).name
+
+        name = Path(unquote(urlsplit(response.url).path)).name
+        return name if name != "" else "download.xls"
+
+    @staticmethod
+    def __multipart(values: List[Tuple[str, str]],
+                    files: Dict[str, Tuple[str, bytes]],
+                    encoding: str) -> Tuple[bytes, str]:
+        boundary = f"----shipping-instruction-{uuid.uuid4().hex}"
+        parts: List[bytes] = []
+        for (name, value) in values:
+            parts.append(
+                f"--{boundary}\r\n"
+                f"Content-Disposition: form-data; name=\"{name}\"\r\n\r\n"
+                .encode(encoding) + value.encode(encoding) + b"\r\n"
+            )
+        for (name, (file_name, data)) in files.items():
+            parts.append(
+                f"--{boundary}\r\n"
+                f"Content-Disposition: form-data; name=\"{name}\"; filename=\"{file_name}\"\r\n"
+                f"Content-Type: application/vnd.ms-excel\r\n\r\n"
+                .encode(encoding) + data + b"\r\n"
+            )
+        parts.append(f"--{boundary}--\r\n".encode(encoding))
+
+        return (b"".join(parts), f"multipart/form-data; boundary={boundary}")
+
+    @staticmethod
+    def __save_error_page(page: _Page, dir: str):
+        error_dir = _init_dir(dir, False)
+        if error_dir is None:
+            return
+
+        name = f'{datetime.now().strftime("%Y%m%d_%H%M%S")}.html'
+        Path(error_dir).joinpath(name).write_text(page.text, encoding="utf-8")
@@ -1,5 +1,5 @@
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, List, Optional
 
 
 def _get_first_file_in_dir(dir: str) -> Optional[str]:
@@ -14,6 +14,19 @@ def _get_first_file_in_dir(dir: str) -> Optional[str]:
     return None
 
 
+def _get_files_in_dir(dir: str, suffix: str) -> List[str]:
+    dir_p = Path(dir)
+    if not dir_p.is_dir():
+        return []
+
+    files: List[str] = []
+    for content in sorted(dir_p.iterdir()):
+        if content.is_file() and content.suffix == suffix:
+            files.append(str(content))
+
+    return files
+
+
 def _init_dir(dir: str, unlink: bool) -> Optional[str]:
     path = Path(dir)
 
@@ -23,7 +36,8 @@ def _init_dir(dir: str, unlink: bool) -> Optional[str]:
 
     # 指定されたディレクトリが存在しなかったら作成
     if not path.exists():
-        path.mkdir(parents=True)
+        # 別のスレッドが同時に作ることもある
+        path.mkdir(parents=True, exist_ok=True)
         return str(path)
 
     # 既存のディレクトリで、unlink = True だったら中身を全削除
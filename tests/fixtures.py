@@ -0,0 +1,175 @@
+# テストとベンチマークで共有するデータの作り方と、作り直す前の引当
+import csv
+import random
+from datetime import date
+from pathlib import Path
+from typing import List
+
+from xlwt import Workbook
+
+from shipping_instruction.config import (AnsweredOrderFileColumnConfig,
+                                         OrderFileColumnConfingBase,
+                                         PMSFileColumnsConfig)
+from shipping_instruction.order import Order, SPLRow
+from shipping_instruction.pms import PMSPartition, PMSRow, PMSRowsOfKata
+
+
+def write_order_xls(dir: str,
+                    rows: List[dict],
+                    config: OrderFileColumnConfingBase,
+                    name: str = "order.xls") -> str:
+    # rows の各要素は {列名: 値}。指定がない列は空欄
+    C = config
+    wb = Workbook()
+    sh = wb.add_sheet(C.SHEET)
+    columns = {column: getattr(C, column) for column in dir_columns(C)}
+    for column, col in columns.items():
+        sh.write(0, col, column)
+    for row_index, row in enumerate(rows, start=1):
+        for column, col in columns.items():
+            sh.write(row_index, col, row.get(column, ""))
+
+    path = str(Path(dir).joinpath(name))
+    wb.save(path)
+    return path
+
+
+def dir_columns(config: OrderFileColumnConfingBase) -> List[str]:
+    return [name for name in dir(config)
+            if name.isupper() and isinstance(getattr(config, name), int)
+            and not isinstance(getattr(config, name), bool)]
+
+
+def answered_row(orderID: int, kata: str, orderQty: int,
+                 releasedQty: int, released: bool = True,
+                 orderNumber: int = 0) -> dict:
+    C = AnsweredOrderFileColumnConfig
+    return {"JUTYUU_ID": orderID,
+            "JUTYUU_ORDER_BANGOU": orderNumber or 9000 + orderID,
+            "TYUUMON_BANGOU": f"AB{orderID:04d}",
+            "KATABAN": kata,
+            "JUTYUU_SUU": orderQty,
+            "HINBAN": f"{kata}-H",
+            "KAITOU_SUU": releasedQty,
+            "SYUKKA_STATUS": C.RELEASED_VAL if released else "Planned",
+            "KAITOU_SYUKKA_BI": 44105.0,
+            "JUTYUU_RECORD_KOUSHIN_BI": 44105.5}
+
+
+def partition(shipmentDate: date, shipmentWarehouse: str,
+              rows: List[tuple]) -> PMSPartition:
+    # rows: [(kata, hin, qty)]
+    pms_rows_of_kata = {}
+    for (kata, hin, qty) in rows:
+        pms_rows_of_kata.setdefault(kata, []).append(
+            PMSRow(kata=kata, hin=hin, shipmentDate=shipmentDate,
+                   shipmentQty=qty, shipmentWarehouse=shipmentWarehouse)
+        )
+    return PMSPartition(
+        shipmentDate=shipmentDate,
+        shipmentWarehouse=shipmentWarehouse,
+        pmsRowsOfKatas=tuple(
+            PMSRowsOfKata(kata=kata, shipmentDate=shipmentDate,
+                          shipmentWarehouse=shipmentWarehouse,
+                          pmsRows=tuple(pms_rows))
+            for kata, pms_rows in pms_rows_of_kata.items()
+        )
+    )
+
+
+def legacy_spl_rows_to_order(splRows: List[SPLRow], orders: List[Order]):
+    # 作り直す前の引当 (SPL 行が注番をまたぐたびに先頭のオーダから見直す)
+    # 比較テストとベンチマークのために残す
+    for order in orders:
+        order.reset_spl_rows()
+
+    while True:
+        if legacy_spl_rows_to_order_core(splRows, orders):
+            break
+
+
+def legacy_spl_rows_to_order_core(splRows: List[SPLRow],
+                                  orders: List[Order]) -> bool:
+    for order in orders:
+        if order.isUpdateDone:
+            continue
+
+        for spl_row in splRows:
+            if spl_row.isCopyDone:
+                continue
+
+            if order.notUpdatedShipmentQty >= spl_row.notCopiedShipmentQty:
+                shipment_qty = spl_row.notCopiedShipmentQty
+                spl_row_to_order = SPLRow(kata=spl_row.kata,  # type: ignore
+                                          hin=spl_row.hin,
+                                          shipmentDate=spl_row.shipmentDate,
+                                          shipmentQty=shipment_qty,
+                                          shipmentWarehouse=spl_row.shipmentWarehouse,
+                                          isTBD=spl_row.isTBD)
+                spl_row.copiedShipmentQty = spl_row.shipmentQty
+                order.updatedReleasedQty += shipment_qty
+                order.append_spl_row(spl_row_to_order)
+            else:
+                shipment_qty = order.notUpdatedShipmentQty
+                spl_row_to_order = SPLRow(kata=spl_row.kata,  # type: ignore
+                                          hin=spl_row.hin,
+                                          shipmentDate=spl_row.shipmentDate,
+                                          shipmentQty=shipment_qty,
+                                          shipmentWarehouse=spl_row.shipmentWarehouse,
+                                          isTBD=spl_row.isTBD)
+                spl_row.copiedShipmentQty += shipment_qty
+                order.updatedReleasedQty = order.releasedQty
+                order.append_spl_row(spl_row_to_order)
+
+                return False
+
+    return True
+
+
+def allocation_case(seed: int, orderCount: int, splRowCount: int,
+                    kata: str = "K"):
+    # 出荷数の合計はリリース数量の合計と同じ (TBD 行で埋めたあとの状態)
+    rnd = random.Random(seed)
+    released = [rnd.choice([0, 1, 2, 3, 5, 10]) for _ in range(orderCount)]
+    total = sum(released)
+    cuts = sorted(rnd.randint(0, total) for _ in range(splRowCount - 1))
+    qtys = [b - a for a, b in zip([0] + cuts, cuts + [total])]
+
+    def make():
+        orders = [Order(orderID=f"{kata}-{i}", orderNumber=str(i),
+                        tyuumonBangou="AB", kata=kata, orderQty=qty,
+                        isNew=False, releasedQty=qty)
+                  for i, qty in enumerate(released)]
+        spl_rows = [SPLRow(kata=kata, hin=f"H{i}",  # type: ignore
+                           shipmentDate=date(2020, 10, 1), shipmentQty=qty,
+                           shipmentWarehouse="N05", isTBD=i == len(qtys) - 1)
+                    for i, qty in enumerate(qtys)]
+        return (orders, spl_rows)
+
+    return make
+
+
+def allocation_result(orders: List[Order], splRows: List[SPLRow]):
+    return ([(order.updatedReleasedQty,
+              [(row.hin, row.shipmentQty, row.isTBD) for row in order.splRows])
+             for order in orders],
+            [row.copiedShipmentQty for row in splRows])
+
+
+def write_pms_csv(dir: str, rows: List[dict], name: str = "pms.csv",
+                  columns: int = 16, filler: str = "") -> str:
+    C = PMSFileColumnsConfig
+    path = Path(dir).joinpath(name)
+    with open(str(path), "w", newline="", encoding="shift_jis") as f:
+        writer = csv.writer(f)
+        writer.writerow([f"列{i}" for i in range(columns)])
+        for row in rows:
+            values = [filler] * columns
+            values[C.INSTRUCTION_NUMBER] = row.get("instructionNumber", "A001")
+            values[C.SHIPMENT_WAREHOUSE] = row.get("warehouse", "N05")
+            values[C.SHIPMENT_DATE] = row.get("date", "2020/10/01")
+            values[C.KATA] = row["kata"]
+            values[C.HIN] = row["hin"]
+            values[C.SHIPMENT_QTY] = str(row["qty"])
+            writer.writerow(values)
+    return str(path)
@@ -0,0 +1,98 @@
+import random
+import tempfile
+import unittest
+from array import array
+from datetime import date
+from typing import List, Tuple
+
+from shipping_instruction.allocation import allocate
+from shipping_instruction.config import AnsweredOrderFileColumnConfig
+from shipping_instruction.order import OrderFile, OrderFiles
+from shipping_instruction.pms import PMSPartition
+from tests.fixtures import answered_row, partition, write_order_xls
+
+
+def plan_case(seed: int) -> Tuple[List[dict], List[PMSPartition]]:
+    # 複数の型の受注と、出荷日・出荷倉庫にまたがる出荷計画
+    # 出荷数の合計はリリース数量の合計を超えない (残りは TBD 行になる)
+    rnd = random.Random(seed)
+    rows: List[dict] = []
+    plan_rows: List[List[tuple]] = [[], []]
+    for k in range(1 + seed % 4):
+        kata = f"K{k}"
+        released_qty = 0
+        for _ in range(1 + rnd.randrange(6)):
+            qty = rnd.choice([0, 1, 2, 3, 5])
+            rows.append(answered_row(len(rows) + 1, kata, qty, qty))
+            released_qty += qty
+
+        shipment_qty = rnd.randint(0, released_qty)
+        cuts = sorted(rnd.randint(0, shipment_qty)
+                      for _ in range(rnd.randrange(4)))
+        for (i, (start, end)) in enumerate(zip([0] + cuts, cuts + [shipment_qty])):
+            plan_rows[rnd.randrange(2)].append((kata, f"H{i}", end - start))
+
+    partitions = [partition(date(2020, 10, 1), "N05", plan_rows[0]),
+                  partition(date(2020, 10, 2), "N06", plan_rows[1])]
+    return (rows, partitions)
+
+
+class TestAllocate(unittest.TestCase):
+
+    def test_allocate(self):
+        # 型 0: 注文 3, 2 に SPL 行 2, 3 / 型 1: 注文 4 に SPL 行 0, 4
+        allocation = allocate(orderKatas=array("l", [0, 0, 1]),
+                              orderQtys=array("q", [3, 2, 4]),
+                              splKatas=array("l", [0, 0, 1, 1]),
+                              splQtys=array("q", [2, 3, 0, 4]))
+        self.assertEqual(list(zip(allocation.orderIndexes,
+                                  allocation.splIndexes,
+                                  allocation.qtys)),
+                         [(0, 0, 2), (0, 1, 1), (1, 1, 2), (2, 3, 4)])
+
+    def test_allocate_exact_fill(self):
+        # 注残がちょうど埋まった注文には、同じ型の次の SPL 行から数量 0 の行が入る
+        allocation = allocate(orderKatas=array("l", [0, 0, 1]),
+                              orderQtys=array("q", [2, 2, 1]),
+                              splKatas=array("l", [0, 0, 1]),
+                              splQtys=array("q", [2, 2, 1]))
+        self.assertEqual(list(zip(allocation.orderIndexes,
+                                  allocation.splIndexes,
+                                  allocation.qtys)),
+                         [(0, 0, 2), (0, 1, 0), (1, 1, 2), (2, 2, 1)])
+
+    def test_allocate_not_equal(self):
+        with self.assertRaises(Exception):
+            allocate(orderKatas=array("l", [0]), orderQtys=array("q", [3]),
+                     splKatas=array("l", [0]), splQtys=array("q", [2]))
+
+    def test_allocate_empty(self):
+        allocation = allocate(array("l"), array("q"), array("l"), array("q"))
+        self.assertEqual(len(allocation.qtys), 0)
+
+    def test_matches_object_path(self):
+        config = AnsweredOrderFileColumnConfig()
+        with tempfile.TemporaryDirectory() as dir:
+            for seed in range(30):
+                (rows, partitions) = plan_case(seed)
+                path = write_order_xls(dir, rows, config)
+
+                order_files = OrderFiles(files=[
+                    OrderFile(isNew=False, path=path, config=config)])
+                order_files.apply_shipping_plan(partitions=partitions)
+                columnar_files = OrderFiles(files=[
+                    OrderFile(isNew=False, path=path, config=config)])
+                columnar_files.apply_shipping_plan(partitions=partitions,
+                                                   columnar=True)
+
+                self.assertEqual(columnar_files.orders, order_files.orders,
+                                 f"seed={seed}")
+                self.assertEqual([order.updatedReleasedQty
+                                  for order in columnar_files.orders],
+                                 [order.updatedReleasedQty
+                                  for order in order_files.orders],
+                                 f"seed={seed}")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,179 @@
+import unittest
+from contextlib import contextmanager
+from datetime import date
+
+from shipping_instruction import browser
+from shipping_instruction.browser import BrowserSession, WaitTimer
+from shipping_instruction.config import DriverConfig
+from shipping_instruction.order import Order, SPLRow
+
+# モジュールの外からは名前の変換を避けて取り出す
+registration_groups = getattr(browser, "__registration_groups")
+hin_cell_text = getattr(browser, "__hin_cell_text")
+
+
+class FakeSwitchTo:
+
+    def __init__(self, calls):
+        self.calls = calls
+
+    def default_content(self):
+        self.calls.append(("default_content",))
+
+
+class FakeDriver:
+    CONTEXT_CHROME = "chrome"
+
+    def __init__(self):
+        self.calls = []
+        self.switch_to = FakeSwitchTo(self.calls)
+
+    @contextmanager
+    def context(self, context):
+        self.calls.append(("context", context))
+        yield
+
+    def execute_script(self, script, *args):
+        self.calls.append(("execute_script",) + args)
+
+    def get(self, url):
+        self.calls.append(("get", url))
+
+    def quit(self):
+        self.calls.append(("quit",))
+
+
+class FakeUser:
+    URL = "http://portal.example/"
+
+
+class TestBrowserSession(unittest.TestCase):
+
+    def test_borrow(self):
+        driver_config = DriverConfig(download="")
+        session = BrowserSession(driver_config, FakeUser())
+        # 起動とログインは済んでいることにする
+        driver = FakeDriver()
+        session.driver = driver
+        session.launchSeconds = 4.0
+
+        # ログインした直後はそのまま貸す
+        self.assertIs(session.borrow(driver_config), driver)
+        self.assertEqual(driver.calls, [])
+
+        # 2 回目からはメニューのページに戻して、ダウンロード先を切り替える
+        download_config = DriverConfig(download="")
+        download_config.preference = {"browser.download.dir": "C:\\pdf",
+                                      "browser.download.folderList": 2}
+        session.borrow(download_config)
+        self.assertEqual(driver.calls, [
+            ("context", "chrome"),
+            ("execute_script", download_config.preference),
+            ("default_content",),
+            ("get", FakeUser.URL),
+        ])
+
+        session.borrow(driver_config)
+        self.assertEqual(session.borrowCount, 3)
+        self.assertEqual(session.savedLaunchCount, 2)
+        self.assertEqual(session.savedSeconds, 8.0)
+
+        with session:
+            pass
+        self.assertEqual(driver.calls[-1], ("quit",))
+        self.assertIsNone(session.driver)
+
+
+class FakeWait:
+
+    def __init__(self, result):
+        self.result = result
+
+    def until(self, condition):
+        if self.result is None:
+            raise TimeoutError()
+        return self.result
+
+
+class TestWaitTimer(unittest.TestCase):
+
+    def test_until(self):
+        timer = WaitTimer()
+        self.assertEqual(timer.until(FakeWait("element"), None, fixedSeconds=3),
+                         "element")
+        self.assertEqual(timer.fixedSeconds, 3)
+        self.assertLess(timer.waitedSeconds, 1)
+        self.assertGreater(timer.savedSeconds, 2)
+
+        # 待ちきれなかったときも、待った時間は数える
+        with self.assertRaises(TimeoutError):
+            timer.until(FakeWait(None), None, fixedSeconds=1)
+        self.assertEqual(timer.fixedSeconds, 4)
+
+        total = WaitTimer()
+        total.add(timer)
+        total.add(timer)
+        self.assertEqual(total.fixedSeconds, 8)
+        self.assertEqual(total.waitedSeconds, timer.waitedSeconds * 2)
+
+
+class TestRegistrationGroups(unittest.TestCase):
+
+    def test_registration_groups(self):
+        order = Order(orderID="1", orderNumber="9001", tyuumonBangou="AB0001",
+                      kata="K1", orderQty=5, isNew=False, releasedQty=5)
+        for (hin, day, is_tbd) in [("H1", 1, False), ("H2", 1, False),
+                                   ("H3", 2, False), ("H4", 1, True),
+                                   ("H5", 1, False)]:
+            order.append_spl_row(SPLRow(kata="K1", hin=hin,  # type: ignore
+                                        shipmentDate=date(2020, 10, day),
+                                        shipmentQty=1, shipmentWarehouse="N05",
+                                        isTBD=is_tbd))
+        other = Order(orderID="2", orderNumber="9002", tyuumonBangou="AB0002",
+                      kata="K1", orderQty=1, isNew=False, releasedQty=1)
+        other.append_spl_row(SPLRow(kata="K1", hin="H1",  # type: ignore
+                                    shipmentDate=date(2020, 10, 1),
+                                    shipmentQty=1, shipmentWarehouse="N05",
+                                    isTBD=False))
+
+        def hins(groups):
+            return [(order.orderNumber, [row.hin for row in rows])
+                    for (order, rows) in groups]
+
+        # 1 行ずつ
+        self.assertEqual(hins(registration_groups([order, other], False)),
+                         [("9001", ["H1"]), ("9001", ["H2"]), ("9001", ["H3"]),
+                          ("9001", ["H5"]), ("9002", ["H1"])])
+
+        # 注文番号と出荷日ごと
+        self.assertEqual(hins(registration_groups([order, other], True)),
+                         [("9001", ["H1", "H2", "H5"]), ("9001", ["H3"]),
+                          ("9002", ["H1"])])
+
+
+class FakeElement:
+
+    def __init__(self, text: str = "", headers=(), cells=()):
+        self.text = text
+        self.headers = [FakeElement(header) for header in headers]
+        self.cells = [FakeElement(cell) for cell in cells]
+
+    def find_elements(self, by, xpath):
+        return self.headers if "th" in xpath else self.cells
+
+
+class TestHinCellText(unittest.TestCase):
+
+    def test_hin_cell_text(self):
+        headers = ["選択", "型式", "品目", "備考"]
+        row = FakeElement(headers=headers, cells=["", "H2", " H1 ", "H2 H3"])
+        # ほかの欄に同じ文字があっても、品目の欄だけを見る
+        self.assertEqual(hin_cell_text(row), "H1")
+
+        # 品目の欄がわからなければ、見分けられない
+        self.assertIsNone(hin_cell_text(FakeElement(headers=["型式"], cells=["H1"])))
+        self.assertIsNone(hin_cell_text(FakeElement(headers=headers, cells=["", "K1"])))
+
+
+if __name__ == "__main__":
+    unittest.main()
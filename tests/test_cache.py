@@ -0,0 +1,181 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from xlwt import Workbook
+
+from shipping_instruction.cache import SnapshotCache
+from shipping_instruction.config import (AnsweredOrderFileColumnConfig,
+                                         MRPCConfig, PMSFileColumnsConfig)
+from shipping_instruction.order import OrderFile
+from shipping_instruction.pms import PMSFile
+from tests.fixtures import answered_row, write_order_xls, write_pms_csv
+
+
+class TestSnapshotCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+        self.cache_dir = str(Path(self.dir).joinpath("cache"))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_key(self):
+        path = Path(self.dir).joinpath("a.csv")
+        path.write_bytes(b"abc")
+        key = SnapshotCache.key(str(path), "1", PMSFileColumnsConfig())
+        self.assertEqual(key,
+                         SnapshotCache.key(str(path), "1", PMSFileColumnsConfig()))
+        self.assertNotEqual(key,
+                            SnapshotCache.key(str(path), "2", PMSFileColumnsConfig()))
+        self.assertNotEqual(key,
+                            SnapshotCache.key(str(path), "1", AnsweredOrderFileColumnConfig()))
+
+        path.write_bytes(b"abd")
+        self.assertNotEqual(key,
+                            SnapshotCache.key(str(path), "1", PMSFileColumnsConfig()))
+
+    def test_lru_eviction(self):
+        cache = SnapshotCache(self.cache_dir, maxBytes=2500)
+        payload = b"x" * 1000
+        cache.save("a", payload)
+        cache.save("b", payload)
+        os.utime(str(Path(self.cache_dir).joinpath("a.pickle")), (1, 1))
+        os.utime(str(Path(self.cache_dir).joinpath("b.pickle")), (2, 2))
+
+        # a を使ったので、次に消えるのは b
+        self.assertEqual(cache.load("a"), payload)
+        cache.save("c", payload)
+
+        self.assertEqual(cache.load("a"), payload)
+        self.assertIsNone(cache.load("b"))
+        self.assertEqual(cache.load("c"), payload)
+
+    def test_broken_snapshot(self):
+        cache = SnapshotCache(self.cache_dir)
+        Path(self.cache_dir).joinpath("a.pickle").write_bytes(b"broken")
+        self.assertIsNone(cache.load("a"))
+        self.assertFalse(Path(self.cache_dir).joinpath("a.pickle").exists())
+
+    def test_order_file_snapshot(self):
+        cache = SnapshotCache(self.cache_dir)
+        path = write_order_xls(self.dir, [
+            answered_row(1, "K1", 10, 6),
+            answered_row(1, "K1", 10, 4, released=False),
+        ], AnsweredOrderFileColumnConfig())
+
+        first = OrderFile(isNew=False, path=path,
+                          config=AnsweredOrderFileColumnConfig(), cache=cache)
+        first.orders[0].releasedQty = 0
+        second = OrderFile(isNew=False, path=path,
+                           config=AnsweredOrderFileColumnConfig(), cache=cache)
+
+        # 読み込み直後の状態が保存されていて、あとからの変更は影響しない
+        self.assertEqual(second.orderOfID["1"].releasedQty, 6)
+        self.assertEqual(second.orderOfID["1"].notReleasedRows, [2])
+        self.assertEqual(len(list(Path(self.cache_dir).iterdir())), 1)
+
+    def test_order_file_incremental(self):
+        cache = SnapshotCache(self.cache_dir)
+        config = AnsweredOrderFileColumnConfig()
+        rows = [answered_row(1, "K1", 10, 6),
+                answered_row(1, "K1", 10, 4, released=False),
+                answered_row(2, "K2", 5, 5)]
+        path = write_order_xls(self.dir, rows, config)
+        first = OrderFile(isNew=False, path=path, config=config,
+                          cache=cache, incrementalKey="answered-40")
+        self.assertEqual(first.reusedOrderCount, 0)
+
+        # 受注 2 だけ更新され、受注 3 が増え、行の並びも変わる
+        changed = dict(answered_row(2, "K2", 5, 3), JUTYUU_RECORD_KOUSHIN_BI=44106.5)
+        path = write_order_xls(self.dir, [answered_row(3, "K3", 7, 7),
+                                          changed] + rows[:2], config)
+        second = OrderFile(isNew=False, path=path, config=config,
+                           cache=cache, incrementalKey="answered-40")
+
+        self.assertEqual(second.reusedOrderCount, 1)
+        self.assertEqual([order.orderID for order in second.orders],
+                         ["3", "2", "1"])
+        self.assertEqual(second.orderOfID["1"].releasedQty, 6)
+        self.assertEqual(second.orderOfID["1"].releasedRows, [3])
+        self.assertEqual(second.orderOfID["1"].notReleasedRows, [4])
+        self.assertEqual(second.orderOfID["2"].releasedQty, 3)
+        self.assertEqual(second.orderOfID["3"].releasedQty, 7)
+
+        # 全部を作り直した結果と同じになる
+        full = OrderFile(isNew=False, path=path, config=config)
+        self.assertEqual(second.orders, full.orders)
+        self.assertEqual(second.katas, full.katas)
+
+    def test_order_file_incremental_any_column(self):
+        cache = SnapshotCache(self.cache_dir)
+        config = AnsweredOrderFileColumnConfig()
+        rows = [answered_row(1, "K1", 10, 6), answered_row(2, "K2", 5, 5)]
+        path = write_order_xls(self.dir, rows, config)
+        OrderFile(isNew=False, path=path, config=config,
+                  cache=cache, incrementalKey="answered-40")
+
+        # 更新日時やステータスは同じまま、受注数量と品目だけが変わる
+        changed = [dict(rows[0], JUTYUU_SUU=12), dict(rows[1], HINBAN="K2-H2")]
+        path = write_order_xls(self.dir, changed, config)
+        second = OrderFile(isNew=False, path=path, config=config,
+                           cache=cache, incrementalKey="answered-40")
+
+        self.assertEqual(second.reusedOrderCount, 0)
+        self.assertEqual(second.orderOfID["1"].orderQty, 12)
+        full = OrderFile(isNew=False, path=path, config=config)
+        self.assertEqual(second.orders, full.orders)
+
+    def test_order_file_incremental_empty(self):
+        cache = SnapshotCache(self.cache_dir)
+        config = AnsweredOrderFileColumnConfig()
+        path = write_order_xls(self.dir, [answered_row(1, "K1", 10, 6)], config)
+        OrderFile(isNew=False, path=path, config=config,
+                  cache=cache, incrementalKey="answered-40")
+
+        # ヘッダだけのファイルも、行もないファイルも、全部を作り直すときと同じく扱う
+        header_only = write_order_xls(self.dir, [], config, name="header.xls")
+        wb = Workbook()
+        wb.add_sheet(config.SHEET)
+        empty = str(Path(self.dir).joinpath("empty.xls"))
+        wb.save(empty)
+        for path in (header_only, empty):
+            with self.assertRaises(Exception) as full:
+                OrderFile(isNew=False, path=path, config=config)
+            with self.assertRaises(Exception) as incremental:
+                OrderFile(isNew=False, path=path, config=config,
+                          cache=cache, incrementalKey="answered-40")
+            self.assertEqual(str(incremental.exception), str(full.exception))
+            self.assertEqual(str(incremental.exception), "No Data In Order File")
+
+    def test_pms_file_snapshot_sites(self):
+        cache = SnapshotCache(self.cache_dir)
+        path = write_pms_csv(self.dir, [{"kata": "K1", "hin": "H1", "qty": 3}])
+        PMSFile(path=path, config=PMSFileColumnsConfig(), cache=cache)
+
+        # MRP 拠点の対応が変われば、前の読み込み結果は使わない
+        sites = dict(MRPCConfig.SITES, W=("60", "W01"))
+        with mock.patch.object(MRPCConfig, "SITES", sites):
+            PMSFile(path=path, config=PMSFileColumnsConfig(), cache=cache)
+        self.assertEqual(len(list(Path(self.cache_dir).iterdir())), 2)
+
+        PMSFile(path=path, config=PMSFileColumnsConfig(), cache=cache)
+        self.assertEqual(len(list(Path(self.cache_dir).iterdir())), 2)
+
+    def test_pms_file_snapshot(self):
+        cache = SnapshotCache(self.cache_dir)
+        path = write_pms_csv(self.dir, [{"kata": "K1", "hin": "H1", "qty": 3}])
+
+        first = PMSFile(path=path, config=PMSFileColumnsConfig(), cache=cache)
+        second = PMSFile(path=path, config=PMSFileColumnsConfig(), cache=cache)
+        self.assertEqual(first.partitions, second.partitions)
+        self.assertEqual(second.instructionNumber, "A001")
+        self.assertEqual(second.fileName, "pms.csv")
+
+
+if __name__ == "__main__":
+    unittest.main()
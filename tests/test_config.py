@@ -0,0 +1,59 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from shipping_instruction.config import DriverConfig
+
+
+class TestDriverConfig(unittest.TestCase):
+
+    def test_profile(self):
+        # 指定したプロファイルはそのまま使う
+        self.assertEqual(DriverConfig(profile="profile").profile, "profile")
+
+    def test_profile_template(self):
+        with tempfile.TemporaryDirectory() as dir:
+            source = Path(dir).joinpath("abcd.default-release")
+            source.mkdir()
+            source.joinpath("cert9.db").write_bytes(b"cert")
+            source.joinpath("places.sqlite").write_bytes(b"history" * 1024)
+            source.joinpath("cache2").mkdir()
+
+            class Config(DriverConfig):
+                PROFILE_TEMPLATE_DIR = str(Path(dir).joinpath("template"))
+
+            with mock.patch.object(DriverConfig, "_DriverConfig__get_profile_dir",
+                                   staticmethod(lambda: str(source))):
+                # 起動するまでは作らない
+                config = Config(download=str(Path(dir).joinpath("download")))
+                self.assertFalse(Path(Config.PROFILE_TEMPLATE_DIR).exists())
+
+                profile = Path(config.profile)
+
+                # 証明書の設定とダウンロードの設定だけを持つ
+                self.assertEqual(sorted(p.name for p in profile.iterdir()),
+                                 ["cert9.db", "user.js"])
+                user_js = profile.joinpath("user.js").read_text(encoding="utf-8")
+                self.assertIn('user_pref("browser.download.folderList", 2);',
+                              user_js)
+                self.assertIn("application/pdf", user_js)
+                # ダウンロード先は起動するときに設定する
+                self.assertNotIn("browser.download.dir\"", user_js)
+                self.assertEqual(config.preference["browser.download.dir"],
+                                 config.download)
+
+                # 2 回目からは作ってあるものを使う
+                mtime = profile.joinpath("user.js").stat().st_mtime_ns
+                self.assertEqual(Config().profile, str(profile))
+                self.assertEqual(profile.joinpath("user.js").stat().st_mtime_ns,
+                                 mtime)
+
+            # 既定のプロファイルを使うこともできる
+            with mock.patch.object(DriverConfig, "_DriverConfig__get_profile_dir",
+                                   staticmethod(lambda: str(source))):
+                self.assertEqual(Config(slimProfile=False).profile, str(source))
+
+
+if __name__ == "__main__":
+    unittest.main()
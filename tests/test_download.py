@@ -0,0 +1,61 @@
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+from shipping_instruction.download import DownloadTracker
+
+
+def firefox_like_download(dir: str, name: str, chunks: int = 5):
+    # Firefox と同じく、空のファイルと .part ファイルを作り、書き終えたら名前を変える
+    target = Path(dir).joinpath(name)
+    part = Path(dir).joinpath(f"{name}.part")
+    target.touch()
+    with open(part, "wb") as f:
+        for _ in range(chunks):
+            f.write(b"x" * 1024)
+            f.flush()
+            time.sleep(0.02)
+    part.replace(target)
+
+
+class TestDownloadTracker(unittest.TestCase):
+
+    def test_wait(self):
+        with tempfile.TemporaryDirectory() as dir:
+            # 前の行の PDF が残っていても、新しいファイルを待つ
+            Path(dir).joinpath("previous.pdf").write_bytes(b"previous")
+
+            with DownloadTracker(dir, pollFrequency=0.05) as tracker:
+                for name in ("first.pdf", "second.pdf"):
+                    tracker.snapshot()
+                    writer = threading.Thread(target=firefox_like_download,
+                                              args=(dir, name))
+                    writer.start()
+                    path = tracker.wait(5)
+                    writer.join()
+
+                    self.assertEqual(Path(path).name, name)
+                    self.assertEqual(Path(path).stat().st_size, 5 * 1024)
+
+    def test_wait_timeout(self):
+        with tempfile.TemporaryDirectory() as dir:
+            Path(dir).joinpath("previous.pdf").write_bytes(b"previous")
+            with DownloadTracker(dir, pollFrequency=0.05) as tracker:
+                with self.assertRaises(Exception) as cm:
+                    tracker.wait(0.2)
+                self.assertIn("Download Timeout", str(cm.exception))
+
+    def test_wait_unexpected_downloads(self):
+        with tempfile.TemporaryDirectory() as dir:
+            with DownloadTracker(dir, pollFrequency=0.05) as tracker:
+                Path(dir).joinpath("a.pdf").write_bytes(b"a")
+                Path(dir).joinpath("b.pdf").write_bytes(b"b")
+                with self.assertRaises(Exception) as cm:
+                    tracker.wait(1)
+                self.assertIn("Unexpected Downloads", str(cm.exception))
+
+
+if __name__ == "__main__":
+    unittest.main()
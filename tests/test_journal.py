@@ -0,0 +1,150 @@
+import json
+import tempfile
+import unittest
+from datetime import date
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+from shipping_instruction import browser
+from shipping_instruction.browser import ShippingInstructionResult
+from shipping_instruction.journal import RegistrationJournal
+from shipping_instruction.order import Order, SPLRow
+
+# モジュールの外からは名前の変換を避けて取り出す
+resume_rows = getattr(browser, "__resume_rows")
+
+
+def make_order(orderNumber: str, hins, warehouses=None):
+    order = Order(orderID=orderNumber, orderNumber=orderNumber,
+                  tyuumonBangou=f"AB{orderNumber}", kata="K1",
+                  orderQty=len(hins), isNew=False, releasedQty=len(hins))
+    for (hin, warehouse) in zip(hins, warehouses or ["N05"] * len(hins)):
+        order.append_spl_row(SPLRow(kata="K1", hin=hin,  # type: ignore
+                                    shipmentDate=date(2021, 4, 1),
+                                    shipmentQty=1, shipmentWarehouse=warehouse,
+                                    isTBD=False))
+    return order
+
+
+class TestRegistrationJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = str(Path(self.tmp.name).joinpath("journal"))
+        self.download = Path(self.tmp.name).joinpath("download")
+        self.download.mkdir()
+        self.order = make_order("9001", ["H1", "H2", "H3"])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def download_pdf(self, name: str) -> str:
+        path = self.download.joinpath(name)
+        path.write_bytes(name.encode())
+        return str(path)
+
+    def test_record_and_resume(self):
+        (h1, h2, h3) = self.order.notTBDSPLRows
+        journal = RegistrationJournal(self.dir, "A1")
+        self.assertIsNone(journal.registered(self.order, h1))
+
+        kept = journal.record(self.order, h1, self.download_pdf("a.pdf"))
+        # まとめて登録した行は、同じ PDF を 1 回だけ残す
+        shared = self.download_pdf("b.pdf")
+        self.assertEqual(journal.record(self.order, h2, shared),
+                         journal.record(self.order, h3, shared))
+
+        # ダウンロード先を空にしても、残しておいた PDF は使える
+        for p in self.download.iterdir():
+            p.unlink()
+        self.assertEqual(Path(kept).read_bytes(), b"a.pdf")
+
+        # やり直すときは記録を読み込む
+        resumed = RegistrationJournal(self.dir, "A1")
+        self.assertEqual(len(resumed), 3)
+        self.assertEqual(resumed.registered(self.order, h1), kept)
+
+        # 指示番号が違えば別の記録
+        self.assertEqual(len(RegistrationJournal(self.dir, "A2")), 0)
+        # やり直さないときは読み込まない
+        self.assertEqual(len(RegistrationJournal(self.dir, "A1", resume=False)), 0)
+
+    def test_torn_line(self):
+        (h1, h2, _) = self.order.notTBDSPLRows
+        journal = RegistrationJournal(self.dir, "A1")
+        journal.record(self.order, h1, self.download_pdf("a.pdf"))
+
+        # 書いている途中で止まった
+        with open(journal.path, "a", encoding="utf-8") as f:
+            f.write('{"instructionNumber": "A1", "orderNu')
+
+        resumed = RegistrationJournal(self.dir, "A1")
+        self.assertEqual(len(resumed), 1)
+        kept = resumed.record(self.order, h2, self.download_pdf("a.pdf"))
+
+        # 前の実行の PDF は上書きしない
+        self.assertNotEqual(kept, journal.registered(self.order, h1))
+
+        # 書きかけの行の続きには書かない
+        lines = Path(journal.path).read_text(encoding="utf-8").splitlines()
+        self.assertEqual(json.loads(lines[-1])["hin"], "H2")
+        self.assertEqual(len(RegistrationJournal(self.dir, "A1")), 2)
+
+    def test_warehouse(self):
+        # 品番と出荷日が同じで、倉庫だけが違う行
+        order = make_order("9002", ["H1", "H1"], ["N01", "N02"])
+        (n01, n02) = order.notTBDSPLRows
+        journal = RegistrationJournal(self.dir, "A1")
+        kept = journal.record(order, n01, self.download_pdf("a.pdf"))
+
+        resumed = RegistrationJournal(self.dir, "A1")
+        self.assertEqual(resumed.registered(order, n01), kept)
+        # もう一方の行は登録していない
+        self.assertIsNone(resumed.registered(order, n02))
+
+        result = ShippingInstructionResult()
+        self.assertEqual(resume_rows(resumed, result, order, [n01, n02]), [n02])
+
+    def test_resume_rows(self):
+        (h1, h2, h3) = self.order.notTBDSPLRows
+        journal = RegistrationJournal(self.dir, "A1")
+        kept = journal.record(self.order, h2, self.download_pdf("b.pdf"))
+
+        result = ShippingInstructionResult()
+        remaining = resume_rows(journal, result, self.order, [h1, h2, h3])
+
+        # 登録済みの行は飛ばし、記録にある PDF を結合に使う
+        self.assertEqual(remaining, [h1, h3])
+        self.assertEqual(result.registeredRows, [(self.order, h2, kept)])
+        self.assertEqual(result.resumedRowCount, 1)
+
+    def test_group_registration(self):
+        # まとめて登録した行は、ダウンロードした 1 つの PDF を共有する
+        order = make_order("9003", ["H1", "H2"])
+        journal = RegistrationJournal(self.dir, "A1")
+
+        def register_group(driver, wait, timer, tracker, order, splRows,
+                           mrpCConfig, user, waitConfig):
+            return self.download_pdf("group.pdf")
+
+        session = SimpleNamespace(borrow=lambda driverConfig: object())
+        with mock.patch.object(browser, "__register_group", register_group):
+            result = browser.shipping_instruction(
+                orders=[order],
+                driverConfig=SimpleNamespace(download=str(self.download)),
+                mrpCConfig=None,
+                user=None,
+                session=session,
+                batchRegistration=True,
+                journal=journal)
+
+        pdf_paths = {pdf_path for (_, _, pdf_path) in result.registeredRows}
+        self.assertEqual(len(result.registeredRows), 2)
+        self.assertEqual(len(pdf_paths), 1)
+        self.assertEqual([p.name for p in Path(journal.pdfDir).iterdir()],
+                         ["0000_group.pdf"])
+
+
+if __name__ == "__main__":
+    unittest.main()
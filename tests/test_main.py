@@ -18,7 +18,7 @@ class TestMain(unittest.TestCase):
 
     def test_download_order(self):
         pms_file = read_pms_file()
-        mrp_c_config = MRPCConfig(pms_file)
+        mrp_c_config = MRPCConfig(pms_file.partitions[0])
         user = User(DirConfig.USER_JSON_PATH)
         download_answered_order(mrp_c_config, user)
         download_new_order(mrp_c_config, user)
@@ -34,8 +34,8 @@ class TestMain(unittest.TestCase):
 
         new_order_path = _get_first_file_in_dir(DirConfig.NEW_ORDER_DIR)
 
-        (_, _, order_files) = output_upload_file_wrapper(
-            pms_file,
+        (_, _, order_files, _) = output_upload_file_wrapper(
+            pms_file.partitions,
             answered_order_path,
             new_order_path
         )
@@ -49,7 +49,7 @@ class TestMain(unittest.TestCase):
 
     def test_shipping_instruction_wrapper(self):
         pms_file = read_pms_file()
-        mrp_c_config = MRPCConfig(pms_file)
+        mrp_c_config = MRPCConfig(pms_file.partitions[0])
         order_files = self.test_output_upload_file_wrapper()
         shipping_instruction_wrapper(
             order_files.ordersHasNotTBDSPLRow,
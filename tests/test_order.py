@@ -0,0 +1,232 @@
+import tempfile
+import unittest
+from datetime import date
+from pathlib import Path
+from typing import List
+
+from xlrd import open_workbook
+
+from shipping_instruction.config import (AnsweredOrderFileColumnConfig,
+                                         NewOrderFileColumnConfig)
+from shipping_instruction.order import Order, OrderFile, OrderFiles, SPLRow
+from tests.fixtures import (allocation_case, allocation_result, answered_row,
+                            legacy_spl_rows_to_order, partition,
+                            write_order_xls)
+
+
+class TestOrderFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def answered_file(self, rows: List[dict]) -> OrderFile:
+        path = write_order_xls(self.dir, rows, AnsweredOrderFileColumnConfig())
+        return OrderFile(isNew=False, path=path,
+                         config=AnsweredOrderFileColumnConfig())
+
+    def test_load_answered_file(self):
+        order_file = self.answered_file([
+            answered_row(2, "K2", 5, 5),
+            answered_row(1, "K1", 10, 6),
+            answered_row(1, "K1", 10, 4, released=False),
+            answered_row(2, "K2", 5, 0, released=False),
+            answered_row(1, "K1", 10, 3),
+        ])
+
+        self.assertEqual([order.orderID for order in order_file.orders],
+                         ["2", "1"])
+        order = order_file.orderOfID["1"]
+        self.assertEqual(order.orderNumber, "9001")
+        self.assertEqual(order.tyuumonBangou, "AB0001")
+        self.assertEqual(order.orderQty, 10)
+        self.assertEqual(order.releasedQty, 9)
+        self.assertEqual(order.releasedRows, [2, 5])
+        self.assertEqual(order.notReleasedRows, [3])
+        self.assertEqual(order_file.orderOfID["2"].releasedQty, 5)
+
+    def test_load_new_file(self):
+        path = write_order_xls(self.dir, [
+            {"JUTYUU_ID": 7, "JUTYUU_ORDER_BANGOU": 9007,
+             "TYUUMON_BANGOU": "AB0007", "KATABAN": "K1", "JUTYUU_SUU": 8},
+        ], NewOrderFileColumnConfig())
+        order_file = OrderFile(isNew=True, path=path,
+                               config=NewOrderFileColumnConfig())
+        order = order_file.orderOfID["7"]
+        # 新規受注は受注数量がそのままリリース数量
+        self.assertEqual(order.releasedQty, 8)
+        self.assertEqual(order.releasedRows, [])
+
+    def test_kata_indexes(self):
+        answered_file = self.answered_file([
+            answered_row(1, "K1", 10, 6),
+            answered_row(2, "K2", 5, 5),
+            answered_row(3, "K1", 4, 4),
+        ])
+        path = write_order_xls(self.dir, [
+            {"JUTYUU_ID": 7, "JUTYUU_ORDER_BANGOU": 9007,
+             "TYUUMON_BANGOU": "AB0007", "KATABAN": "K1", "JUTYUU_SUU": 8},
+        ], NewOrderFileColumnConfig(), name="new.xls")
+        new_file = OrderFile(isNew=True, path=path,
+                             config=NewOrderFileColumnConfig())
+
+        self.assertEqual(answered_file.katas, ["K1", "K2"])
+        self.assertEqual(answered_file.releasedQtyOfKata, {"K1": 10, "K2": 5})
+
+        order_files = OrderFiles(files=[answered_file])
+        order_files.append_order_file(orderFile=new_file)
+
+        self.assertEqual([order.orderID for order in order_files.ordersOfKata["K1"]],
+                         ["1", "3", "7"])
+        self.assertEqual(order_files.releasedQtyOfKata, {"K1": 18, "K2": 5})
+        # ファイル側の索引は足し合わせても変わらない
+        self.assertEqual(len(answered_file.ordersOfKata["K1"]), 2)
+
+    def test_apply_shipping_plan_over_partitions(self):
+        order_file = self.answered_file([
+            answered_row(1, "K1", 10, 6),
+            answered_row(1, "K1", 10, 4, released=False),
+            answered_row(2, "K1", 5, 5),
+            answered_row(3, "K2", 3, 3),
+        ])
+        order_files = OrderFiles(files=[order_file])
+
+        order_files.apply_shipping_plan(partitions=[
+            partition(date(2020, 10, 1), "N05", [("K1", "H1", 4)]),
+            partition(date(2020, 10, 2), "N06", [("K1", "H2", 5),
+                                                 ("K2", "H3", 3)]),
+        ])
+
+        shipped = {}
+        for order in order_files.orders:
+            # 注番ごとのリリース数量がちょうど埋まる
+            self.assertEqual(sum(r.shipmentQty for r in order.splRows),
+                             order.releasedQty)
+            for r in order.splRows:
+                key = (r.kata, r.hin, r.shipmentDate, r.shipmentWarehouse,
+                       r.isTBD)
+                shipped[key] = shipped.get(key, 0) + r.shipmentQty
+
+        self.assertEqual(shipped, {
+            ("K1", "H1", date(2020, 10, 1), "N05", False): 4,
+            ("K1", "H2", date(2020, 10, 2), "N06", False): 5,
+            ("K1", "H1", None, "N05", True): 2,
+            ("K2", "H3", date(2020, 10, 2), "N06", False): 3,
+        })
+
+    def test_apply_shipping_plan_columnar(self):
+        rows = [answered_row(1, "K1", 10, 6),
+                answered_row(1, "K1", 10, 4, released=False),
+                answered_row(2, "K1", 5, 5),
+                answered_row(3, "K2", 3, 3),
+                answered_row(4, "K2", 0, 0)]
+        partitions = [
+            partition(date(2020, 10, 1), "N05", [("K1", "H1", 6)]),
+            partition(date(2020, 10, 2), "N06", [("K1", "H2", 3),
+                                                 ("K2", "H3", 3)]),
+        ]
+        order_files = OrderFiles(files=[self.answered_file(rows)])
+        order_files.apply_shipping_plan(partitions=partitions)
+        columnar_files = OrderFiles(files=[self.answered_file(rows)])
+        columnar_files.apply_shipping_plan(partitions=partitions,
+                                           columnar=True)
+
+        self.assertEqual(columnar_files.orders, order_files.orders)
+        self.assertEqual([order.updatedReleasedQty
+                          for order in columnar_files.orders],
+                         [order.updatedReleasedQty
+                          for order in order_files.orders])
+
+    def test_spl_rows_to_order_matches_legacy(self):
+        spl_rows_to_order = OrderFiles._OrderFiles__spl_rows_to_order  # type: ignore
+        for seed in range(300):
+            make = allocation_case(seed,
+                                   orderCount=1 + seed % 12,
+                                   splRowCount=1 + seed % 7)
+            (orders, spl_rows) = make()
+            legacy_spl_rows_to_order(spl_rows, orders)
+            expected = allocation_result(orders, spl_rows)
+
+            (orders, spl_rows) = make()
+            spl_rows_to_order(splRows=spl_rows, orders=orders)
+            self.assertEqual(allocation_result(orders, spl_rows), expected,
+                             f"seed={seed}")
+
+    def test_spl_rows_to_order_exact_fill(self):
+        # 注残がちょうど埋まったオーダにも、次の SPL 行から数量 0 の行が入る
+        orders = [Order(orderID=str(i), orderNumber=str(i), tyuumonBangou="AB",
+                        kata="K", orderQty=2, isNew=False, releasedQty=2)
+                  for i in range(2)]
+        spl_rows = [SPLRow(kata="K", hin=f"H{i}",  # type: ignore
+                           shipmentDate=date(2020, 10, 1), shipmentQty=2,
+                           shipmentWarehouse="N05", isTBD=False)
+                    for i in range(2)]
+        OrderFiles._OrderFiles__spl_rows_to_order(  # type: ignore
+            splRows=spl_rows, orders=orders)
+
+        self.assertEqual([(row.hin, row.shipmentQty) for row in orders[0].splRows],
+                         [("H0", 2), ("H1", 0)])
+        self.assertEqual([(row.hin, row.shipmentQty) for row in orders[1].splRows],
+                         [("H1", 2)])
+
+    def test_not_tbd_spl_rows(self):
+        order = Order(orderID="1", orderNumber="9001", tyuumonBangou="AB0001",
+                      kata="K1", orderQty=3, isNew=False, releasedQty=3)
+        spl_rows = [SPLRow(kata="K1", hin="H1",  # type: ignore
+                           shipmentDate=date(2020, 10, 1), shipmentQty=1,
+                           shipmentWarehouse="N05", isTBD=is_tbd)
+                    for is_tbd in [False, True, False]]
+        self.assertFalse(order.hasNotTBDSPLRow)
+
+        for spl_row in spl_rows:
+            order.append_spl_row(spl_row)
+        self.assertTrue(order.hasNotTBDSPLRow)
+        self.assertEqual(order.notTBDSPLRows, [spl_rows[0], spl_rows[2]])
+
+        order.splRows = spl_rows[1:2]
+        self.assertFalse(order.hasNotTBDSPLRow)
+        self.assertEqual(order.splRows, spl_rows[1:2])
+
+    def test_output_upload_file(self):
+        C = AnsweredOrderFileColumnConfig
+        order_file = self.answered_file([
+            answered_row(1, "K1", 10, 6),
+            answered_row(1, "K1", 10, 4, released=False),
+        ])
+        order_files = OrderFiles(files=[order_file])
+        order_files.apply_shipping_plan(partitions=[
+            partition(date(2020, 10, 1), "N05", [("K1", "H1", 4)]),
+        ])
+
+        output = str(Path(self.dir).joinpath("out", "answered.xls"))
+        self.assertTrue(order_file.output_upload_file(output=output))
+
+        sh = open_workbook(output).sheet_by_name(C.SHEET)
+        rows = [sh.row_values(row) for row in range(1, sh.nrows)]
+        self.assertEqual(len(rows), 4)
+        # 空欄のセルも列の範囲に入る
+        self.assertEqual(open_workbook(output, formatting_info=True)
+                         .sheet_by_name(C.SHEET).ncols, C.TYUUSYAKU + 1)
+
+        # 元の行: リリース済みの行は削除扱い
+        self.assertEqual(rows[0][C.JUTYUU_ID], "1")
+        self.assertEqual(rows[0][C.SAKUJO_F], C.DELETE_VAL)
+        self.assertEqual(rows[0][C.KAITOU_SUU], "6")
+        self.assertEqual(rows[0][C.KAITOU_SYUKKA_BI], "2020-10-01")
+        self.assertEqual(rows[0][C.JUTYUU_RECORD_KOUSHIN_BI],
+                         "2020-10-01 12:00:00")
+        self.assertEqual(rows[1][C.SAKUJO_F], "")
+        self.assertEqual(rows[1][C.KAITOU_SUU], "4")
+
+        # 出荷計画の行
+        self.assertEqual([(r[C.HINBAN], r[C.KAITOU_SUU], r[C.KAITOU_SYUKKA_BI],
+                           r[C.SYUKKA_SOUKO]) for r in rows[2:]],
+                         [("H1", 4, "2020-10-01", "N05"),
+                          ("H1", 2, "", "N05")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,271 @@
+import io
+import tempfile
+import threading
+import unittest
+from contextlib import redirect_stdout
+from datetime import date
+from pathlib import Path
+from unittest import mock
+
+from shipping_instruction import main
+from shipping_instruction.config import DirConfig, InstructionConfig
+from shipping_instruction.order import Order, SPLRow
+from shipping_instruction.pms import PMSPartition
+
+
+class FakePMSFile:
+
+    def __init__(self, warehouses):
+        self.instructionNumber = "A1"
+        self.partitionsOfSite = {}
+        for warehouse in warehouses:
+            self.partitionsOfSite.setdefault(warehouse[0], []).append(
+                PMSPartition(shipmentDate=date(2021, 4, 1),
+                             shipmentWarehouse=warehouse,
+                             pmsRowsOfKatas=())
+            )
+
+
+class TestPipeline(unittest.TestCase):
+
+    def test_dir_config_of_site(self):
+        base = DirConfig("A1")
+        north = base.of_site("40")
+        east = base.of_site("20")
+
+        self.assertEqual(north.instructionNumber, "A1")
+        self.assertEqual(north.ANSWERED_ORDER_OUTPUT_PATH,
+                         "output\\A1\\40\\answered.xls")
+        self.assertEqual(east.NEW_ORDER_OUTPUT_PATH,
+                         "output\\A1\\20\\new.xls")
+
+        # 拠点ごとにダウンロード先と出力先が重ならない
+        for name in ("ANSWERED_ORDER_DIR", "NEW_ORDER_DIR", "PDF_DIR",
+                     "ANSWERED_ORDER_OUTPUT_PATH", "NEW_ORDER_OUTPUT_PATH"):
+            self.assertNotEqual(getattr(north, name), getattr(east, name))
+
+        # 拠点を指定しなければ今までと同じ
+        self.assertEqual(DirConfig().ANSWERED_ORDER_DIR,
+                         DirConfig.ANSWERED_ORDER_DIR)
+        self.assertEqual(DirConfig().PDF_DIR, DirConfig.PDF_DIR)
+
+    def test_run_pipeline_sites_concurrently(self):
+        pms_file = FakePMSFile(["N05", "E09"])
+        barrier = threading.Barrier(2, timeout=5)
+        calls = {}
+
+        def run_site_pipeline(pmsFile, partitions, mrpCConfig, user,
+                              dirConfig, pdfSuffix, incremental=False,
+                              instructionConfig=None):
+            # 両方の拠点が同時に動いていなければ、ここで待ちきれずに失敗する
+            barrier.wait()
+            calls[mrpCConfig.MRPC] = (dirConfig, pdfSuffix)
+            return True
+
+        with mock.patch.object(main, "run_site_pipeline", run_site_pipeline):
+            done = main.run_pipeline(pmsFile=pms_file,
+                                     user=None,
+                                     dirConfig=DirConfig("A1"))
+
+        self.assertTrue(done)
+        self.assertEqual(set(calls), {"40", "20"})
+        self.assertEqual(calls["40"][1], "_40")
+        self.assertEqual(calls["40"][0].PDF_DIR, "download\\40\\pdf")
+        self.assertEqual(calls["20"][0].ANSWERED_ORDER_DIR,
+                         "download\\20\\answered")
+
+    def test_run_pipeline_reports_failed_site(self):
+        pms_file = FakePMSFile(["N05", "E09"])
+        finished = []
+
+        def run_site_pipeline(pmsFile, partitions, mrpCConfig, user,
+                              dirConfig, pdfSuffix, incremental=False,
+                              instructionConfig=None):
+            if mrpCConfig.MRPC == "40":
+                raise Exception("ダウンロードに失敗しました")
+            finished.append(mrpCConfig.MRPC)
+            return True
+
+        with mock.patch.object(main, "run_site_pipeline", run_site_pipeline):
+            done = main.run_pipeline(pmsFile=pms_file,
+                                     user=None,
+                                     dirConfig=DirConfig())
+
+        # 失敗した拠点があっても、ほかの拠点は最後まで進む
+        self.assertFalse(done)
+        self.assertEqual(finished, ["20"])
+
+    def test_download_order_files_concurrently(self):
+        barrier = threading.Barrier(2, timeout=5)
+        sessions = {}
+
+        def download_answered_order(mrpCConfig, user, dirConfig, session,
+                                    portal=None):
+            # 両方のダウンロードが同時に動いていなければ、ここで待ちきれずに失敗する
+            barrier.wait()
+            sessions["answered"] = session
+            return "answered.xls"
+
+        def download_new_order(mrpCConfig, user, dirConfig, session,
+                               portal=None):
+            barrier.wait()
+            sessions["new"] = session
+            return None
+
+        session = object()
+        with mock.patch.object(main, "download_answered_order", download_answered_order), \
+                mock.patch.object(main, "download_new_order", download_new_order):
+            paths = main.download_order_files(mrpCConfig=None,
+                                              user=None,
+                                              session=session)
+
+        self.assertEqual(paths, ("answered.xls", None))
+        # 新規受注は別のブラウザでダウンロードする
+        self.assertIs(sessions["answered"], session)
+        self.assertIsNot(sessions["new"], session)
+
+    def test_run_pipeline_single_site(self):
+        pms_file = FakePMSFile(["N05", "N06"])
+        calls = []
+
+        def run_site_pipeline(pmsFile, partitions, mrpCConfig, user,
+                              dirConfig, pdfSuffix, incremental=False,
+                              instructionConfig=None):
+            calls.append((len(partitions), dirConfig, pdfSuffix))
+            return True
+
+        dir_config = DirConfig()
+        with mock.patch.object(main, "run_site_pipeline", run_site_pipeline):
+            self.assertTrue(main.run_pipeline(pmsFile=pms_file,
+                                              user=None,
+                                              dirConfig=dir_config))
+
+        self.assertEqual(calls, [(2, dir_config, "")])
+
+
+def make_order(orderNumber: str, hins):
+    order = Order(orderID=orderNumber, orderNumber=orderNumber,
+                  tyuumonBangou=f"AB{orderNumber}", kata="K1",
+                  orderQty=len(hins), isNew=False, releasedQty=len(hins))
+    for hin in hins:
+        order.append_spl_row(SPLRow(kata="K1", hin=hin,  # type: ignore
+                                    shipmentDate=date(2021, 4, 1),
+                                    shipmentQty=1, shipmentWarehouse="N05",
+                                    isTBD=False))
+    return order
+
+
+class FakeBrowserSession:
+
+    def __init__(self, driverConfig, user):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class TestInstructionWorkers(unittest.TestCase):
+
+    def setUp(self):
+        self.orders = [make_order("9001", ["H1", "H2", "H3"]),
+                       make_order("9002", ["H1"]),
+                       make_order("9003", ["H1", "H2"]),
+                       make_order("9004", ["H1"])]
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir_config = DirConfig()
+        self.dir_config.PDF_DIR = str(Path(self.tmp.name).joinpath("pdf"))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_shard_orders(self):
+        shards = main.shard_orders(self.orders, 2)
+        self.assertEqual([[order.orderNumber for order in shard] for shard in shards],
+                         [["9001", "9004"], ["9002", "9003"]])
+
+        # ワーカーがオーダより多くても、空のワーカーは作らない
+        self.assertEqual(len(main.shard_orders(self.orders[:1], 3)), 1)
+
+    def run_workers(self, fail: str = ""):
+        barrier = threading.Barrier(2, timeout=5)
+        calls = []
+
+        def shipping_instruction(orders, driverConfig, mrpCConfig, user,
+                                 session, batchRegistration, result, journal=None):
+            calls.append((orders[0].orderNumber, driverConfig.download, session))
+            barrier.wait()
+            # 後ろのオーダを持つワーカーのほうが先に終わる
+            if orders[0].orderNumber == "9001":
+                barrier.wait()
+            try:
+                for order in orders:
+                    for spl_row in order.notTBDSPLRows:
+                        if order.orderNumber == fail:
+                            raise Exception("SPL Not Found")
+                        result.registeredRows.append(
+                            (order, spl_row, f"{order.orderNumber}-{spl_row.hin}.pdf"))
+            finally:
+                if orders[0].orderNumber != "9001":
+                    barrier.wait()
+            return result
+
+        session = object()
+        output = io.StringIO()
+        with mock.patch.object(main, "shipping_instruction", shipping_instruction), \
+                mock.patch.object(main, "BrowserSession", FakeBrowserSession), \
+                redirect_stdout(output):
+            try:
+                files = main.shipping_instruction_wrapper(
+                    orders=self.orders,
+                    mrpCConfig=None,
+                    user=None,
+                    dirConfig=self.dir_config,
+                    session=session,
+                    instructionConfig=InstructionConfig(workers=2))
+            except Exception as e:
+                files = e
+
+        return (files, calls, session, output.getvalue())
+
+    def test_workers(self):
+        (files, calls, session, _) = self.run_workers()
+
+        # 終わった順ではなく、オーダと SPL 行の順に結合する
+        self.assertEqual(files, ["9001-H1.pdf", "9001-H2.pdf", "9001-H3.pdf",
+                                 "9002-H1.pdf", "9003-H1.pdf", "9003-H2.pdf",
+                                 "9004-H1.pdf"])
+
+        # ワーカーごとにダウンロード先とブラウザが分かれている
+        download_dirs = {order_number: download for (order_number, download, _) in calls}
+        self.assertNotEqual(download_dirs["9001"], download_dirs["9002"])
+        sessions = {order_number: s for (order_number, _, s) in calls}
+        self.assertIs(sessions["9001"], session)
+        self.assertIsNot(sessions["9002"], session)
+
+    def test_worker_failure(self):
+        (error, _, _, output) = self.run_workers(fail="9003")
+
+        self.assertIsInstance(error, Exception)
+        # 失敗したワーカーも、ほかのワーカーも、登録できた行数を報告する
+        self.assertIn("ワーカー 0: 4 / 4 行を登録 完了", output)
+        self.assertIn("ワーカー 1: 1 / 3 行を登録 失敗: SPL Not Found", output)
+
+    def test_ordered_pdf_files_shared_pdf(self):
+        order = self.orders[0]
+        result = main.ShippingInstructionResult()
+        # まとめて登録した行は同じ PDF を共有する
+        for spl_row in reversed(order.notTBDSPLRows):
+            result.registeredRows.append((order, spl_row, "9001.pdf"))
+        result.registeredRows.insert(0, (self.orders[1],
+                                         self.orders[1].notTBDSPLRows[0],
+                                         "9002.pdf"))
+
+        self.assertEqual(main.ordered_pdf_files(self.orders, result),
+                         ["9001.pdf", "9002.pdf"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,171 @@
+import pickle
+import tempfile
+import unittest
+from datetime import date
+from pathlib import Path
+
+from shipping_instruction.config import PMSFileColumnsConfig
+from shipping_instruction.pms import PMSFile, PMSValidationError
+from tests.fixtures import write_pms_csv
+
+
+class TestPMSFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    USE_MMAP = False
+
+    def read(self) -> PMSFile:
+        return PMSFile(path=self.dir, config=PMSFileColumnsConfig(),
+                       useMmap=self.USE_MMAP)
+
+    def test_group_by_kata_and_hin(self):
+        write_pms_csv(self.dir, [
+            {"kata": "K1", "hin": "H1", "qty": 3},
+            {"kata": "K2", "hin": "H2", "qty": 5},
+            {"kata": "K1", "hin": "H1", "qty": 4},
+            {"kata": "K1", "hin": "H3", "qty": 1},
+            {"kata": "K3", "hin": "H4", "qty": 0},
+        ])
+        pms_file = self.read()
+
+        self.assertEqual(pms_file.instructionNumber, "A001")
+        self.assertEqual(sorted(pms_file.katas), ["K1", "K2", "K3"])
+        self.assertEqual(len(pms_file.partitions), 1)
+        partition = pms_file.partitions[0]
+        self.assertEqual(partition.headCharOfShipmentWarehouse, "N")
+        # 出荷数がゼロの型は対象外
+        self.assertEqual(sorted(partition.pmsRowsOfKata.keys()), ["K1", "K2"])
+
+        k1 = partition.pmsRowsOfKata["K1"]
+        self.assertEqual(k1.shipmentDate, date(2020, 10, 1))
+        self.assertEqual(k1.shipmentQty, 8)
+        self.assertEqual(dict(k1.shipmentQtyOfHin), {"H1": 7, "H3": 1})
+        self.assertEqual(sorted(k1.hins), ["H1", "H3"])
+
+    def test_aggregates_are_fixed(self):
+        write_pms_csv(self.dir, [
+            {"kata": "K1", "hin": "H1", "qty": 3},
+            {"kata": "K1", "hin": "H2", "qty": 4},
+        ])
+        pms_file = self.read()
+        k1 = pms_file.partitions[0].pmsRowsOfKata["K1"]
+        self.assertIs(k1.shipmentQtyOfHin, k1.shipmentQtyOfHin)
+        with self.assertRaises(Exception):
+            k1.shipmentQty = 0  # type: ignore
+
+        # 一括処理でプロセス間を受け渡せること
+        restored: PMSFile = pickle.loads(pickle.dumps(pms_file))
+        self.assertEqual(restored.partitions[0].pmsRowsOfKata["K1"].shipmentQtyOfHin,
+                         {"H1": 3, "H2": 4})
+
+    def test_read_file_path(self):
+        write_pms_csv(self.dir, [{"kata": "K1", "hin": "H1", "qty": 1}],
+                      name="a.csv")
+        path = write_pms_csv(self.dir,
+                             [{"kata": "K2", "hin": "H2", "qty": 2,
+                               "instructionNumber": "B002"}],
+                             name="b.csv")
+        pms_file = PMSFile(path=path, config=PMSFileColumnsConfig(),
+                           useMmap=self.USE_MMAP)
+        self.assertEqual(pms_file.fileName, "b.csv")
+        self.assertEqual(pms_file.instructionNumber, "B002")
+
+    def test_partition_by_date_and_warehouse(self):
+        write_pms_csv(self.dir, [
+            {"kata": "K1", "hin": "H1", "qty": 3},
+            {"kata": "K1", "hin": "H1", "qty": 2, "date": "2020/10/02"},
+            {"kata": "K1", "hin": "H2", "qty": 4, "warehouse": "E09"},
+            {"kata": "K2", "hin": "H3", "qty": 1, "date": "2020/10/02"},
+        ])
+        pms_file = self.read()
+
+        self.assertEqual(
+            [(p.shipmentDate, p.shipmentWarehouse, sorted(p.pmsRowsOfKata))
+             for p in pms_file.partitions],
+            [(date(2020, 10, 1), "E09", ["K1"]),
+             (date(2020, 10, 1), "N05", ["K1"]),
+             (date(2020, 10, 2), "N05", ["K1", "K2"])]
+        )
+
+        partitions_of_site = pms_file.partitionsOfSite
+        self.assertEqual(sorted(partitions_of_site), ["E", "N"])
+        self.assertEqual(len(partitions_of_site["N"]), 2)
+        self.assertEqual(
+            partitions_of_site["E"][0].pmsRowsOfKata["K1"].shipmentQty, 4)
+
+    def test_report_every_violation(self):
+        write_pms_csv(self.dir, [
+            {"kata": "K1", "hin": "H1", "qty": 3},
+            {"kata": "K1", "hin": "H1", "qty": "x"},
+            {"kata": "", "hin": "", "qty": 1, "warehouse": "Z01"},
+            {"kata": "K2", "hin": "H2", "qty": 1, "date": "2020-10-01"},
+        ])
+        with self.assertRaises(PMSValidationError) as cm:
+            self.read()
+
+        C = PMSFileColumnsConfig
+        self.assertEqual(
+            [(v.row, v.column, v.code) for v in cm.exception.violations],
+            [(3, C.SHIPMENT_QTY + 1, "INVALID_SHIPMENT_QTY"),
+             (4, C.SHIPMENT_WAREHOUSE + 1, "UNKNOWN_SHIPMENT_WAREHOUSE"),
+             (4, C.KATA + 1, "EMPTY_KATA"),
+             (4, C.HIN + 1, "EMPTY_HIN"),
+             (5, C.SHIPMENT_DATE + 1, "INVALID_SHIPMENT_DATE")]
+        )
+
+        report = pickle.loads(pickle.dumps(cm.exception)).to_dict()
+        self.assertEqual(report["file"], "pms.csv")
+        self.assertEqual(len(report["violations"]), 5)
+
+    def test_invalid_suffix(self):
+        Path(self.dir).joinpath("pms.txt").write_text("")
+        with self.assertRaises(PMSValidationError) as cm:
+            self.read()
+        self.assertEqual(cm.exception.violations[0].code, "INVALID_SUFFIX")
+
+    def test_no_data(self):
+        write_pms_csv(self.dir, [
+            {"kata": "K1", "hin": "H1", "qty": 0},
+        ])
+        with self.assertRaises(Exception):
+            self.read()
+
+
+class TestPMSFileMmap(TestPMSFile):
+    USE_MMAP = True
+
+    def test_quoted_line(self):
+        write_pms_csv(self.dir, [
+            {"kata": "K1,A", "hin": "品目1", "qty": 3},
+            {"kata": "K2", "hin": "品目2", "qty": 4},
+        ])
+        pms_file = self.read()
+        pms_rows_of_kata = pms_file.partitions[0].pmsRowsOfKata
+        self.assertEqual(dict(pms_rows_of_kata["K1,A"].shipmentQtyOfHin),
+                         {"品目1": 3})
+        self.assertEqual(dict(pms_rows_of_kata["K2"].shipmentQtyOfHin),
+                         {"品目2": 4})
+
+    def test_quoted_newline(self):
+        # 引用符の中の改行で、1 件が複数の行に分かれている
+        write_pms_csv(self.dir, [
+            {"kata": "K1\r\nA", "hin": "品目1", "qty": 3},
+            {"kata": "K2", "hin": "品目2", "qty": 4},
+        ], filler="備考\n2 行目")
+        pms_file = self.read()
+        pms_rows_of_kata = pms_file.partitions[0].pmsRowsOfKata
+        self.assertEqual(sorted(pms_rows_of_kata.keys()), ["K1\r\nA", "K2"])
+        self.assertEqual(dict(pms_rows_of_kata["K1\r\nA"].shipmentQtyOfHin),
+                         {"品目1": 3})
+        self.assertEqual(dict(pms_rows_of_kata["K2"].shipmentQtyOfHin),
+                         {"品目2": 4})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,271 @@
+import tempfile
+import threading
+import time
+import unittest
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+from urllib.parse import parse_qsl
+
+from shipping_instruction import main
+from shipping_instruction.config import DirConfig, PortalConfig
+from shipping_instruction.portal import (PortalClient, PortalError,
+                                         PortalNotSentError)
+
+LOGIN_PAGE = """<html><body>
+<form action="/login" method="post">
+<input type="text" name="sei_login">
+<input type="password" name="sei_passwd">
+<input type="hidden" name="token" value="t0k3n">
+<input type="submit" name="login" value="ログイン">
+</form></body></html>"""
+
+SEARCH_PAGE = """<html><body>
+<form action="/order/search" method="post">
+<input type="hidden" name="mode" value="{mode}">
+<input type="text" name="xmrp_bu_c_rfc_2" value="99">
+<input type="text" name="keiyaku_kaisya_cd_rfc3">
+<input type="checkbox" id="xsotype_k_chk_4-1" name="xsotype_k_chk_4" value="1">
+<input type="checkbox" id="xsotype_k_chk_4-2" name="xsotype_k_chk_4" value="2" checked>
+<select name="sort"><option value="a">A</option><option value="b" selected>B</option></select>
+<input type="submit" name="btn_submit" value="検索">
+<input type="submit" name="btn_clear" value="クリア">
+</form></body></html>"""
+
+RESULT_PAGE = """<html><body>
+<a href="/order/download?mode={mode}">ダウンロード(XLS)</a>
+</body></html>"""
+
+UPLOAD_PAGE = """<html><body>
+<form action="/spl/upload" method="post" enctype="multipart/form-data">
+<input type="hidden" name="kind" value="{kind}">
+<input type="file" name="pms_upfile">
+<input type="submit" name="btn_submit" value="アップロード">
+</form></body></html>"""
+
+
+class StandInPortal(BaseHTTPRequestHandler):
+    # sei_login / btn_submit / ダウンロード(XLS) のページだけを真似たポータル
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/":
+            return self.send_page(LOGIN_PAGE)
+        if not self.logged_in():
+            return self.send_page("forbidden", status=403)
+
+        if path == "/menu":
+            return self.send_page('<frameset><frame name="fr_menu"></frameset>')
+        if path in ("/order/answered", "/order/new"):
+            return self.send_page(SEARCH_PAGE.format(mode=path.split("/")[-1]))
+        if path == "/order/nolink":
+            return self.send_page(SEARCH_PAGE.format(mode="nolink"))
+        if path == "/order/download":
+            mode = dict(parse_qsl(self.path.split("?")[1]))["mode"]
+            return self.send_body(f"xls-{mode}".encode(), "application/vnd.ms-excel",
+                                  {"Content-Disposition": f'attachment; filename="{mode}.xls"'})
+        if path == "/spl/upload":
+            return self.send_page(UPLOAD_PAGE.format(kind="answered"))
+
+        self.send_page("not found", status=404)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.path == "/login":
+            fields = dict(parse_qsl(body.decode()))
+            self.server.requests.append(("login", fields))
+            if (fields.get("sei_login"), fields.get("sei_passwd"), fields.get("token")) \
+                    != ("user", "password", "t0k3n"):
+                return self.send_page(LOGIN_PAGE)
+            return self.send_body(b"", "text/html", {"Location": "/menu",
+                                                     "Set-Cookie": "SID=s3ss10n; Path=/"},
+                                  status=302)
+        if not self.logged_in():
+            return self.send_page("forbidden", status=403)
+
+        if self.path == "/order/search":
+            fields = parse_qsl(body.decode())
+            self.server.requests.append(("search", fields))
+            mode = dict(fields)["mode"]
+            if mode == "nolink":
+                return self.send_page("<p>該当するデータがありません</p>")
+            return self.send_page(RESULT_PAGE.format(mode=mode))
+        if self.path == "/spl/upload":
+            message = BytesParser(policy=HTTP).parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body
+            )
+            parts = {part.get_param("name", header="content-disposition"): part
+                     for part in message.iter_parts()}
+            self.server.requests.append(("upload", parts))
+            if parts["pms_upfile"].get_content() == b"slow":
+                # クライアントのタイムアウトより長くかかる
+                time.sleep(1)
+            if parts["pms_upfile"].get_content() == b"rejected":
+                return self.send_page("<p>エラーがあります</p>")
+            return self.send_page("<p>\n以下のデータを登録しました。</p>")
+
+        self.send_page("not found", status=404)
+
+    def logged_in(self) -> bool:
+        return "SID=s3ss10n" in (self.headers.get("Cookie") or "")
+
+    def send_page(self, html: str, status: int = 200):
+        self.send_body(html.encode("utf-8"), "text/html; charset=utf-8", status=status)
+
+    def send_body(self, body: bytes, contentType: str, headers={}, status: int = 200):
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        for (key, value) in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StandInPortalConfig(PortalConfig):
+    ANSWERED_ORDER_SEARCH_PATH = "order/answered"
+    NEW_ORDER_SEARCH_PATH = "order/nolink"
+    ANSWERED_ORDER_UPLOAD_PATH = "spl/upload"
+
+
+class SlowStandInPortalConfig(StandInPortalConfig):
+    TIMEOUT = 0.3
+
+
+class FakeUser:
+
+    def __init__(self, url: str, password: str = "password"):
+        self.URL = url
+        self.SSO_ID = "user"
+        self.SSO_PASSWORD = password
+
+
+class TestPortalClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StandInPortal)
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/"
+
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def test_download_and_upload(self):
+        with PortalClient(FakeUser(self.url), StandInPortalConfig()) as portal:
+            path = portal.download_order(isNew=False, mrpc="40",
+                                         downloadDir=str(Path(self.tmp.name).joinpath("answered")))
+            self.assertEqual(Path(path).name, "answered.xls")
+            self.assertEqual(Path(path).read_bytes(), b"xls-answered")
+
+            upload = Path(self.tmp.name).joinpath("answered.xls")
+            upload.write_bytes(b"spl rows")
+            self.assertTrue(portal.upload_spl(isNew=False, uploadPath=str(upload)))
+
+            # ログインは 1 回だけで、接続も使いまわす
+            self.assertEqual(portal.connectionCount, 1)
+
+        kinds = [kind for (kind, _) in self.server.requests]
+        self.assertEqual(kinds, ["login", "search", "upload"])
+
+        # ブラウザで入力してボタンを押したときと同じ値を送る
+        search = self.server.requests[1][1]
+        self.assertEqual(search, [("mode", "answered"),
+                                  ("xmrp_bu_c_rfc_2", "40"),
+                                  ("keiyaku_kaisya_cd_rfc3", "32268"),
+                                  ("xsotype_k_chk_4", "1"),
+                                  ("xsotype_k_chk_4", "2"),
+                                  ("sort", "b"),
+                                  ("btn_submit", "検索")])
+
+        parts = self.server.requests[2][1]
+        self.assertEqual(parts["kind"].get_content().strip(), "answered")
+        self.assertEqual(parts["pms_upfile"].get_filename(), "answered.xls")
+        self.assertEqual(parts["pms_upfile"].get_content(), b"spl rows")
+        self.assertIn("btn_submit", parts)
+
+    def test_upload_rejected(self):
+        upload = Path(self.tmp.name).joinpath("answered.xls")
+        upload.write_bytes(b"rejected")
+        error_dir = Path(self.tmp.name).joinpath("error")
+        with PortalClient(FakeUser(self.url), StandInPortalConfig(),
+                          errorDir=str(error_dir)) as portal:
+            self.assertFalse(portal.upload_spl(isNew=False, uploadPath=str(upload)))
+
+        # 弾かれたページを残す
+        pages = list(error_dir.iterdir())
+        self.assertEqual(len(pages), 1)
+        self.assertIn("エラーがあります", pages[0].read_text(encoding="utf-8"))
+
+    def test_upload_timeout_not_resent(self):
+        upload = Path(self.tmp.name).joinpath("answered.xls")
+        upload.write_bytes(b"slow")
+        with PortalClient(FakeUser(self.url), SlowStandInPortalConfig(),
+                          errorDir=self.tmp.name) as portal:
+            # ログインで使った接続を使いまわして送る
+            portal.login()
+            with self.assertRaises(PortalError):
+                portal.upload_spl(isNew=False, uploadPath=str(upload))
+
+        # 送ったあとのタイムアウトでは、アップロードをやり直さない
+        kinds = [kind for (kind, _) in self.server.requests]
+        self.assertEqual(kinds.count("upload"), 1)
+
+    def test_upload_wrapper_falls_back_only_before_sending(self):
+        upload = Path(self.tmp.name).joinpath("answered.xls")
+        upload.write_bytes(b"slow")
+        dir_config = DirConfig()
+        dir_config.ANSWERED_ORDER_OUTPUT_PATH = str(upload)
+        dir_config.NEW_ORDER_OUTPUT_PATH = str(upload)
+        browser_uploads = []
+
+        def upload_spl(isNew, driverConfig, dirConfig, user, session):
+            browser_uploads.append(isNew)
+            return True
+
+        with PortalClient(FakeUser(self.url), SlowStandInPortalConfig(),
+                          errorDir=self.tmp.name) as portal, \
+                mock.patch.object(main, "upload_spl", upload_spl):
+            # 新規受注のページは設定していないので、送る前にブラウザへ切り替える
+            main.upload_spl_wrapper(doAnswered=False, doNew=True, user=None,
+                                    dirConfig=dir_config, portal=portal)
+            self.assertEqual(browser_uploads, [True])
+
+            # サーバが受け取ったあとのタイムアウトでは、ブラウザで送り直さずに止める
+            with self.assertRaises(Exception):
+                main.upload_spl_wrapper(doAnswered=True, doNew=False, user=None,
+                                        dirConfig=dir_config, portal=portal)
+            self.assertEqual(browser_uploads, [True])
+
+        kinds = [kind for (kind, _) in self.server.requests]
+        self.assertEqual(kinds.count("upload"), 1)
+
+    def test_fallback(self):
+        with PortalClient(FakeUser(self.url), StandInPortalConfig()) as portal:
+            # ダウンロードのリンクがない
+            with self.assertRaises(PortalError):
+                portal.download_order(isNew=True, mrpc="40",
+                                      downloadDir=self.tmp.name)
+
+            # ページのパスを設定していない
+            with self.assertRaises(PortalNotSentError):
+                portal.upload_spl(isNew=True, uploadPath="new.xls")
+
+        with PortalClient(FakeUser(self.url, password="wrong"),
+                          StandInPortalConfig()) as portal:
+            with self.assertRaises(PortalError):
+                portal.login()
+
+
+if __name__ == "__main__":
+    unittest.main()